@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+File:             allowlist.py
+Date:             17/10/2026
+Description:      Allowlist engine for the ID checks of the security state machines.
+                  IDs are held in a sorted NumPy int64 array (8 bytes an ID) and found
+                  with a binary search, sorted .npy files are memory mapped rather than
+                  read in. Lists can be limited to some checkpoints or hours of the day
+                  and reloaded from their files while the system is running.
+                  Run "python allowlist.py" to benchmark memory and lookups at 10M IDs
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import datetime
+import threading
+import numpy as np
+import event_notifier as en
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+ID_TYPE = np.int64
+ID_MIN, ID_MAX = np.iinfo(ID_TYPE).min, np.iinfo(ID_TYPE).max
+
+def sorted_ids(ids):
+    """Sorts IDs into an int64 array and drops repeats (a sort is much quicker than
+        np.unique for millions of IDs)"""
+    ids = np.sort(np.asarray(ids, dtype=ID_TYPE).ravel())
+    if len(ids) > 1:
+        ids = ids[np.concatenate(([True], ids[1:] != ids[:-1]))]
+    return ids
+
+def load_ids(path):
+    """Loads IDs from a file as a sorted array without repeats.
+        A .npy file is memory mapped if already sorted, any other file is read as
+        whitespace separated integers, raising ValueError on anything else so a
+        corrupt or half written file is never loaded as a shorter list"""
+    if path.endswith(".npy"):
+        ids = np.load(path, mmap_mode="r")
+        if ids.dtype == ID_TYPE and ids.ndim == 1 and bool(np.all(ids[1:] > ids[:-1])):
+            return ids
+        return sorted_ids(ids)
+    with open(path, "r") as openfile:
+        tokens = openfile.read().split()
+    try:
+        return sorted_ids(np.array(tokens, dtype=ID_TYPE))
+    except (ValueError, OverflowError) as e:
+        raise ValueError(f"{path} is not a list of IDs: {e}") from e
+
+def save_ids(path, ids):
+    """Saves IDs as a sorted .npy file that load_ids can memory map"""
+    temp_path = path + ".tmp.npy"
+    np.save(temp_path, sorted_ids(ids))
+    os.replace(temp_path, path)
+
+def parse_hours(hours):
+    """Turns ("HH:MM", "HH:MM") into minutes of the day, None for all day"""
+    if hours is None:
+        return None
+    start, end = (datetime.time.fromisoformat(hour) for hour in hours)
+    return (start.hour * 60 + start.minute, end.hour * 60 + end.minute)
+
+class Allowlist:
+    """A set of allowed IDs with an optional scope.
+        checkpoints limits the list to those checkpoint ids, hours to a daily window
+        such as ("07:00", "18:00") which may wrap past midnight"""
+    def __init__(self, ids=(), path=None, checkpoints=None, hours=None):
+        self.path = path
+        self.checkpoints = None if checkpoints is None else frozenset(str(c) for c in checkpoints)
+        self.hours = hours
+        self._minutes = parse_hours(hours)
+        self.ids = load_ids(path) if path else sorted_ids(list(ids))
+        self.loaded_mtime = os.path.getmtime(path) if path else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, user_id):
+        """Binary search of the sorted IDs"""
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return False
+        if not ID_MIN <= user_id <= ID_MAX:
+            return False
+        ids = self.ids
+        index = int(ids.searchsorted(user_id))
+        return index < len(ids) and ids[index] == user_id
+
+    def in_scope(self, checkpoint=None, when=None):
+        """Whether the list applies at the checkpoint and time"""
+        if self.checkpoints is not None and str(checkpoint) not in self.checkpoints:
+            return False
+        if self._minutes is None:
+            return True
+        when = datetime.datetime.now() if when is None else when
+        minute = when.hour * 60 + when.minute
+        start, end = self._minutes
+        if start <= end:
+            return start <= minute < end
+        return minute >= start or minute < end
+
+    def reloaded(self):
+        """A new list with the same scope read again from the file, itself if it
+            was not built from a file"""
+        if not self.path:
+            return self
+        return Allowlist(path=self.path, checkpoints=self.checkpoints, hours=self.hours)
+
+    def memory_bytes(self):
+        """Bytes held by the ID array, mapped files are paged in by the OS as needed"""
+        return self.ids.nbytes
+
+class AccessPolicy:
+    """The allowlists consulted by the state machines, an ID is allowed if any list in
+        scope holds it. Lists built from files (or a JSON config of them) can be
+        reloaded, the new lists are built fully before being swapped in so a lookup
+        always sees either the old or the new lists"""
+    def __init__(self, allowlists=(), config_path=None):
+        self.config_path = config_path
+        self.allowlists = tuple(allowlists)
+        self.config_mtime = None
+        self._reload_lock = threading.Lock()
+        if config_path:
+            self.allowlists = self._load_config()
+
+    @classmethod
+    def of(cls, allowable_ids):
+        """Makes a policy from a policy, an Allowlist or an iterable of IDs"""
+        if isinstance(allowable_ids, cls):
+            return allowable_ids
+        if isinstance(allowable_ids, Allowlist):
+            return cls([allowable_ids])
+        return cls([Allowlist(allowable_ids)])
+
+    def _load_config(self):
+        """Builds the lists of the config, a JSON list of {"path", "checkpoints",
+            "hours"} with paths relative to the config file"""
+        config_mtime = os.path.getmtime(self.config_path)
+        with open(self.config_path, "r") as openfile:
+            entries = json.load(openfile)
+        folder = os.path.dirname(os.path.abspath(self.config_path))
+        allowlists = tuple(Allowlist(path=os.path.join(folder, entry["path"]),
+                                     checkpoints=entry.get("checkpoints"),
+                                     hours=entry.get("hours"))
+                           for entry in entries)
+        self.config_mtime = config_mtime
+        return allowlists
+
+    def allows(self, user_id, checkpoint=None, when=None):
+        """Whether the ID is allowed at the checkpoint and time (now if not given)"""
+        return any(user_id in allowlist for allowlist in self.allowlists
+                   if allowlist.in_scope(checkpoint, when))
+
+    def __contains__(self, user_id):
+        return self.allows(user_id)
+
+    def reload(self):
+        """Rebuilds every list from its file and swaps them in, lists given as IDs are
+            kept. Returns False and keeps the current lists if any file fails to load"""
+        with self._reload_lock:
+            try:
+                if self.config_path:
+                    allowlists = self._load_config()
+                else:
+                    allowlists = tuple(allowlist.reloaded() for allowlist in self.allowlists)
+            except (OSError, ValueError, KeyError) as e:
+                en.notify(en.SubscribedEventType.ERROR_EVENT,
+                          logging_level=en.LoggingLevel.ERROR,
+                          error_location=type(self).__name__,
+                          description=f"Allowlist reload failed, keeping current lists: {e}")
+                return False
+            self.allowlists = allowlists
+            return True
+
+    def reload_if_changed(self):
+        """Reloads if the config or any list file has been modified since loading"""
+        is_changed = any(not os.path.exists(allowlist.path) or
+                         os.path.getmtime(allowlist.path) != allowlist.loaded_mtime
+                         for allowlist in self.allowlists if allowlist.path)
+        if self.config_path:
+            is_changed |= os.path.getmtime(self.config_path) != self.config_mtime
+        return self.reload() if is_changed else False
+
+    def stats(self):
+        """Returns the number of lists, IDs and bytes held"""
+        allowlists = self.allowlists
+        return {"lists" : len(allowlists),
+                "ids" : sum(len(allowlist) for allowlist in allowlists),
+                "bytes" : sum(allowlist.memory_bytes() for allowlist in allowlists)}
+
+def benchmark(count=10_000_000, lookups=200_000, seed=0):
+    """Builds a list of count random IDs, returns the time to load it from text and
+        .npy files, its memory against a Python set and the lookup latency"""
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(np.iinfo(np.int32).max, size=count, replace=False).astype(ID_TYPE)
+    results = {"ids" : count}
+    with tempfile.TemporaryDirectory() as folder:
+        text_path = os.path.join(folder, "ids.txt")
+        np.savetxt(text_path, ids, fmt="%d")
+        npy_path = os.path.join(folder, "ids.npy")
+        save_ids(npy_path, ids)
+        start = time.perf_counter()
+        Allowlist(path=text_path)
+        results["text_load_seconds"] = time.perf_counter() - start
+        start = time.perf_counter()
+        allowlist = Allowlist(path=npy_path)
+        results["mapped_load_seconds"] = time.perf_counter() - start
+        results["array_bytes"] = allowlist.memory_bytes()
+        # A set of ints costs its table plus a boxed int object for every ID
+        results["python_set_bytes_estimate"] = (sys.getsizeof(set(range(1024))) // 1024 * 2
+                                                + sys.getsizeof(2 ** 30)) * count
+        probes = np.concatenate([rng.choice(ids, lookups // 2),
+                                 rng.integers(np.iinfo(np.int32).max, ID_MAX,
+                                              lookups - lookups // 2)]).tolist()
+        policy = AccessPolicy([allowlist])
+        start = time.perf_counter()
+        hits = sum(policy.allows(probe) for probe in probes)
+        elapsed = time.perf_counter() - start
+        results["lookup_microseconds"] = elapsed * 1e6 / lookups
+        results["hits"] = hits
+        del allowlist, policy
+    return results
+
+if __name__ == "__main__":
+    # Benchmark 10 million IDs if run "python allowlist.py"
+    print(benchmark())
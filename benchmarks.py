@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""
+File:             benchmarks.py
+Date:             17/10/2026
+Description:      Standalone performance benchmarks, synthetic inputs only so no camera
+                  or other hardware is needed. Covers notifier fan out, event logging
+                  against large existing logs, capture encode and write per codec and
+                  resolution, and state machine transitions.
+                  Results are JSON, compared against a baseline file and the run fails
+                  if any metric is worse than the baseline by more than the threshold.
+                  eg: python benchmarks.py --save-baseline    (on a known good build)
+                      python benchmarks.py --threshold 0.25   (fails on a regression)
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import cv2 as cv
+import numpy as np
+import event_notifier as en
+from event_logger import EventLogger, EventJournal
+from security_camera import Camera
+from image_codec import CaptureCodec
+from security_states import SecurityStateMachine
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+BASELINE_FILE = "benchmark_baseline.json"
+RESOLUTIONS = {"720p" : (720, 1280), "1080p" : (1080, 1920)}
+CODECS = {"png" : CaptureCodec("png"),
+          "jpg" : CaptureCodec("jpg", quality=85),
+          "webp" : CaptureCodec("webp", quality=85)}
+
+def metric(value, unit, higher_is_better=False):
+    """A single benchmark result"""
+    return {"value" : value, "unit" : unit, "higher_is_better" : higher_is_better}
+
+def best_time(function, repeats=5):
+    """The fastest of several timed runs of function, in seconds"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def synthetic_frame(resolution, seed=0):
+    """A BGR frame with gradients, shapes and mild noise, closer to a camera image
+        than flat colour or pure noise for the encoders"""
+    height, width = resolution
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.dstack([(x + y) / 2, np.broadcast_to(x, (height, width)),
+                       np.broadcast_to(y, (height, width))])
+    frame = frame + rng.normal(0, 4, frame.shape)
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+    for _ in range(12):
+        centre = (int(rng.integers(width)), int(rng.integers(height)))
+        cv.circle(frame, centre, int(rng.integers(10, height // 6)),
+                  tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+    return frame
+
+def bench_notifier(subscriber_counts=(1, 10, 100), calls=2000):
+    """Microseconds per notify with N inline subscribers"""
+    results = {}
+    for count in subscriber_counts:
+        functions = [lambda **kwargs: None for _ in range(count)]
+        for function in functions:
+            en.subscribe(en.SubscribedEventType.SECURITY_EVENT, function)
+        try:
+            def notify_all():
+                for _ in range(calls):
+                    en.notify(en.SubscribedEventType.SECURITY_EVENT,
+                              event_id=en.EventTypes.PERSON_DETECTED)
+            elapsed = best_time(notify_all)
+        finally:
+            for function in functions:
+                en.unsubscribe(en.SubscribedEventType.SECURITY_EVENT, function)
+        results[f"notify_{count}_subscribers_us"] = metric(elapsed * 1e6 / calls, "us")
+    return results
+
+def bench_event_logger(existing_counts=(10_000, 100_000), events=2000):
+    """Microseconds per log_event on top of a journal already holding N events, and
+        the ratio between the largest and smallest log, which stays near 1 unless
+        logging has become O(n) in the size of the log"""
+    results = {}
+    per_event = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for count in existing_counts:
+            journal_path = os.path.join(folder, f"events-{count}.jsonl")
+            with open(journal_path, "w") as outfile:
+                for index in range(count):
+                    outfile.write(json.dumps({"event_type" : "EventTypes.PERSON_DETECTED",
+                                              "image_path" : f"event_{index}",
+                                              "event_time" : 1_700_000_000 + index}) + "\n")
+            logger = EventLogger(EventJournal(journal_path,
+                                              os.path.join(folder, f"events-{count}.json")))
+            start = time.perf_counter()
+            for index in range(events):
+                logger.log_event(event_type=en.EventTypes.PERSON_ENTER,
+                                 image_path=f"new_{index}",
+                                 event_time=1_800_000_000 + index)
+            elapsed = time.perf_counter() - start
+            logger.close()
+            per_event[count] = elapsed * 1e6 / events
+            results[f"log_event_{count // 1000}k_existing_us"] = metric(per_event[count], "us")
+    smallest, largest = min(existing_counts), max(existing_counts)
+    results["log_event_scaling_ratio"] = metric(per_event[largest] / per_event[smallest], "x")
+    return results
+
+def bench_capture(resolutions=RESOLUTIONS, codecs=CODECS, captures=10):
+    """Milliseconds to encode and write one capture through Camera.write_frame, per
+        codec and resolution. Each camera reads a short synthetic video file"""
+    results = {}
+    errors = []
+    record_error = lambda **kwargs: errors.append(kwargs.get("description"))
+    en.subscribe(en.SubscribedEventType.ERROR_EVENT, record_error)
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            for resolution_name, resolution in resolutions.items():
+                frames = [synthetic_frame(resolution, seed) for seed in range(captures)]
+                video_path = os.path.join(folder, f"{resolution_name}.avi")
+                writer = cv.VideoWriter(video_path, cv.VideoWriter_fourcc(*"MJPG"), 30,
+                                        (resolution[1], resolution[0]))
+                for frame in frames[:2]:
+                    writer.write(frame)
+                writer.release()
+                for codec_name, codec in codecs.items():
+                    camera = Camera(video_path, codec=codec)
+                    camera.feed_name = f"{resolution_name}-{codec_name}"
+                    event_path = os.path.join(folder, f"event_{resolution_name}_{codec_name}")
+                    os.makedirs(event_path, exist_ok=True)
+                    def write_all():
+                        for frame in frames:
+                            camera.write_frame(event_path, frame)
+                    elapsed = best_time(write_all, repeats=3)
+                    camera.camera_cap.release()
+                    results[f"capture_{codec_name}_{resolution_name}_ms"] = metric(
+                        elapsed * 1000 / captures, "ms")
+    finally:
+        en.unsubscribe(en.SubscribedEventType.ERROR_EVENT, record_error)
+    if errors:
+        raise RuntimeError(f"Captures failed during the benchmark: {errors[0]}")
+    return results
+
+def bench_state_machine(cycles=2000):
+    """Transitions per second of a single machine walking through an entry"""
+    machine = SecurityStateMachine(allowable_ids=[42], print_actions=False)
+    quiet = lambda **kwargs: None
+    en.subscribe(en.SubscribedEventType.SECURITY_EVENT, quiet)
+    try:
+        def run_cycles():
+            for _ in range(cycles):
+                machine.walk_up()
+                machine.open(42)
+                machine.identify()
+                machine.move_on()
+        elapsed = best_time(run_cycles, repeats=3)
+    finally:
+        en.unsubscribe(en.SubscribedEventType.SECURITY_EVENT, quiet)
+    return {"state_machine_transitions_per_second" : metric(cycles * 4 / elapsed,
+                                                            "transitions/s",
+                                                            higher_is_better=True)}
+
+SUITES = {"notifier" : bench_notifier,
+          "event_logger" : bench_event_logger,
+          "capture" : bench_capture,
+          "state_machine" : bench_state_machine}
+
+def run(suites=None):
+    """Runs the named suites (all by default), returns the results document"""
+    metrics = {}
+    for name in suites if suites else SUITES:
+        metrics.update(SUITES[name]())
+    return {"created" : time.time(),
+            "python" : platform.python_version(),
+            "machine" : platform.platform(),
+            "metrics" : metrics}
+
+def compare(results, baseline, threshold=0.2):
+    """Returns the metrics worse than the baseline by more than threshold (0.2 = 20%),
+        as {name: (baseline value, value)}. Metrics missing from either side are skipped"""
+    regressions = {}
+    for name, result in results["metrics"].items():
+        reference = baseline["metrics"].get(name)
+        if reference is None or not reference["value"]:
+            continue
+        change = result["value"] / reference["value"]
+        if result["higher_is_better"]:
+            is_regression = change < 1 - threshold
+        else:
+            is_regression = change > 1 + threshold
+        if is_regression:
+            regressions[name] = (reference["value"], result["value"])
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="LVS Security Benchmarks",
+                                     description="Runs the performance benchmarks")
+    parser.add_argument("--suite", action='append', choices=list(SUITES))
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    # Write these results as the new baseline instead of comparing
+    parser.add_argument("--save-baseline", action='store_true')
+    # Allowed slowdown before a metric fails, 0.2 is 20% worse than the baseline
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--output", required=False)
+    args = parser.parse_args()
+    results = run(args.suite)
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(results, outfile, indent=2)
+    print(json.dumps(results["metrics"], indent=2))
+    if args.save_baseline:
+        with open(args.baseline, "w") as outfile:
+            json.dump(results, outfile, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as openfile:
+            regressions = compare(results, json.load(openfile), args.threshold)
+        for name, (reference, value) in regressions.items():
+            print(f"REGRESSION {name}: {reference:.4g} -> {value:.4g}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} of {args.baseline}")
+    else:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
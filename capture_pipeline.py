@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+File:             capture_pipeline.py
+Date:             17/10/2026
+Description:      Asynchronous capture pipeline.
+                  Security events only snapshot the frame references of each camera,
+                  the encoding and writing of the images and the logging of the event
+                  are queued and handled by a pool of worker threads so the state
+                  machine never waits on the disk
+"""
+
+import queue
+import threading
+import event_notifier as en
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+class CapturePipeline:
+    """Bounded queue of capture jobs worked through by a pool of writer threads.
+        A job is any callable, when the queue is full new jobs are dropped and counted
+        rather than blocking the caller"""
+    def __init__(self, workers=2, max_queue=32):
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._count_lock = threading.Lock()
+        self._is_accepting = True
+        self.workers = [threading.Thread(target=self._work, name=f"capture-{index}", daemon=True)
+                        for index in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, job):
+        """Queues a job without waiting, returns whether it was accepted"""
+        if not self._is_accepting:
+            self._count("dropped")
+            return False
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            self._count("dropped")
+            en.notify(en.SubscribedEventType.ERROR_EVENT,
+                      logging_level=en.LoggingLevel.WARNING,
+                      error_location=type(self).__name__,
+                      description=f"Capture queue full, dropped job ({self.dropped} dropped)")
+            return False
+        self._count("submitted")
+        return True
+
+    def _count(self, counter):
+        """Increments one of the pipeline counters"""
+        with self._count_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _work(self):
+        """Worker loop, runs jobs until it is handed the None sentinel"""
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            try:
+                job()
+                self._count("completed")
+            except Exception as e:
+                self._count("failed")
+                en.notify(en.SubscribedEventType.ERROR_EVENT,
+                          logging_level=en.LoggingLevel.ERROR,
+                          error_location=type(self).__name__,
+                          description=f"Capture job failed: {e}")
+            finally:
+                self.jobs.task_done()
+
+    def queue_depth(self):
+        """The number of jobs waiting to be worked on"""
+        return self.jobs.qsize()
+
+    def stats(self):
+        """Returns the queue depth and job counters of the pipeline"""
+        with self._count_lock:
+            return {"queue_depth" : self.jobs.qsize(),
+                    "submitted" : self.submitted,
+                    "completed" : self.completed,
+                    "failed" : self.failed,
+                    "dropped" : self.dropped}
+
+    def drain(self):
+        """Waits until every queued job has been worked on"""
+        self.jobs.join()
+
+    def shutdown(self, timeout=None):
+        """Stops accepting jobs, finishes the ones already queued and stops the workers"""
+        self._is_accepting = False
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join(timeout)
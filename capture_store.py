@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""
+File:             capture_store.py
+Date:             17/10/2026
+Description:      Content addressed store for event capture images.
+                  Each encoded image is saved once under blobs/ by its SHA-256 hash
+                  and hardlinked into the event folders that use it, so the folders
+                  look the same as before. Every event also gets a manifest under
+                  manifests/ listing the blobs it references, which is what the
+                  reference counts are built from when events are deleted. A blob handed out
+                  by put or pin is pinned until its event is recorded or it is released,
+                  so pruning an older event cannot delete it while it is being saved
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+import event_notifier as en
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+class CaptureStore:
+    """Deduplicating store of capture images kept under root.
+        By default only identical bytes are shared. near_threshold opts in to lossy
+        near duplicate reuse, it is the mean grey level difference (0-255) of a small
+        thumbnail under which a camera's new frame is treated as the same image as its
+        last capture and that capture is linked in its place. A change to a small part
+        of the frame, such as a person entering it, can fall under it, so the saved
+        image may not show what the camera saw at the time"""
+    def __init__(self, root, near_threshold=0):
+        self.root = root
+        self.blob_root = os.path.join(root, "blobs")
+        self.manifest_root = os.path.join(root, "manifests")
+        self.near_threshold = near_threshold
+        self.blobs_written = 0
+        self.blobs_reused = 0
+        self._refcounts = None
+        self._pins = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.blob_root, exist_ok=True)
+        os.makedirs(self.manifest_root, exist_ok=True)
+
+    def blob_path(self, blob_hash, extension):
+        """Where the blob of a hash is kept"""
+        return os.path.join(self.blob_root, blob_hash[:2], blob_hash + extension)
+
+    def put(self, encoded, extension):
+        """Saves the encoded image if it is not already stored, returns its blob id
+            (the hash followed by the extension) pinned until record_event or release"""
+        blob_hash = hashlib.sha256(encoded).hexdigest()
+        blob_id = blob_hash + extension
+        path = self.blob_path(blob_hash, extension)
+        with self._lock:
+            self._pins[blob_id] = self._pins.get(blob_id, 0) + 1
+            if os.path.exists(path):
+                self.blobs_reused += 1
+                return blob_id
+            self.blobs_written += 1
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as outfile:
+            outfile.write(encoded)
+        os.replace(temp_path, path)
+        return blob_id
+
+    def pin(self, blob_id):
+        """Pins a blob already stored for another event until record_event or release,
+            returns False without pinning if it is no longer stored"""
+        with self._lock:
+            if not self._pins.get(blob_id) and not self._load_refcounts().get(blob_id):
+                return False
+            self._pins[blob_id] = self._pins.get(blob_id, 0) + 1
+            return True
+
+    def release(self, blob_id):
+        """Drops a pin from put or pin whose blob was not recorded in an event,
+            deleting the blob if nothing else references or pins it"""
+        with self._lock:
+            self._release(blob_id)
+            if not self._pins.get(blob_id) and not self._load_refcounts().get(blob_id):
+                try:
+                    os.remove(self.blob_path(*self._split(blob_id)))
+                except FileNotFoundError:
+                    pass
+
+    def _release(self, blob_id):
+        """Drops a pin, must be called with the lock held"""
+        pins = self._pins.get(blob_id, 0) - 1
+        if pins > 0:
+            self._pins[blob_id] = pins
+        else:
+            self._pins.pop(blob_id, None)
+
+    def _split(self, blob_id):
+        """Splits a blob id back into its hash and extension"""
+        blob_hash, extension = os.path.splitext(blob_id)
+        return blob_hash, extension
+
+    def link(self, blob_id, destination):
+        """Makes the blob appear at destination, as a hardlink where the file system
+            allows it and a copy where it does not"""
+        source = self.blob_path(*self._split(blob_id))
+        if os.path.lexists(destination):
+            os.remove(destination)
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+
+    def _manifest_path(self, folder):
+        """Manifests are named by a hash of the event folder path"""
+        return os.path.join(self.manifest_root,
+                            hashlib.sha1(folder.encode("utf-8")).hexdigest()[:20] + ".json")
+
+    def record_event(self, folder, files):
+        """Writes the manifest of an event, files maps each image path in the event
+            folder to its blob id. Releases the pin put or pin took on each blob"""
+        with self._lock:
+            try:
+                with open(self._manifest_path(folder), "w") as outfile:
+                    json.dump({"folder" : folder, "files" : files}, outfile)
+                if self._refcounts is not None:
+                    for blob_id in files.values():
+                        self._refcounts[blob_id] = self._refcounts.get(blob_id, 0) + 1
+            finally:
+                for blob_id in files.values():
+                    self._release(blob_id)
+
+    def _load_refcounts(self):
+        """Counts the references to every blob from the manifests, must be called
+            with the lock held"""
+        if self._refcounts is None:
+            self._refcounts = {}
+            for manifest_name in os.listdir(self.manifest_root):
+                with open(os.path.join(self.manifest_root, manifest_name), "r") as openfile:
+                    for blob_id in json.load(openfile)["files"].values():
+                        self._refcounts[blob_id] = self._refcounts.get(blob_id, 0) + 1
+        return self._refcounts
+
+    def refcount(self, blob_id):
+        """The number of events referencing a blob"""
+        with self._lock:
+            return self._load_refcounts().get(blob_id, 0)
+
+    def delete_event(self, folder):
+        """Removes an event folder and its manifest, deleting any blob no other event
+            references or has pinned. Returns the bytes reclaimed from the blob store"""
+        manifest_path = self._manifest_path(folder)
+        files = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as openfile:
+                files = json.load(openfile)["files"]
+        reclaimed = 0
+        with self._lock:
+            refcounts = self._load_refcounts()
+            for blob_id in files.values():
+                refcounts[blob_id] = refcounts.get(blob_id, 1) - 1
+                if refcounts[blob_id] <= 0:
+                    del refcounts[blob_id]
+                    if self._pins.get(blob_id):
+                        continue
+                    path = self.blob_path(*self._split(blob_id))
+                    try:
+                        reclaimed += os.path.getsize(path)
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+        try:
+            shutil.rmtree(folder)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            en.notify(en.SubscribedEventType.ERROR_EVENT,
+                      logging_level=en.LoggingLevel.WARNING,
+                      error_location=type(self).__name__,
+                      description=f"Unable to remove {folder}: {e}")
+        return reclaimed
+
+    def stats(self):
+        """Returns the blob write and reuse counters"""
+        with self._lock:
+            return {"blobs_written" : self.blobs_written, "blobs_reused" : self.blobs_reused}
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+File:             checkpoint_pool.py
+Date:             17/10/2026
+Description:      Pool of named checkpoint sessions, each with its own security state
+                  machine, so one manager can run every gate on a site.
+                  Actions are queued per session and worked through by a shared pool
+                  of threads, a session is only ever run by one thread at a time so its
+                  actions stay in order and a busy gate never holds up another.
+                  Run "python checkpoint_pool.py" to benchmark transitions per second
+"""
+
+import time
+import queue
+import threading
+import collections
+import event_notifier as en
+from allowlist import AccessPolicy
+from security_states import SecurityStateMachine
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+class CheckpointSession:
+    """A checkpoint's state machine and its queue of (action, argument, submitted)
+        commands. running holds (action, submitted, started) of the command being run,
+        as time.monotonic() values"""
+    def __init__(self, checkpoint_id, machine):
+        self.checkpoint_id = checkpoint_id
+        self.machine = machine
+        self.commands = collections.deque()
+        self.is_scheduled = False
+        self.running = None
+        self.processed = 0
+        self.failed = 0
+
+class CheckpointPool:
+    """Hosts any number of checkpoint sessions on a fixed pool of worker threads.
+        Closed sessions hand their machine back to be reset and reused, keeping up to
+        max_idle machines so sessions can be created and recycled cheaply"""
+    def __init__(self, workers=4, allowable_ids=None, max_idle=1024, batch_size=32):
+        # One policy is shared by every session so a reload reaches them all
+        self.allowable_ids = AccessPolicy.of(allowable_ids if allowable_ids is not None else [42, 50])
+        self.max_idle = max_idle
+        self.batch_size = batch_size
+        self.sessions: dict[str: CheckpointSession] = {}
+        self._idle_machines = []
+        self._ready = queue.SimpleQueue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self.workers = [threading.Thread(target=self._work, name=f"checkpoint-{index}", daemon=True)
+                        for index in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def open_session(self, checkpoint_id):
+        """Gets the session of a checkpoint, creating it if needed"""
+        checkpoint_id = str(checkpoint_id)
+        with self._lock:
+            session = self.sessions.get(checkpoint_id)
+            if session:
+                return session
+            machine = self._idle_machines.pop() if self._idle_machines else None
+        if machine is None:
+            machine = SecurityStateMachine(allowable_ids=self.allowable_ids,
+                                           print_actions=False, checkpoint=checkpoint_id)
+        else:
+            machine.reset(checkpoint_id)
+        with self._lock:
+            # Another thread may have opened the same checkpoint in the meantime
+            session = self.sessions.setdefault(checkpoint_id,
+                                               CheckpointSession(checkpoint_id, machine))
+            if session.machine is not machine and len(self._idle_machines) < self.max_idle:
+                self._idle_machines.append(machine)
+            return session
+
+    def close_session(self, checkpoint_id):
+        """Removes a checkpoint's session once its queued actions have run, keeping
+            its machine for reuse"""
+        checkpoint_id = str(checkpoint_id)
+        with self._lock:
+            session = self.sessions.get(checkpoint_id)
+            if session is None:
+                return
+            while session.commands or session.is_scheduled:
+                self._drained.wait()
+            del self.sessions[checkpoint_id]
+            if len(self._idle_machines) < self.max_idle:
+                self._idle_machines.append(session.machine)
+
+    def submit(self, checkpoint_id, action, argument=None):
+        """Queues an action for a checkpoint, opening its session if needed. The
+            session is checked to still be open under the lock close_session takes"""
+        checkpoint_id = str(checkpoint_id)
+        while True:
+            session = self.open_session(checkpoint_id)
+            with self._lock:
+                if self.sessions.get(checkpoint_id) is not session:
+                    # Closed since it was opened, its machine may already be reused
+                    continue
+                session.commands.append((action, argument, time.monotonic()))
+                self._pending += 1
+                if not session.is_scheduled:
+                    session.is_scheduled = True
+                    self._ready.put(session)
+                return
+
+    def _work(self):
+        """Runs a batch of a ready session's commands, putting it back in line if it
+            still has more, until handed the None sentinel"""
+        while True:
+            session = self._ready.get()
+            if session is None:
+                return
+            for _ in range(self.batch_size):
+                with self._lock:
+                    if not session.commands:
+                        break
+                    action, argument, submitted = session.commands.popleft()
+                session.running = (action, submitted, time.monotonic())
+                self._run(session, action, argument)
+            with self._lock:
+                session.running = None
+                if session.commands:
+                    self._ready.put(session)
+                else:
+                    session.is_scheduled = False
+                    self._drained.notify_all()
+
+    def _run(self, session, action, argument):
+        """Calls the action on the session's machine"""
+        try:
+            function = getattr(session.machine, action)
+            function(argument)
+            session.processed += 1
+        except Exception as e:
+            session.failed += 1
+            en.notify(en.SubscribedEventType.ERROR_EVENT,
+                      logging_level=en.LoggingLevel.WARNING,
+                      error_location=type(self).__name__,
+                      description=f"{action} failed at checkpoint {session.checkpoint_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+                if not self._pending:
+                    self._drained.notify_all()
+
+    def backlog(self):
+        """Actions queued or running across every session"""
+        return self._pending
+
+    def drain(self, timeout=None):
+        """Waits until every queued action has run, returns False on timeout"""
+        with self._lock:
+            return self._drained.wait_for(lambda: self._pending == 0, timeout)
+
+    def state(self, checkpoint_id):
+        """The current state of a checkpoint's machine"""
+        return self.sessions[str(checkpoint_id)].machine.current_state_value
+
+    def stats(self):
+        """Returns the session and action counters of the pool"""
+        with self._lock:
+            return {"sessions" : len(self.sessions),
+                    "idle_machines" : len(self._idle_machines),
+                    "pending" : self._pending,
+                    "processed" : sum(session.processed for session in self.sessions.values()),
+                    "failed" : sum(session.failed for session in self.sessions.values())}
+
+    def shutdown(self):
+        """Runs the queued actions and stops the workers"""
+        self.drain()
+        for _ in self.workers:
+            self._ready.put(None)
+        for worker in self.workers:
+            worker.join()
+
+ENTRY_CYCLE = [("walk_up", None), ("open", 42), ("identify", None), ("move_on", None)]
+
+def benchmark(session_counts=(1, 100, 10000), transitions=40000, workers=4):
+    """Runs entry cycles spread across the given numbers of live sessions, returns the
+        transitions per second and the time to build then recycle the sessions"""
+    events = [0]
+    def count_event(**kwargs):
+        events[0] += 1
+    en.subscribe(en.SubscribedEventType.SECURITY_EVENT, count_event)
+    results = []
+    try:
+        for session_count in session_counts:
+            pool = CheckpointPool(workers=workers, allowable_ids=[42])
+            start = time.perf_counter()
+            for index in range(session_count):
+                pool.open_session(f"gate-{index}")
+            setup = time.perf_counter() - start
+            cycles = max(1, transitions // (len(ENTRY_CYCLE) * session_count))
+            start = time.perf_counter()
+            for _ in range(cycles):
+                for index in range(session_count):
+                    for action, argument in ENTRY_CYCLE:
+                        pool.submit(f"gate-{index}", action, argument)
+            pool.drain()
+            elapsed = time.perf_counter() - start
+            # Sessions opened after others close reuse their machines
+            start = time.perf_counter()
+            for index in range(session_count):
+                pool.close_session(f"gate-{index}")
+                pool.open_session(f"reused-{index}")
+            recycle = time.perf_counter() - start
+            pool.shutdown()
+            done = cycles * session_count * len(ENTRY_CYCLE)
+            results.append({"sessions" : session_count,
+                            "transitions" : done,
+                            "transitions_per_second" : done / elapsed,
+                            "setup_seconds" : setup,
+                            "recycle_seconds" : recycle})
+    finally:
+        en.unsubscribe(en.SubscribedEventType.SECURITY_EVENT, count_event)
+    return results
+
+if __name__ == "__main__":
+    # Benchmark 1, 100 and 10,000 live sessions if run "python checkpoint_pool.py"
+    for result in benchmark():
+        print(result)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+File:             display.py
+Date:             17/10/2026
+Description:      The one thread that draws camera feeds on screen.
+                  HighGUI is not thread safe, so rather than every camera calling
+                  imshow and waitKey from its own read loop, the shown feeds are tiled
+                  into a single downscaled mosaic window by the MosaicDisplay at a
+                  capped refresh rate. Each tile is resized straight from the camera's
+                  buffer into a preallocated canvas, and only when the camera has a
+                  new frame, so capture threads never wait on the GUI.
+"""
+
+import math
+import time
+import threading
+import cv2 as cv
+import numpy as np
+import event_notifier as en
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+WINDOW_NAME = "LVS Security"
+ESCAPE_KEY = 27
+
+def grid_shape(count):
+    """Columns and rows of the most square grid holding count tiles"""
+    columns = math.ceil(math.sqrt(count))
+    return columns, math.ceil(count / columns)
+
+class MosaicDisplay(threading.Thread):
+    """Tiles the feeds of every camera with is_showing set into one window, refreshed
+        at most fps times a second on a canvas of canvas_size (width, height).
+        The window closes while no camera is shown, Esc in the window hides them all"""
+    def __init__(self, camera_manager, fps=10.0, canvas_size=(1280, 720),
+                 window_name=WINDOW_NAME):
+        threading.Thread.__init__(self, name="mosaic-display", daemon=True)
+        self.camera_manager = camera_manager
+        self.fps = fps
+        self.canvas_size = canvas_size
+        self.window_name = window_name
+        width, height = canvas_size
+        self.canvas = np.zeros((height, width, 3), dtype=np.uint8)
+        self.tiles = {}
+        self.refreshes = 0
+        self.tiles_drawn = 0
+        self._layout = ()
+        self._sequences = {}
+        self._is_window_open = False
+        self._stop_event = threading.Event()
+
+    def shown_cameras(self):
+        """(name, camera) of every camera to be drawn, in the manager's order"""
+        return [(name, camera) for name, camera in list(self.camera_manager.cameras.items())
+                if camera.is_showing and not camera.is_quitting]
+
+    def _arrange(self, names):
+        """Lays the canvas out in tiles for the named cameras, each tile a view of the
+            canvas so frames are resized straight into it"""
+        self.canvas[:] = 0
+        self.tiles = {}
+        self._sequences = {}
+        self._layout = tuple(names)
+        if not names:
+            return
+        width, height = self.canvas_size
+        columns, rows = grid_shape(len(names))
+        tile_width, tile_height = width // columns, height // rows
+        for index, name in enumerate(names):
+            row, column = divmod(index, columns)
+            top, left = row * tile_height, column * tile_width
+            self.tiles[name] = self.canvas[top:top + tile_height, left:left + tile_width]
+
+    def _draw_tile(self, name, camera):
+        """Resizes the camera's newest frame into its tile, skipped if it has no new
+            frame since the last refresh"""
+        tile = self.tiles[name]
+        sequence = camera.buffer.sequence
+        if sequence == self._sequences.get(name):
+            return False
+        tile_height, tile_width = tile.shape[:2]
+        def fit(frame):
+            # Letterboxed to keep the camera's aspect ratio within the tile
+            frame_height, frame_width = frame.shape[:2]
+            scale = min(tile_width / frame_width, tile_height / frame_height)
+            width = max(1, int(frame_width * scale))
+            height = max(1, int(frame_height * scale))
+            top, left = (tile_height - height) // 2, (tile_width - width) // 2
+            target = tile[top:top + height, left:left + width]
+            if frame.ndim == 2:
+                frame = cv.cvtColor(frame, cv.COLOR_GRAY2BGR)
+            # Linear is several times quicker than area averaging, good enough to preview
+            cv.resize(frame, (width, height), dst=target, interpolation=cv.INTER_LINEAR)
+            return True
+        is_drawn, sequence = camera.buffer.apply_latest(fit)
+        if not is_drawn:
+            return False
+        self._sequences[name] = sequence
+        cv.putText(tile, name, (6, 18), cv.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1,
+                   cv.LINE_AA)
+        self.tiles_drawn += 1
+        return True
+
+    def compose(self):
+        """Brings the canvas up to date with the shown cameras, returns the canvas or
+            None if no camera is shown"""
+        shown = self.shown_cameras()
+        names = tuple(name for name, _ in shown)
+        if names != self._layout:
+            self._arrange(names)
+        if not shown:
+            return None
+        for name, camera in shown:
+            camera.request_frame()
+            self._draw_tile(name, camera)
+        self.refreshes += 1
+        return self.canvas
+
+    def render(self, canvas):
+        """Shows the canvas, or closes the window if there is none. Returns the key
+            pressed"""
+        if canvas is None:
+            if self._is_window_open:
+                cv.destroyWindow(self.window_name)
+                cv.waitKey(1)
+                self._is_window_open = False
+            return -1
+        cv.imshow(self.window_name, canvas)
+        self._is_window_open = True
+        return cv.waitKey(1)
+
+    def run(self):
+        interval = 1 / self.fps
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                key = self.render(self.compose())
+            except cv.error as e:
+                en.notify(en.SubscribedEventType.ERROR_EVENT,
+                          logging_level=en.LoggingLevel.ERROR,
+                          error_location=type(self).__name__,
+                          description=f"Unable to display the cameras: {e}")
+                self.camera_manager.hide_all_cameras()
+                key = -1
+            if key == ESCAPE_KEY:
+                self.camera_manager.hide_all_cameras()
+            self._stop_event.wait(max(0.0, interval - (time.monotonic() - started)))
+        try:
+            self.render(None)
+        except cv.error:
+            pass
+
+    def quit(self):
+        """Closes the window and stops the thread"""
+        self._stop_event.set()
+
+    def stats(self):
+        return {"refreshes" : self.refreshes, "tiles_drawn" : self.tiles_drawn,
+                "shown" : len(self._layout)}
@@ -2,10 +2,25 @@
 """
 File:             event_logger.py
 Date:             3/01/2025
-Description:      Formats and reads/writes all security events to events.json
+Description:      Formats and reads/writes all security events.
+                  Events are appended to a line delimited journal (events.jsonl) so
+                  each new event only writes its own record, the legacy single
+                  document events.json can still be produced through compaction.
+                  Changes to a logged event (such as the repeats debounced into it)
+                  are appended as amendment records {"amends": image_path, ...} and
+                  folded back into their event as the journal is loaded
 """
 
+import os
+import gc
 import json
+import time
+import bisect
+import itertools
+import collections
+import datetime
+import threading
+import event_notifier as en
 
 __author__ = "Benjamin Vernon-Bosley"
 __copyright__ = "Livestock Visibility Solutions"
@@ -16,14 +31,75 @@ __maintainer__ = "Benjamin Vernon-Bosley"
 __email__ = "ben.vernon.bosley@gmail.com"
 __status__ = "Prototype"
 
+JOURNAL_FILE = "events.jsonl"
+LEGACY_FILE = "events.json"
+AMENDS = "amends"
+AMEND_MARKER = b'"amends":'
+# How many of the newest events are searched for the event an amendment is for
+AMEND_REACH = 4096
+MAX_PENDING_AMENDS = 1024
+
+def event_timestamp(event_time):
+    """Converts an event time (epoch seconds, datetime or its string form) into epoch
+        seconds for ordering, times that cannot be read sort before all others"""
+    match event_time:
+        case int() | float():
+            return float(event_time)
+        case datetime.datetime():
+            return event_time.timestamp()
+        case str():
+            try:
+                return float(event_time)
+            except ValueError:
+                pass
+            try:
+                return datetime.datetime.fromisoformat(event_time).timestamp()
+            except ValueError:
+                return float("-inf")
+        case _:
+            return float("-inf")
+
+def write_legacy(legacy_path, event_dicts):
+    """Writes events out as the legacy single document events.json. The document is
+        written to a temporary file and swapped in so readers never see a half
+        written file"""
+    json_object = json.dumps({"events" : list(event_dicts)}, indent=4)
+    temp_path = legacy_path + ".tmp"
+    with open(temp_path, "w") as outfile:
+        outfile.write(json_object)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(temp_path, legacy_path)
+
+def apply_amendments(previous, event_items):
+    """Folds the amendment records in event_items into the events they amend, searching
+        back through event_items then previous as far as AMEND_REACH events, as
+        amend_event does in memory. Returns event_items without them"""
+    events = []
+    for item in event_items:
+        image_path = item.get(AMENDS)
+        if image_path is None:
+            events.append(item)
+            continue
+        fields = {name : value for name, value in item.items() if name != AMENDS}
+        for event in itertools.islice(itertools.chain(reversed(events), reversed(previous)),
+                                      AMEND_REACH):
+            if event.get("image_path") == image_path:
+                event.update(fields)
+                break
+    return events
+
 class EventData:
     """The object an event is created as, mostly represented as a single dictionary"""
-    def __init__(self, event_type, image_path, event_time, **kwargs) -> None:
+    __slots__ = ("event_type", "image_path", "event_time", "timestamp", "event_dict")
+
+    def __init__(self, /, event_type, image_path, event_time, **kwargs) -> None:
 
         # Have these variables accessable for down the line polling
         self.event_type = str(event_type)
         self.image_path = image_path
         self.event_time = event_time
+        self.timestamp = event_timestamp(event_time)
 
         # Populate compulsary arguments in an event
         self.event_dict = {
@@ -36,52 +112,465 @@ class EventData:
         for arg_name, arg_value in kwargs.items():
             self.event_dict.update({arg_name : str(arg_value)})
 
+class EventJournal:
+    """Append only, line delimited JSON store of events. Every record is a single
+        line so writing an event never touches the events before it. Syncing to disk
+        is batched, flushing every fsync_batch records or fsync_interval seconds"""
+    def __init__(self, journal_path=JOURNAL_FILE, legacy_path=LEGACY_FILE,
+                 fsync_batch=16, fsync_interval=1.0):
+        self.journal_path = journal_path
+        self.legacy_path = legacy_path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        # Bytes of records parsed at once while loading
+        self.read_chunk = 1 << 20
+
+    def _open(self):
+        """Opens the journal for appending if it is not already open"""
+        if self._file is None:
+            self._file = open(self.journal_path, "ab")
+        return self._file
+
+    def _report(self, description):
+        """Sends journal problems through to the error logger"""
+        en.notify(en.SubscribedEventType.ERROR_EVENT,
+                  logging_level=en.LoggingLevel.WARNING,
+                  error_location=type(self).__name__,
+                  description=description)
+
+    def append(self, event_dict):
+        """Writes a single event record to the end of the journal"""
+        record = json.dumps(event_dict, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock:
+            journal = self._open()
+            journal.write(record)
+            journal.flush()
+            self._unsynced += 1
+            if (self._unsynced >= self.fsync_batch or
+                    time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync()
+
+    def _sync(self):
+        """Forces written records onto disk, must be called with the lock held"""
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        """Forces any batched records onto disk"""
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        """Syncs and closes the journal file"""
+        with self._lock:
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def load(self):
+        """Streams every event dictionary out of the journal in a single pass.
+            A partially written record at the end of the file (from a crash mid
+            write) is cut off first so later appends start on a clean line. Only the
+            records present when loading starts are read, the lock is not held while
+            reading so events can be appended meanwhile"""
+        if not os.path.exists(self.journal_path):
+            yield from self._migrate_legacy()
+            return
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            end = self._repair_tail()
+        position = 0
+        # The newest AMEND_REACH events are held back until more are read, so
+        # amendments reach as far back as they do in memory however far apart they are
+        previous = collections.deque()
+        with open(self.journal_path, "rb") as openfile:
+            while position < end:
+                lines = openfile.readlines(min(end - position, self.read_chunk))
+                if not lines:
+                    break
+                # One parse of the whole chunk as a JSON array is much quicker than
+                # a parse per line, lines are only parsed alone to find a bad record
+                chunk = b",".join(lines)
+                try:
+                    event_items = json.loads(b"[" + chunk + b"]")
+                except ValueError:
+                    event_items = self._parse_lines(lines, position)
+                for line in lines:
+                    position += len(line)
+                if AMEND_MARKER in chunk:
+                    event_items = apply_amendments(previous, event_items)
+                previous.extend(event_items)
+                while len(previous) > AMEND_REACH:
+                    yield previous.popleft()
+        yield from previous
+
+    def _parse_lines(self, lines, position):
+        """Parses records one at a time, skipping and reporting corrupt ones"""
+        event_items = []
+        for line in lines:
+            try:
+                event_items.append(json.loads(line))
+            except ValueError:
+                self._report(f"Skipping corrupt record at byte {position} "
+                             f"in {self.journal_path}")
+            position += len(line)
+        return event_items
+
+    def _repair_tail(self, chunk_size=65536):
+        """Truncates a partial final record, must be called with the lock held.
+            Only reads back from the end of the file to the last full record and
+            returns the size of the file afterwards"""
+        with open(self.journal_path, "r+b") as openfile:
+            size = openfile.seek(0, os.SEEK_END)
+            good_end = size
+            while good_end > 0:
+                start = max(0, good_end - chunk_size)
+                openfile.seek(start)
+                newline = openfile.read(good_end - start).rfind(b"\n")
+                if newline >= 0:
+                    good_end = start + newline + 1
+                    break
+                good_end = start
+            if good_end < size:
+                self._report(f"Recovered {self.journal_path}, truncating partial "
+                             f"record at byte {good_end}")
+                openfile.truncate(good_end)
+        return good_end
+
+    def _migrate_legacy(self):
+        """Seeds a new journal from the legacy events.json document if one exists"""
+        event_items = []
+        if os.path.exists(self.legacy_path):
+            with open(self.legacy_path, "r") as openfile:
+                event_items = json.load(openfile).get("events", [])
+        with self._lock:
+            with open(self.journal_path, "wb") as outfile:
+                for event_item in event_items:
+                    outfile.write(json.dumps(event_item, separators=(",", ":"))
+                                  .encode("utf-8") + b"\n")
+                outfile.flush()
+                os.fsync(outfile.fileno())
+        yield from event_items
+
+    def truncate(self):
+        """Erases every record in the journal"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            with open(self.journal_path, "wb") as outfile:
+                os.fsync(outfile.fileno())
+            self._unsynced = 0
+
+    def rewrite(self, keep, pause_every=1000, pause=0.001):
+        """Rewrites the journal with only the records keep(event_dict) returns True
+            for, returning how many were removed. The existing records are filtered
+            into a new file without the lock, sleeping for pause every pause_every
+            records to spread the I/O, so appends carry on meanwhile. The lock is only
+            held to copy across records appended since, then swap the files"""
+        if not os.path.exists(self.journal_path):
+            return 0
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            scanned_end = os.path.getsize(self.journal_path)
+        temp_path = self.journal_path + ".tmp"
+        removed = 0
+        with open(self.journal_path, "rb") as openfile, open(temp_path, "wb") as outfile:
+            position = 0
+            for count, line in enumerate(openfile, 1):
+                if position >= scanned_end or not line.endswith(b"\n"):
+                    break
+                position += len(line)
+                try:
+                    is_kept = keep(json.loads(line))
+                except ValueError:
+                    is_kept = False
+                if is_kept:
+                    outfile.write(line)
+                else:
+                    removed += 1
+                if pause and count % pause_every == 0:
+                    time.sleep(pause)
+            with self._lock:
+                if self._file is not None:
+                    self._file.flush()
+                openfile.seek(position)
+                outfile.write(openfile.read())
+                outfile.flush()
+                os.fsync(outfile.fileno())
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                outfile.close()
+                os.replace(temp_path, self.journal_path)
+                self._unsynced = 0
+        return removed
+
+    def compact(self, event_dicts):
+        """Writes the given events out as the legacy single document events.json"""
+        write_legacy(self.legacy_path, event_dicts)
+
 class EventLogger:
     """The handler for reading and writing the events, either from loading or saving from
-        file, or logging them from function calls"""
-    def __init__(self):
+        file, or logging them from function calls.
+        Events are indexed in memory as they are logged, per type and by time, so
+        queries never go back to the file.
+        If lazy the history is loaded in a background thread, events can be logged
+        straight away and reading the events waits for the history"""
+    def __init__(self, journal=None, lazy=False):
         self._event_list = []
-        self.load_events()
+        self._type_index = {}
+        self._time_index = []
+        self._index_lock = threading.Lock()
+        self._pending_amends = {}
+        self._loaded = threading.Event()
+        self.load_seconds = None
+        self.journal = journal if journal else EventJournal()
+        if not lazy:
+            self.load_events()
+            return
+        records = iter(self.journal.load())
+        # Taking the first record fixes where the journal's history ends before any
+        # event is logged, so events logged while loading are never read in twice
+        first = next(records, None)
+        history = itertools.chain([first], records) if first is not None else iter(())
+        threading.Thread(target=self.load_events, args=(history,), name="event-history",
+                         daemon=True).start()
 
-    def load_events(self):
-        """Reads and appends all events from a json file, called primarily through startup
-            so no _event_list reinitialisation is included in this function"""
-        with open('events.json', 'r') as openfile:
-            event_data = json.load(openfile)
-        for event_item in event_data["events"]:
-            event = EventData(**event_item)
-            self._event_list.append(event)
+    def load_events(self, records=None):
+        """Reads all events from the journal, called primarily through startup.
+            The history is indexed with a single sort rather than an insert per event,
+            then swapped in ahead of any events logged while it was loading"""
+        started = time.monotonic()
+        # The collector would otherwise scan the growing history over and over while
+        # millions of events are built, none of which are garbage
+        is_collecting = gc.isenabled()
+        gc.disable()
+        try:
+            event_list = [EventData(**event_item) for event_item in
+                          (self.journal.load() if records is None else records)]
+            time_index = sorted((event.timestamp, position)
+                                for position, event in enumerate(event_list))
+            type_index = {}
+            for entry in time_index:
+                type_index.setdefault(event_list[entry[1]].event_type, []).append(entry)
+            with self._index_lock:
+                for event in self._event_list:
+                    self._index_event(event, event_list, time_index, type_index)
+                self._event_list = event_list
+                self._time_index = time_index
+                self._type_index = type_index
+        finally:
+            if is_collecting:
+                gc.enable()
+            self.load_seconds = time.monotonic() - started
+            self._loaded.set()
+
+    def wait_loaded(self, timeout=None):
+        """Waits for the history to finish loading, returns whether it has"""
+        return self._loaded.wait(timeout)
+
+    @staticmethod
+    def _index_event(event, event_list, time_index, type_index):
+        """Appends an event to a list and its type and time indexes, must hold the lock
+            if they are live. Both indexes hold (timestamp, position) pairs kept in time
+            order"""
+        position = len(event_list)
+        event_list.append(event)
+        entry = (event.timestamp, position)
+        for index in (time_index, type_index.setdefault(event.event_type, [])):
+            if not index or index[-1] <= entry:
+                index.append(entry)
+            else:
+                bisect.insort(index, entry)
 
     def update_event_file(self):
-        """Writes all events into events"""
-        event_dict = self.events_as_dictionaries()
-        json_dict = {"events" : event_dict}
-        json_object = json.dumps(json_dict, indent=4)
-        with open("events.json", "w") as outfile:
-            outfile.write(json_object)
+        """Writes all events into the legacy events.json document"""
+        self.compact()
+
+    def compact(self):
+        """Produces the legacy events.json from the events currently held, for tools
+            that still read the single document format"""
+        self.journal.sync()
+        self.journal.compact(self.events_as_dictionaries())
 
     def purge_file(self):
-        """Erases the json file contents"""
-        # with open('events.json','w'):
-        #     pass
+        """Erases the journal and legacy file contents"""
+        self.wait_loaded()
         self.clear_events()
-        self.update_event_file()
+        self.journal.truncate()
+        self.compact()
+
+    def prune(self, keep, pause=0.001):
+        """Removes every event keep(event_dict) returns False for from memory and
+            the journal, returns the removed event dictionaries.
+            New indexes are built from a copy of the events without the lock, which is
+            only taken to copy the list and to swap in the result along with any
+            events logged in the meantime, so log_event is never held up for long"""
+        self.wait_loaded()
+        with self._index_lock:
+            snapshot = list(self._event_list)
+        event_list, time_index, type_index = [], [], {}
+        removed = []
+        for event in sorted(snapshot, key=lambda event: event.timestamp):
+            if keep(event.event_dict):
+                self._index_event(event, event_list, time_index, type_index)
+            else:
+                removed.append(event.event_dict)
+        if not removed:
+            return []
+        with self._index_lock:
+            for event in self._event_list[len(snapshot):]:
+                self._index_event(event, event_list, time_index, type_index)
+            self._event_list = event_list
+            self._time_index = time_index
+            self._type_index = type_index
+        # Journal records are matched by type, folder and time, as amendments may have
+        # changed the rest since they were written. Newer events are never removed
+        def record_key(event_dict):
+            return (event_dict.get("event_type"), event_dict.get("image_path"),
+                    event_dict.get("event_time"))
+        removed_records = {}
+        for event_dict in removed:
+            key = record_key(event_dict)
+            removed_records[key] = removed_records.get(key, 0) + 1
+        removed_paths = {event_dict.get("image_path") for event_dict in removed}
+        def keep_record(event_dict):
+            if AMENDS in event_dict:
+                return event_dict[AMENDS] not in removed_paths
+            key = record_key(event_dict)
+            if removed_records.get(key, 0) > 0:
+                removed_records[key] -= 1
+                return False
+            return True
+        self.journal.rewrite(keep_record, pause=pause)
+        return removed
 
     def clear_events(self):
         """Clears the logger object list of events"""
-        self._event_list = []
+        with self._index_lock:
+            self._event_list = []
+            self._type_index = {}
+            self._time_index = []
+
+    def log_event(self, /, **kwargs):
+        """Called every event trigger, appends the event to the list and journal"""
+        event = EventData(**kwargs)
+        # Written before it is indexed, so no amendment can reach the journal ahead of it
+        self.journal.append(event.event_dict)
+        with self._index_lock:
+            self._index_event(event, self._event_list, self._time_index, self._type_index)
+            pending = self._pending_amends.pop(event.image_path, None)
+            if pending:
+                event.event_dict.update(pending)
+        if pending:
+            self.journal.append({AMENDS : event.image_path, **pending})
 
-    def log_event(self, **kwargs):
-        """Called every event trigger, appends the event to the list and updates the file"""
-        self._event_list.append(EventData(**kwargs))
-        self.update_event_file()
+    def amend_event(self, image_path, persist=True, **kwargs):
+        """Merges the fields given into the newest logged event saved to image_path,
+            appending an amendment to the journal unless persist is False. Fields for
+            an event still being saved are held until it is logged. Returns whether the
+            event had been logged"""
+        fields = {name : str(value) for name, value in kwargs.items()}
+        with self._index_lock:
+            event = self._find_recent(image_path)
+            if event is None:
+                if (image_path not in self._pending_amends and
+                        len(self._pending_amends) >= MAX_PENDING_AMENDS):
+                    # The oldest is for an event that was most likely never saved
+                    del self._pending_amends[next(iter(self._pending_amends))]
+                self._pending_amends.setdefault(image_path, {}).update(fields)
+                return False
+            event.event_dict.update(fields)
+        if persist:
+            self.journal.append({AMENDS : image_path, **fields})
+        return True
+
+    def _find_recent(self, image_path):
+        """The newest of the last AMEND_REACH events saved to image_path, must be
+            called with the lock held"""
+        for event in itertools.islice(reversed(self._event_list), AMEND_REACH):
+            if event.image_path == image_path:
+                return event
+        return None
 
     def events_as_dictionaries(self):
         """Returns the list of events objects as a list of the object dictionaries"""
+        self.wait_loaded()
         return [event.event_dict for event in self._event_list]
 
     def retrieve_events(self):
         """Reloads the saved events in file and returns event list"""
+        self.wait_loaded()
+        self.journal.sync()
         self.clear_events()
         self.load_events()
         return self.events_as_dictionaries()
+
+    def query(self, event_type=None, start=None, end=None, camera=None,
+              limit=None, offset=0, newest_first=False, **kwargs):
+        """Yields event dictionaries matching every filter given, in time order.
+            event_type selects a per-type index, start and end (inclusive, anything
+            event_timestamp accepts) bisect the time ordered index, camera and any
+            other keyword arguments must equal the optional event arguments"""
+        if camera is not None:
+            kwargs["camera"] = camera
+        filters = {name : str(value) for name, value in kwargs.items()}
+        self.wait_loaded()
+        with self._index_lock:
+            if event_type is None:
+                index = self._time_index
+            else:
+                index = self._type_index.get(str(event_type), [])
+            low = 0 if start is None else bisect.bisect_left(
+                index, event_timestamp(start), key=lambda entry: entry[0])
+            high = len(index) if end is None else bisect.bisect_right(
+                index, event_timestamp(end), key=lambda entry: entry[0])
+            event_list = self._event_list
+            order = range(high - 1, low - 1, -1) if newest_first else range(low, high)
+            if limit is not None:
+                # Only walks as far as the limit, nothing is copied or reversed
+                matched = list(itertools.islice(self._walk(
+                    event_list, (index[entry][1] for entry in order), filters, offset), limit))
+            else:
+                # Everything in range is wanted, copy it and filter without the lock
+                positions = [index[entry][1] for entry in order]
+        if limit is not None:
+            yield from matched
+        else:
+            yield from self._walk(event_list, positions, filters, offset)
+
+    @staticmethod
+    def _walk(event_list, positions, filters, offset):
+        """Yields the event dictionaries at positions matching the filters, after
+            skipping the first offset of them"""
+        skipped = 0
+        for position in positions:
+            event_dict = event_list[position].event_dict
+            if any(event_dict.get(name) != value for name, value in filters.items()):
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            yield event_dict
+
+    def latest(self, count, event_type=None):
+        """Returns the newest count events, optionally of a single type"""
+        return list(self.query(event_type=event_type, limit=count, newest_first=True))
+
+    def close(self):
+        """Flushes any batched writes to disk"""
+        self.journal.close()
+
+if __name__ == "__main__":
+    # Rebuild the legacy events.json from the journal if run "python event_logger.py"
+    EventLogger().compact()
@@ -3,10 +3,15 @@
 File:           event_notifier.py
 Date:           3/01/2025
 Description:    Adds a subscriber observer pattern to the security system.
-                Currently used for general events and Error logging
+                Currently used for general events and Error logging.
+                Subscribers are called inline by default, or can opt in to their own
+                queue and worker thread
 """
 
 import enum
+import time
+import queue
+import threading
 
 __author__ = "Benjamin Vernon-Bosley"
 __copyright__ = "Livestock Visibility Solutions"
@@ -36,25 +41,216 @@ class EventTypes(enum.Enum):
     PERSON_ENTER = 5
     PERSON_DETAINED = 6
 
+class OverflowPolicy(enum.Enum):
+    """What an asynchronous subscriber does with a new event when its queue is full"""
+    BLOCK = 0
+    DROP_OLDEST = 1
+    DROP_NEWEST = 2
+
+# The time.monotonic() the event being delivered on a thread was notified
+_delivery = threading.local()
+
+def notified_at():
+    """When the event a subscriber is handling was notified, for timing how long it
+        waited to be delivered. None outside of a delivery"""
+    return getattr(_delivery, "notified", None)
+
+class Subscriber:
+    """A subscribed function and its delivery counters. Called inline on the
+        notifying thread, the original behaviour"""
+    def __init__(self, function):
+        self.function = function
+        self.delivered = 0
+        self.dropped = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._count_lock = threading.Lock()
+
+    def deliver(self, kwargs):
+        """Runs the subscribed function with the event arguments"""
+        self._call(kwargs)
+
+    def _call(self, kwargs):
+        """Calls the function and records how long it took"""
+        start = time.perf_counter()
+        try:
+            self.function(**kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._count_lock:
+                self.delivered += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+
+    def backlog(self):
+        """Events waiting to be delivered, always none when called inline"""
+        return 0
+
+    def stop(self):
+        """Nothing to stop for inline subscribers"""
+
+    def stats(self):
+        """Returns the delivery counters of the subscriber"""
+        with self._count_lock:
+            return {"subscriber" : getattr(self.function, "__qualname__", repr(self.function)),
+                    "asynchronous" : False,
+                    "delivered" : self.delivered,
+                    "dropped" : self.dropped,
+                    "backlog" : self.backlog(),
+                    "mean_ms" : 1000 * self.total_seconds / self.delivered if self.delivered else 0.0,
+                    "max_ms" : 1000 * self.max_seconds}
+
+class QueuedSubscriber(Subscriber):
+    """A subscriber with its own bounded queue and worker thread, so a slow function
+        never holds up the notifying thread or the other subscribers. Failures are
+        reported through ERROR_EVENT, or printed if event_type is ERROR_EVENT"""
+    def __init__(self, function, max_queue=256, overflow=OverflowPolicy.BLOCK,
+                 event_type=None):
+        super().__init__(function)
+        self.event_type = event_type
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.overflow = overflow
+        self.events = queue.Queue(maxsize=max_queue)
+        self.worker = threading.Thread(target=self._work, daemon=True,
+                                       name=f"subscriber-{getattr(function, '__name__', 'function')}")
+        self.worker.start()
+
+    def deliver(self, kwargs):
+        """Queues the event arguments, applying the overflow policy if the queue is full"""
+        kwargs = (notified_at(), kwargs)
+        match self.overflow:
+            case OverflowPolicy.BLOCK:
+                self.events.put(kwargs)
+            case OverflowPolicy.DROP_NEWEST:
+                try:
+                    self.events.put_nowait(kwargs)
+                except queue.Full:
+                    self._count_drop()
+            case OverflowPolicy.DROP_OLDEST:
+                while True:
+                    try:
+                        self.events.put_nowait(kwargs)
+                        return
+                    except queue.Full:
+                        try:
+                            self.events.get_nowait()
+                            self.events.task_done()
+                            self._count_drop()
+                        except queue.Empty:
+                            pass
+
+    def _count_drop(self):
+        """Counts an event thrown away by the overflow policy"""
+        with self._count_lock:
+            self.dropped += 1
+
+    def _work(self):
+        """Delivers queued events until handed the None sentinel"""
+        while True:
+            item = self.events.get()
+            try:
+                if item is None:
+                    return
+                notified, kwargs = item
+                waited = time.monotonic() - notified
+                with self._count_lock:
+                    self.total_wait_seconds += waited
+                    self.max_wait_seconds = max(self.max_wait_seconds, waited)
+                _delivery.notified = notified
+                self._call(kwargs)
+            except Exception as e:
+                self._report_failure(e)
+            finally:
+                self.events.task_done()
+
+    def _report_failure(self, error):
+        """Reports a failed delivery, printed for ERROR_EVENT subscribers as the failing
+            function could be the error logger itself"""
+        description = f"Subscriber {self.function} failed: {error}"
+        if self.event_type == SubscribedEventType.ERROR_EVENT:
+            print(description)
+            return
+        notify(SubscribedEventType.ERROR_EVENT,
+               logging_level=LoggingLevel.ERROR,
+               error_location=type(self).__name__,
+               description=description)
+
+    def backlog(self):
+        """Events waiting in the queue"""
+        return self.events.qsize()
+
+    def stop(self):
+        """Delivers everything already queued then stops the worker"""
+        self.events.put(None)
+        if self.worker is not threading.current_thread():
+            self.worker.join()
+
+    def stats(self):
+        """Returns the delivery counters of the subscriber"""
+        stats = super().stats()
+        stats["asynchronous"] = True
+        with self._count_lock:
+            stats["mean_wait_ms"] = (1000 * self.total_wait_seconds / self.delivered
+                                     if self.delivered else 0.0)
+            stats["max_wait_ms"] = 1000 * self.max_wait_seconds
+        return stats
+
+# Copy on write registry, notify reads whichever dictionary is current without
+# locking and subscribe/unsubscribe swap in a new one under the lock
 subscribers = {}
+_registry_lock = threading.Lock()
 
-def subscribe(event_type, function):
-    """Add a function to be called once an event type of SubscribedEventType is triggered"""
-    if not event_type in subscribers:
-        subscribers[event_type] = []
-    subscribers[event_type].append(function)
+def subscribe(event_type, function, asynchronous=False, max_queue=256,
+              overflow=OverflowPolicy.BLOCK):
+    """Add a function to be called once an event type of SubscribedEventType is triggered.
+        Asynchronous subscribers are called from their own worker thread through a queue
+        of max_queue events, otherwise the function is called on the notifying thread"""
+    global subscribers
+    if asynchronous:
+        subscriber = QueuedSubscriber(function, max_queue, overflow, event_type)
+    else:
+        subscriber = Subscriber(function)
+    with _registry_lock:
+        updated = dict(subscribers)
+        updated[event_type] = subscribers.get(event_type, ()) + (subscriber,)
+        subscribers = updated
 
 def unsubscribe(event_type, function):
-    """Removes a function linked to a SubscribedEventType event"""
-    if not event_type in subscribers:
-        print("Cannot remove events that dont exist")
-        return
-    subscribers[event_type].remove(function)
+    """Removes a function linked to a SubscribedEventType event, an asynchronous
+        subscriber finishes its queued events first"""
+    global subscribers
+    with _registry_lock:
+        if not event_type in subscribers:
+            print("Cannot remove events that dont exist")
+            return
+        current = subscribers[event_type]
+        matches = [subscriber for subscriber in current if subscriber.function == function]
+        if not matches:
+            raise ValueError(f"{function} is not subscribed to {event_type}")
+        removed = matches[0]
+        updated = dict(subscribers)
+        updated[event_type] = tuple(subscriber for subscriber in current
+                                    if subscriber is not removed)
+        subscribers = updated
+    removed.stop()
 
 def notify(event_type, **kwargs):
     """Calls all SubscribedEventType subscribed functions with the arguments provided"""
-    if not event_type in subscribers:
+    current = subscribers
+    if not event_type in current:
         print("Trying to call event with no subscibers")
         return
-    for function in subscribers[event_type]:
-        function(**kwargs)
+    previous = getattr(_delivery, "notified", None)
+    _delivery.notified = time.monotonic()
+    try:
+        for subscriber in current[event_type]:
+            subscriber.deliver(kwargs)
+    finally:
+        _delivery.notified = previous
+
+def subscriber_stats():
+    """Returns the delivery counters of every subscriber, keyed by event type"""
+    current = subscribers
+    return {event_type : [subscriber.stats() for subscriber in event_subscribers]
+            for event_type, event_subscribers in current.items()}
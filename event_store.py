@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+"""
+File:             event_store.py
+Date:             17/10/2026
+Description:      SQLite backend for the event log, used by EventLogger in place of the
+                  JSONL journal (eg: EventLogger(SQLiteEventStore("events.db"))).
+                  The database runs in WAL mode so reporting tools can read while events
+                  are written, with event_type and event time indexed and the optional
+                  event arguments kept in a JSON column. Writes from concurrent capture
+                  workers are group committed, one transaction for everything queued
+                  while the previous commit was running.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import collections
+import event_notifier as en
+from event_logger import (EventJournal, event_timestamp, write_legacy, JOURNAL_FILE, LEGACY_FILE,
+                          AMENDS)
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+DATABASE_FILE = "events.db"
+DATABASE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+REQUIRED_FIELDS = ("event_type", "image_path", "event_time")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    event_type TEXT NOT NULL,
+    image_path TEXT,
+    event_time,
+    timestamp REAL NOT NULL,
+    arguments TEXT
+);
+CREATE INDEX IF NOT EXISTS events_type_time ON events (event_type, timestamp);
+CREATE INDEX IF NOT EXISTS events_time ON events (timestamp);
+CREATE INDEX IF NOT EXISTS events_path ON events (image_path);
+"""
+
+def event_row(event_dict):
+    """The column values of an event, anything beyond the required fields goes into
+        the arguments JSON"""
+    arguments = {name : value for name, value in event_dict.items()
+                 if name not in REQUIRED_FIELDS}
+    return (event_dict["event_type"], event_dict["image_path"], event_dict["event_time"],
+            event_timestamp(event_dict["event_time"]),
+            json.dumps(arguments, separators=(",", ":")) if arguments else None)
+
+def row_event(event_type, image_path, event_time, arguments):
+    """The event dictionary of a row, the same as it was logged"""
+    event_dict = {"event_type" : event_type, "image_path" : image_path,
+                  "event_time" : event_time}
+    if arguments:
+        event_dict.update(json.loads(arguments))
+    return event_dict
+
+class SQLiteEventStore:
+    """An EventJournal stand in keeping events in an SQLite database.
+        append queues the event for the writer thread and waits for its commit, events
+        appended by other threads meanwhile share the same transaction. synchronous is
+        the SQLite setting, NORMAL only syncs the WAL at checkpoints which keeps every
+        commit through a crash of the program but not always through power loss"""
+    def __init__(self, database_path=DATABASE_FILE, legacy_path=LEGACY_FILE,
+                 synchronous="NORMAL", max_batch=512):
+        self.database_path = database_path
+        self.legacy_path = legacy_path
+        self.synchronous = synchronous
+        self.max_batch = max_batch
+        self.commits = 0
+        self.committed_events = 0
+        is_new = not os.path.exists(database_path)
+        self._db_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._pending = []
+        self._queued = 0
+        self._committed = 0
+        # (first, last, error) of the queue positions of batches that failed to commit,
+        # their waiting appends raise the error
+        self._failures = collections.deque(maxlen=256)
+        self._closed = True
+        self._writer = None
+        self._connection = self._connect()
+        self._connection.executescript(SCHEMA)
+        if is_new:
+            self._migrate_legacy()
+        self._open()
+
+    def _open(self):
+        """Starts the writer, like the journal the store reopens if appended to after
+            closing"""
+        if self._connection is None:
+            self._connection = self._connect()
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name="event-store-writer",
+                                        daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        """A connection in WAL mode, each reader opens its own"""
+        connection = sqlite3.connect(self.database_path, check_same_thread=False,
+                                     isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(f"PRAGMA synchronous={self.synchronous}")
+        return connection
+
+    def _report(self, description):
+        """Sends store problems through to the error logger"""
+        en.notify(en.SubscribedEventType.ERROR_EVENT,
+                  logging_level=en.LoggingLevel.WARNING,
+                  error_location=type(self).__name__,
+                  description=description)
+
+    def _migrate_legacy(self):
+        """Seeds a new database from the JSONL journal beside it, or failing that the
+            legacy events.json"""
+        journal_path = os.path.join(os.path.dirname(self.database_path), JOURNAL_FILE)
+        if os.path.exists(journal_path):
+            journal = EventJournal(journal_path, self.legacy_path)
+            event_dicts = list(journal.load())
+            journal.close()
+        elif os.path.exists(self.legacy_path):
+            with open(self.legacy_path, "r") as openfile:
+                event_dicts = json.load(openfile).get("events", [])
+        else:
+            return
+        if event_dicts:
+            self._insert([event_row(event_dict) for event_dict in event_dicts])
+
+    def _transaction(self, statement, rows=((),)):
+        """Runs a statement for every row in one transaction on the writing connection"""
+        with self._db_lock:
+            if self._connection is None:
+                self._connection = self._connect()
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.executemany(statement, rows)
+                self._connection.execute("COMMIT")
+            except sqlite3.Error:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def _insert(self, rows):
+        self._transaction("INSERT INTO events (event_type, image_path, event_time, timestamp, "
+                          "arguments) VALUES (?, ?, ?, ?, ?)", rows)
+        self.commits += 1
+        self.committed_events += len(rows)
+
+    def _amend(self, amendment):
+        """Merges an amendment record into the arguments of the newest event it is for,
+            once everything queued before it is committed"""
+        fields = {name : value for name, value in amendment.items() if name != AMENDS}
+        self.sync()
+        try:
+            self._transaction("UPDATE events SET arguments = "
+                              "json_patch(COALESCE(arguments, '{}'), ?) WHERE id = "
+                              "(SELECT MAX(id) FROM events WHERE image_path = ?)",
+                              [(json.dumps(fields, separators=(",", ":")), amendment[AMENDS])])
+        except sqlite3.Error as e:
+            self._report(f"Failed to amend {amendment[AMENDS]}: {e}")
+
+    def _write_loop(self):
+        """Commits everything queued as one transaction, until closed"""
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending and self._closed:
+                    return
+                rows = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            error = None
+            try:
+                self._insert(rows)
+            except sqlite3.Error as e:
+                error = e
+                self._report(f"Failed to commit {len(rows)} events: {e}")
+            with self._condition:
+                if error is not None:
+                    self._failures.append((self._committed + 1, self._committed + len(rows),
+                                           error))
+                self._committed += len(rows)
+                self._condition.notify_all()
+
+    def append(self, event_dict, wait=True):
+        """Queues an event for the next commit, waiting for it unless wait is False.
+            Raises the sqlite3.Error if the commit it waited for failed. Amendment
+            records are applied to the event they are for straight away"""
+        if AMENDS in event_dict:
+            self._amend(event_dict)
+            return
+        row = event_row(event_dict)
+        with self._condition:
+            if self._closed:
+                self._open()
+            self._pending.append(row)
+            self._queued += 1
+            position = self._queued
+            self._condition.notify_all()
+            while wait and self._committed < position:
+                self._condition.wait()
+            if wait:
+                for first, last, error in self._failures:
+                    if first <= position <= last:
+                        raise error
+
+    def sync(self):
+        """Waits for every queued event to be committed"""
+        with self._condition:
+            position = self._queued
+            while self._committed < position and self._writer.is_alive():
+                self._condition.wait(0.1)
+
+    def close(self):
+        """Commits anything queued and stops the writer"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._writer.join()
+        with self._db_lock:
+            self._connection.close()
+            self._connection = None
+
+    def load(self):
+        """Streams every event dictionary out of the database in the order logged"""
+        self.sync()
+        connection = self._connect()
+        try:
+            cursor = connection.execute("SELECT event_type, image_path, event_time, arguments "
+                                        "FROM events ORDER BY id")
+            for row in cursor:
+                yield row_event(*row)
+        finally:
+            connection.close()
+
+    def query(self, event_type=None, start=None, end=None, limit=None, newest_first=False):
+        """Reads event dictionaries straight from the indexes in time order, for
+            reporting tools. start and end are inclusive and take any event time"""
+        clauses, parameters = [], []
+        if event_type is not None:
+            clauses.append("event_type = ?")
+            parameters.append(str(event_type))
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            parameters.append(event_timestamp(start))
+        if end is not None:
+            clauses.append("timestamp <= ?")
+            parameters.append(event_timestamp(end))
+        sql = "SELECT event_type, image_path, event_time, arguments FROM events"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY timestamp " + ("DESC" if newest_first else "ASC") + ", id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(int(limit))
+        connection = self._connect()
+        try:
+            return [row_event(*row) for row in connection.execute(sql, parameters)]
+        finally:
+            connection.close()
+
+    def count(self):
+        connection = self._connect()
+        try:
+            return connection.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        finally:
+            connection.close()
+
+    def truncate(self):
+        """Erases every event"""
+        self.sync()
+        self._transaction("DELETE FROM events")
+
+    def rewrite(self, keep, pause_every=1000, pause=0.001):
+        """Deletes the events keep(event_dict) returns False for, returns how many.
+            Events are read and deleted pause_every at a time in separate short
+            transactions so the writer is never held up for long"""
+        self.sync()
+        connection = self._connect()
+        removed = 0
+        last_id = 0
+        try:
+            while True:
+                rows = connection.execute(
+                    "SELECT id, event_type, image_path, event_time, arguments FROM events "
+                    "WHERE id > ? ORDER BY id LIMIT ?", (last_id, pause_every)).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                expired = [(row[0],) for row in rows if not keep(row_event(*row[1:]))]
+                if expired:
+                    self._transaction("DELETE FROM events WHERE id = ?", expired)
+                    removed += len(expired)
+                if pause:
+                    time.sleep(pause)
+        finally:
+            connection.close()
+        return removed
+
+    def compact(self, event_dicts):
+        """Writes the given events out as the legacy single document events.json"""
+        write_legacy(self.legacy_path, event_dicts)
+
+    def stats(self):
+        """Commits made and the events they held, more events than commits means
+            writes were grouped"""
+        return {"commits" : self.commits, "events" : self.committed_events}
+
+def open_store(path=None, legacy_path=LEGACY_FILE):
+    """An SQLiteEventStore for database paths (.db, .sqlite), otherwise an EventJournal"""
+    if path is None:
+        return EventJournal(legacy_path=legacy_path)
+    if path.endswith(DATABASE_EXTENSIONS):
+        return SQLiteEventStore(path, legacy_path=legacy_path)
+    return EventJournal(path, legacy_path=legacy_path)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+File:             frame_buffer.py
+Date:             17/10/2026
+Description:      Fixed memory ring buffer of timestamped camera frames.
+                  The frame slots are allocated once from the first frame read and
+                  reused from then on, the number of slots is capped by both the
+                  seconds of history wanted and a memory budget
+"""
+
+import math
+import time
+import threading
+import collections
+import numpy as np
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+DEFAULT_BUFFER_BYTES = 64 * 1024 * 1024
+
+# A copied frame handed to a consumer, timestamp is seconds since the epoch for matching
+# against events and monotonic is the clock used for frame ages and intervals
+BufferedFrame = collections.namedtuple("BufferedFrame",
+                                       ["frame", "sequence", "timestamp", "monotonic"])
+
+class FrameRingBuffer:
+    """Keeps the last few seconds of frames in preallocated slots.
+        The writer asks for the next slot, reads straight into it and commits it with
+        its timestamp, readers only ever get copies so slots can be reused safely"""
+    def __init__(self, seconds=2.0, max_bytes=DEFAULT_BUFFER_BYTES, fps=30):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.fps = fps if fps and fps > 0 else 30
+        self.capacity = 0
+        self._slots = None
+        self._timestamps = []
+        self._sequences = []
+        self._monotonic = []
+        self._head = 0
+        self._latest = None
+        self.sequence = 0
+        self._lock = threading.Lock()
+        self._written = threading.Condition(self._lock)
+
+    def _allocate(self, frame):
+        """Sizes and allocates every slot to match the shape of the given frame"""
+        # Two slots is the minimum so the newest frame stays readable while the
+        # next one is being read
+        by_time = math.ceil(self.seconds * self.fps)
+        by_memory = self.max_bytes // max(1, frame.nbytes)
+        self.capacity = max(2, min(by_time, by_memory))
+        self._slots = np.empty((self.capacity,) + frame.shape, dtype=frame.dtype)
+        self._timestamps = [None] * self.capacity
+        self._sequences = [0] * self.capacity
+        self._monotonic = [0.0] * self.capacity
+        self._head = 0
+        self._latest = None
+
+    def acquire(self):
+        """Returns the slot to read the next frame into, or None before the first
+            frame has sized the buffer. The slot is taken out of the readable
+            history until it is committed"""
+        with self._lock:
+            if self._slots is None:
+                return None
+            self._timestamps[self._head] = None
+            return self._slots[self._head]
+
+    def commit(self, frame, timestamp, monotonic=None):
+        """Stores the frame read into the acquired slot, copying it in if the read
+            returned a new array (first frame or a change of resolution).
+            Every committed frame is given the next sequence number"""
+        with self._lock:
+            if self._slots is None or self._slots.shape[1:] != frame.shape or \
+                    self._slots.dtype != frame.dtype:
+                self._allocate(frame)
+            slot = self._slots[self._head]
+            if frame is not slot and not np.shares_memory(frame, slot):
+                np.copyto(slot, frame)
+            self.sequence += 1
+            self._timestamps[self._head] = timestamp
+            self._sequences[self._head] = self.sequence
+            self._monotonic[self._head] = time.monotonic() if monotonic is None else monotonic
+            self._latest = self._head
+            self._head = (self._head + 1) % self.capacity
+            self._written.notify_all()
+            return slot
+
+    def _copy(self, index):
+        """Copies a slot out as a BufferedFrame, must be called with the lock held"""
+        return BufferedFrame(self._slots[index].copy(), self._sequences[index],
+                             self._timestamps[index], self._monotonic[index])
+
+    def latest(self):
+        """Returns a BufferedFrame copy of the newest frame, or None if there is none"""
+        with self._lock:
+            if self._latest is None or self._timestamps[self._latest] is None:
+                return None
+            return self._copy(self._latest)
+
+    def latest_age(self):
+        """Seconds since the newest frame was read, None if there is none"""
+        with self._lock:
+            if self._latest is None or self._timestamps[self._latest] is None:
+                return None
+            return time.monotonic() - self._monotonic[self._latest]
+
+    def apply_latest(self, function):
+        """Runs function on the newest frame while it is locked, avoiding a full copy
+            for consumers that shrink or summarise it. Returns the result and the
+            frame's sequence number"""
+        with self._lock:
+            if self._latest is None or self._timestamps[self._latest] is None:
+                return None, None
+            return function(self._slots[self._latest]), self._sequences[self._latest]
+
+    def nearest(self, timestamp):
+        """Returns a BufferedFrame copy of the frame closest in time to the timestamp"""
+        with self._lock:
+            filled = [(abs(slot_time - timestamp), index)
+                      for index, slot_time in enumerate(self._timestamps)
+                      if slot_time is not None]
+            if not filled:
+                return None
+            _, index = min(filled)
+            return self._copy(index)
+
+    def frames(self, start, end):
+        """Returns copies of every buffered (timestamp, frame) between start and end,
+            oldest first"""
+        with self._lock:
+            selected = sorted((slot_time, index)
+                              for index, slot_time in enumerate(self._timestamps)
+                              if slot_time is not None and start <= slot_time <= end)
+            return [(slot_time, self._slots[index].copy()) for slot_time, index in selected]
+
+    def wait_until(self, timestamp, timeout=None):
+        """Blocks until a frame at or after the timestamp has been committed, returns
+            False if the timeout passes first"""
+        with self._lock:
+            return self._written.wait_for(
+                lambda: self._latest is not None and
+                        self._timestamps[self._latest] is not None and
+                        self._timestamps[self._latest] >= timestamp,
+                timeout)
+
+    def wait_for_frame(self, after_sequence=0, timeout=None):
+        """Blocks until a frame newer than after_sequence is committed and returns a
+            BufferedFrame copy of it, or None if the timeout passes first"""
+        with self._lock:
+            is_ready = self._written.wait_for(
+                lambda: self._latest is not None and
+                        self._timestamps[self._latest] is not None and
+                        self._sequences[self._latest] > after_sequence,
+                timeout)
+            if not is_ready:
+                return None
+            return self._copy(self._latest)
+
+    def memory_bytes(self):
+        """The memory held by the frame slots"""
+        return 0 if self._slots is None else self._slots.nbytes
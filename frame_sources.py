@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+"""
+File:             frame_sources.py
+Date:             17/10/2026
+Description:      Virtual camera sources so the system can be load tested without
+                  camera hardware. Each source behaves like the parts of
+                  cv.VideoCapture the cameras use (read, grab, retrieve, get, release)
+                  and is chosen by the camera feed given:
+                      synthetic://gate1?size=1280x720&fps=30   generated frames
+                      loop://videos/yard.avi                   a video file on repeat
+                      images://captures/yard?fps=5             a folder of images
+                  Any source can have faults injected with stall=<probability>,
+                  stall_seconds=, drop=<probability> and fail_after=<reads>.
+                  Run "python frame_sources.py --cameras 64" for a load test
+"""
+
+import os
+import time
+import random
+import argparse
+import tempfile
+import urllib.parse
+import cv2 as cv
+import numpy as np
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
+
+class FrameSource:
+    """Base of the virtual sources, paces frames at fps like a live camera (unless
+        realtime is False) and injects faults.
+        stall is the chance a read hangs for stall_seconds, drop the chance a frame
+        is lost (the read takes an extra frame interval) and after fail_after reads
+        the source stops as if the camera was unplugged"""
+    def __init__(self, name, fps=30, realtime=True, stall=0.0, stall_seconds=1.0,
+                 drop=0.0, fail_after=None, seed=None):
+        self.name = name
+        self.fps = fps if fps and fps > 0 else 30
+        self.realtime = realtime
+        self.stall = stall
+        self.stall_seconds = stall_seconds
+        self.drop = drop
+        self.fail_after = fail_after
+        self.frame_index = -1
+        self.reads = 0
+        self.stalls = 0
+        self.drops = 0
+        self.skipped = 0
+        self._random = random.Random(seed)
+        self._start = None
+        self._is_open = True
+
+    def __str__(self):
+        return self.name
+
+    def isOpened(self):
+        return self._is_open
+
+    def _wait_for_frame(self):
+        """Sleeps until the next frame is due"""
+        if self._start is None:
+            self._start = time.monotonic()
+        if self.realtime:
+            delay = self._start + self.frame_index / self.fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def grab(self):
+        """Moves on to the next frame, returns False once the source has failed"""
+        if not self._is_open:
+            return False
+        if self.fail_after is not None and self.reads >= self.fail_after:
+            self._is_open = False
+            return False
+        self.reads += 1
+        if self.stall and self._random.random() < self.stall:
+            self.stalls += 1
+            time.sleep(self.stall_seconds)
+        self.frame_index += 1
+        self.skipped = 0
+        if self.drop and self._random.random() < self.drop:
+            self.drops += 1
+            self.skipped = 1
+            self.frame_index += 1
+        self._wait_for_frame()
+        return True
+
+    def retrieve(self, image=None):
+        """Decodes the grabbed frame, into image if it is the right shape"""
+        if not self._is_open or self.frame_index < 0:
+            return False, None
+        frame = self._render(image)
+        return frame is not None, frame
+
+    def read(self, image=None):
+        """grab followed by retrieve"""
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def _render(self, image):
+        """Produces the current frame, implemented by each source"""
+        raise NotImplementedError
+
+    def _shape(self):
+        """The (height, width, channels) of the frames"""
+        raise NotImplementedError
+
+    def get(self, prop):
+        """The properties the cameras ask cv.VideoCapture for"""
+        match prop:
+            case cv.CAP_PROP_FPS:
+                return float(self.fps)
+            case cv.CAP_PROP_FRAME_WIDTH:
+                return float(self._shape()[1])
+            case cv.CAP_PROP_FRAME_HEIGHT:
+                return float(self._shape()[0])
+            case cv.CAP_PROP_POS_FRAMES:
+                return float(max(self.frame_index, 0))
+        return 0.0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self._is_open = False
+
+def _output(image, shape):
+    """image if it can take a frame of shape, otherwise a new array"""
+    if image is not None and image.shape == shape and image.dtype == np.uint8:
+        return image
+    return np.empty(shape, dtype=np.uint8)
+
+class GeneratedSource(FrameSource):
+    """Procedural frames, a fixed gradient background with a block crossing it so
+        motion detection and the encoders see a changing image"""
+    def __init__(self, name="synthetic", width=1280, height=720, **settings):
+        super().__init__(name, **settings)
+        x = np.linspace(0, 200, width, dtype=np.float32)
+        y = np.linspace(0, 200, height, dtype=np.float32)[:, None]
+        self.background = np.dstack([(x + y) / 2, np.broadcast_to(x, (height, width)),
+                                     np.broadcast_to(y, (height, width))]).astype(np.uint8)
+        self.block = max(4, height // 8)
+
+    def _shape(self):
+        return self.background.shape
+
+    def _render(self, image):
+        frame = _output(image, self.background.shape)
+        np.copyto(frame, self.background)
+        height, width = frame.shape[:2]
+        left = (self.frame_index * 8) % max(1, width - self.block)
+        top = height // 2 - self.block // 2
+        frame[top:top + self.block, left:left + self.block] = 255
+        return frame
+
+class VideoFileSource(FrameSource):
+    """A video file played on repeat, paced at the file's frame rate unless given"""
+    def __init__(self, path, name=None, fps=None, **settings):
+        self.capture = cv.VideoCapture(path)
+        super().__init__(name if name else os.path.splitext(os.path.basename(path))[0],
+                         fps=fps if fps else self.capture.get(cv.CAP_PROP_FPS), **settings)
+        self._is_open = self.capture.isOpened()
+        self._frame_shape = (int(self.capture.get(cv.CAP_PROP_FRAME_HEIGHT)),
+                             int(self.capture.get(cv.CAP_PROP_FRAME_WIDTH)), 3)
+
+    def _shape(self):
+        return self._frame_shape
+
+    def grab(self):
+        if not super().grab():
+            return False
+        for _ in range(1 + self.skipped):
+            if not self.capture.grab():
+                # The end of the file, go back to the start
+                self.capture.set(cv.CAP_PROP_POS_FRAMES, 0)
+                if not self.capture.grab():
+                    self._is_open = False
+                    return False
+        return True
+
+    def _render(self, image):
+        is_decoded, frame = (self.capture.retrieve() if image is None
+                             else self.capture.retrieve(image))
+        return frame if is_decoded else None
+
+    def release(self):
+        super().release()
+        self.capture.release()
+
+class ImageDirectorySource(FrameSource):
+    """The images of a folder in name order on repeat, each one decoded as it is
+        retrieved and resized to the first image's size"""
+    def __init__(self, path, name=None, fps=5, **settings):
+        super().__init__(name if name else os.path.basename(os.path.normpath(path)),
+                         fps=fps, **settings)
+        self.paths = sorted(os.path.join(path, file_name) for file_name in os.listdir(path)
+                            if file_name.lower().endswith(IMAGE_EXTENSIONS))
+        first = cv.imread(self.paths[0]) if self.paths else None
+        self._is_open = first is not None
+        self._frame_shape = first.shape if first is not None else (0, 0, 3)
+
+    def _shape(self):
+        return self._frame_shape
+
+    def _render(self, image):
+        frame = cv.imread(self.paths[self.frame_index % len(self.paths)])
+        if frame is None:
+            return None
+        if frame.shape != self._frame_shape:
+            frame = cv.resize(frame, (self._frame_shape[1], self._frame_shape[0]))
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return image
+        return frame
+
+SCHEMES = {"synthetic" : GeneratedSource,
+           "loop" : VideoFileSource,
+           "images" : ImageDirectorySource}
+
+def is_virtual(camerafeed):
+    """Whether a camera feed names a virtual source rather than a device or stream"""
+    if isinstance(camerafeed, FrameSource):
+        return True
+    return isinstance(camerafeed, str) and camerafeed.split("://", 1)[0] in SCHEMES
+
+def parse_feed(camerafeed):
+    """Builds the virtual source of a synthetic://, loop:// or images:// feed"""
+    scheme, rest = camerafeed.split("://", 1)
+    location, _, query = rest.partition("?")
+    options = dict(urllib.parse.parse_qsl(query))
+    settings = {}
+    for key, convert in (("fps", float), ("stall", float), ("stall_seconds", float),
+                         ("drop", float), ("fail_after", int), ("seed", int)):
+        if key in options:
+            settings[key] = convert(options.pop(key))
+    if "realtime" in options:
+        settings["realtime"] = options.pop("realtime").lower() not in ("0", "false", "no")
+    if "name" in options:
+        settings["name"] = options.pop("name")
+    if scheme == "synthetic":
+        width, height = options.pop("size", "1280x720").lower().split("x")
+        settings.setdefault("name", location if location else "synthetic")
+        source = GeneratedSource(width=int(width), height=int(height), **settings)
+    else:
+        source = SCHEMES[scheme](location, **settings)
+    if options:
+        raise ValueError(f"Unknown options {', '.join(options)} for {camerafeed}")
+    return source
+
+def open_source(camerafeed):
+    """Opens the frame source of a camera feed, virtual sources for their schemes
+        and cv.VideoCapture for device numbers, files and streams"""
+    if isinstance(camerafeed, FrameSource):
+        return camerafeed
+    if is_virtual(camerafeed):
+        return parse_feed(camerafeed)
+    return cv.VideoCapture(camerafeed)
+
+def feed_name(camerafeed):
+    """The name a camera is shown and saved under, the source name for virtual feeds"""
+    if isinstance(camerafeed, FrameSource):
+        return camerafeed.name
+    if is_virtual(camerafeed):
+        scheme, rest = camerafeed.split("://", 1)
+        location, _, query = rest.partition("?")
+        name = dict(urllib.parse.parse_qsl(query)).get("name")
+        if name:
+            return name
+        if scheme == "synthetic":
+            return location if location else "synthetic"
+        return os.path.splitext(os.path.basename(os.path.normpath(location)))[0]
+    return f"{camerafeed}"
+
+def load_test(cameras=64, size="640x360", fps=15, seconds=10.0, captures=20,
+              use_processes=False, stall=0.0, drop=0.0):
+    """Runs a CameraManager on synthetic cameras, returns its CPU use (of this process
+        only, not camera worker processes), memory, errors reported and the latency of
+        snapshotting and writing a capture of every camera, with the time taken by the
+        snapshot alone and the spread of its frame times"""
+    import event_notifier as en
+    from security_camera import CameraManager
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    feeds = [f"synthetic://cam{index}?size={size}&fps={fps}&stall={stall}&drop={drop}"
+             f"&seed={index}" for index in range(cameras)]
+    errors = []
+    record_error = lambda **kwargs: errors.append(kwargs.get("description"))
+    en.subscribe(en.SubscribedEventType.ERROR_EVENT, record_error)
+    manager = CameraManager(feeds, use_processes=use_processes, buffer_seconds=1.0)
+    cpu_start, wall_start = time.process_time(), time.monotonic()
+    for camera in manager.cameras.values():
+        camera.start()
+    capture_times = []
+    snapshot_times = []
+    spreads = []
+    with tempfile.TemporaryDirectory() as folder:
+        time.sleep(min(1.0, seconds))
+        interval = max(0.0, (seconds - 1.0) / max(1, captures))
+        for index in range(captures):
+            event_path = os.path.join(folder, f"event_{index}")
+            os.makedirs(event_path, exist_ok=True)
+            start = time.perf_counter()
+            frames = manager.snapshot(time.time())
+            snapshot_times.append(time.perf_counter() - start)
+            spreads.append(manager.last_snapshot_spread or 0.0)
+            manager.write_snapshot(event_path, frames)
+            capture_times.append(time.perf_counter() - start)
+            time.sleep(interval)
+    elapsed = time.monotonic() - wall_start
+    cpu = time.process_time() - cpu_start
+    frames = sum(camera.buffer.sequence for camera in manager.cameras.values())
+    buffer_bytes = sum(camera.buffer.memory_bytes() for camera in manager.cameras.values())
+    manager.quit_all()
+    en.unsubscribe(en.SubscribedEventType.ERROR_EVENT, record_error)
+    capture_ms = np.array(capture_times) * 1000
+    return {"cameras" : cameras,
+            "size" : size,
+            "fps" : fps,
+            "frames_per_second" : frames / elapsed,
+            "expected_frames_per_second" : cameras * fps,
+            "cpu_cores" : cpu / elapsed,
+            "buffer_bytes" : buffer_bytes,
+            # ru_maxrss is in kilobytes on Linux, there is no resource module on Windows
+            "max_rss_bytes" : (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+                               if resource else None),
+            "capture_ms_p50" : float(np.percentile(capture_ms, 50)),
+            "capture_ms_p95" : float(np.percentile(capture_ms, 95)),
+            "capture_ms_max" : float(capture_ms.max()),
+            "snapshot_ms_p50" : float(np.percentile(np.array(snapshot_times) * 1000, 50)),
+            "snapshot_spread_ms_max" : max(spreads) * 1000,
+            "errors" : len(errors)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="LVS Security Load Test",
+                                     description="Runs the cameras on synthetic sources")
+    parser.add_argument("--cameras", type=int, default=64)
+    parser.add_argument("--size", default="640x360")
+    parser.add_argument("--fps", type=float, default=15)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--processes", action='store_true')
+    # Fault injection, the chance of a stalled read and of a dropped frame
+    parser.add_argument("--stall", type=float, default=0.0)
+    parser.add_argument("--drop", type=float, default=0.0)
+    args = parser.parse_args()
+    print(load_test(args.cameras, args.size, args.fps, args.seconds,
+                    use_processes=args.processes, stall=args.stall, drop=args.drop))
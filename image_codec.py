@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+File:             image_codec.py
+Date:             17/10/2026
+Description:      Image encoding settings for camera captures.
+                  Each camera can save as PNG, JPEG or WebP with its own quality and
+                  optional downscale, and a frame that has just been encoded is kept
+                  for a short window so simultaneous events reuse the same bytes
+"""
+
+import time
+import threading
+import cv2 as cv
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+class CaptureCodec:
+    """How a camera's captures are encoded.
+        quality is 0-100 for jpg and webp, png_compression is 0-9 and scale shrinks
+        the frame before encoding (1.0 keeps the full resolution), further if it is
+        still wider than max_width pixels"""
+    def __init__(self, image_format="png", quality=90, png_compression=3, scale=1.0,
+                 max_width=None):
+        self.image_format = image_format.lower().lstrip(".")
+        if self.image_format == "jpeg":
+            self.image_format = "jpg"
+        if self.image_format not in ("png", "jpg", "webp"):
+            raise ValueError(f"Unsupported image format {image_format}")
+        self.quality = quality
+        self.png_compression = png_compression
+        self.scale = scale
+        self.max_width = max_width
+
+    @property
+    def extension(self):
+        """The file extension, including the dot"""
+        return "." + self.image_format
+
+    def parameters(self):
+        """The OpenCV encoder parameters for the format"""
+        match self.image_format:
+            case "jpg":
+                return [cv.IMWRITE_JPEG_QUALITY, int(self.quality)]
+            case "webp":
+                return [cv.IMWRITE_WEBP_QUALITY, int(self.quality)]
+            case _:
+                return [cv.IMWRITE_PNG_COMPRESSION, int(self.png_compression)]
+
+    def key(self):
+        """Identifies the settings, frames encoded with equal keys are interchangeable"""
+        return (self.image_format, self.quality, self.png_compression, self.scale,
+                self.max_width)
+
+    def encode(self, frame):
+        """Encodes a frame into the bytes of an image file"""
+        scale = self.scale
+        if self.max_width and frame.shape[1] * scale > self.max_width:
+            scale = self.max_width / frame.shape[1]
+        if scale != 1.0:
+            frame = cv.resize(frame, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+        is_encoded, encoded = cv.imencode(self.extension, frame, self.parameters())
+        if not is_encoded:
+            raise cv.error(f"Could not encode frame as {self.image_format}")
+        return encoded.tobytes()
+
+class EncodeCache:
+    """Remembers recently encoded frames by their sequence number for window seconds.
+        If a second event asks for a frame that is still being encoded it waits for
+        that encode rather than starting another"""
+    def __init__(self, window=2.0):
+        self.window = window
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Forgets every encoded frame, for when sequence numbers start over"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_encode(self, sequence, codec, frame):
+        """Returns the encoded bytes of the frame, encoding it only if needed"""
+        key = (sequence, codec.key())
+        now = time.monotonic()
+        with self._lock:
+            for old_key, (created, _, _) in list(self._entries.items()):
+                if now - created > self.window:
+                    del self._entries[old_key]
+            entry = self._entries.get(key)
+            is_owner = entry is None
+            if is_owner:
+                entry = (now, threading.Event(), [None])
+                self._entries[key] = entry
+                self.misses += 1
+            else:
+                self.hits += 1
+        _, is_done, result = entry
+        if not is_owner:
+            is_done.wait()
+            if result[0] is not None:
+                return result[0]
+            return codec.encode(frame)
+        try:
+            result[0] = codec.encode(frame)
+            return result[0]
+        finally:
+            if result[0] is None:
+                with self._lock:
+                    self._entries.pop(key, None)
+            is_done.set()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+"""
+File:             ingest.py
+Date:             17/10/2026
+Description:      Local ingest server for triggers from external sensors and devices.
+                  Sensors connect over TCP and send one trigger a line, either a JSON
+                  object {"event": "PERSON_DETECTED", "sensor": "gate-1"} or the event
+                  name followed by key=value fields, eg: PERSON_DETECTED sensor=gate-1
+                  Every line is answered "ok" or "error: <reason>". Connections are
+                  served by asyncio on one thread, valid triggers are handed to
+                  dispatcher threads (SecurityManager.trigger_event) through a bounded
+                  hand off. When it is full the server stops reading from the sensors,
+                  so the backpressure reaches them through TCP.
+                  Run "python ingest.py" to load test against a stand in handler
+"""
+
+import json
+import time
+import queue
+import socket
+import asyncio
+import argparse
+import threading
+import numpy as np
+import event_notifier as en
+from metrics import Histogram
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+MAX_LINE_BYTES = 4096
+MAX_FIELDS = 16
+MAX_VALUE_LENGTH = 256
+# Set by the manager, logger or storm control, or parameter names of the functions the
+# fields are passed on to, a sensor can not supply them
+RESERVED_FIELDS = frozenset(("event", "event_id", "event_type", "image_path", "event_time",
+                             "amends", "self", "repeats", "last_repeat"))
+
+def parse_trigger(line):
+    """Returns the (EventTypes, fields) of a trigger line, raises ValueError if it is
+        not a valid trigger"""
+    text = line.decode("utf-8").strip() if isinstance(line, bytes) else line.strip()
+    if text.startswith("{"):
+        record = json.loads(text)
+        if not isinstance(record, dict) or "event" not in record:
+            raise ValueError("JSON triggers need an \"event\"")
+        name = record.pop("event")
+        fields = record
+    else:
+        name, *pairs = text.split()
+        fields = {}
+        for pair in pairs:
+            key, separator, value = pair.partition("=")
+            if not separator:
+                raise ValueError(f"Field {pair!r} is not key=value")
+            fields[key] = value
+    try:
+        event_id = en.EventTypes[str(name).upper()]
+    except KeyError:
+        raise ValueError(f"Unknown event {name!r}") from None
+    if event_id is en.EventTypes.INVALID:
+        raise ValueError("INVALID is not a trigger")
+    if len(fields) > MAX_FIELDS:
+        raise ValueError(f"More than {MAX_FIELDS} fields")
+    for key, value in fields.items():
+        if not str(key).isidentifier() or key in RESERVED_FIELDS:
+            raise ValueError(f"Field name {key!r} is not allowed")
+        if not isinstance(value, (str, int, float, bool)) or len(str(value)) > MAX_VALUE_LENGTH:
+            raise ValueError(f"Field {key} must be a short string or number")
+    return event_id, {key : str(value) for key, value in fields.items()}
+
+class IngestServer(threading.Thread):
+    """Serves the line protocol on a local port in a daemon thread, calling
+        handler(event_id, **fields) for every valid trigger on one of dispatch_workers
+        threads. No more than max_pending triggers wait for a dispatcher, reading
+        stops on every connection until one is free. Port 0 picks a free port"""
+    def __init__(self, handler, port=9300, host="127.0.0.1", max_pending=1024,
+                 dispatch_workers=2):
+        threading.Thread.__init__(self, name="ingest-server", daemon=True)
+        self.handler = handler
+        self.max_pending = max_pending
+        # Bound here so the port is known, and taken, before the thread starts
+        self._socket = socket.create_server((host, port))
+        self.port = self._socket.getsockname()[1]
+        self.accepted = 0
+        self.rejected = 0
+        self.handled = 0
+        self.failed = 0
+        self.connections = 0
+        self.backpressure_waits = 0
+        # Time from a line being read to its handler returning
+        self.latency = Histogram()
+        self._pending = queue.Queue()
+        self._loop = asyncio.new_event_loop()
+        self._slots = None
+        self._stopping = None
+        self._connections = set()
+        self._dispatchers = [threading.Thread(target=self._dispatch, daemon=True,
+                                              name=f"ingest-dispatch-{index}")
+                             for index in range(dispatch_workers)]
+        for dispatcher in self._dispatchers:
+            dispatcher.start()
+
+    def run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
+
+    async def _serve(self):
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._stopping = asyncio.Event()
+        server = await asyncio.start_server(self._handle_connection, sock=self._socket,
+                                            limit=MAX_LINE_BYTES)
+        async with server:
+            await self._stopping.wait()
+            server.close()
+            connections = list(self._connections)
+            for connection in connections:
+                connection.cancel()
+            await asyncio.gather(*connections, return_exceptions=True)
+            await server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        """Reads triggers from one sensor connection until it closes"""
+        self.connections += 1
+        self._connections.add(asyncio.current_task())
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Longer than MAX_LINE_BYTES, the rest of the stream can't be trusted
+                    writer.write(b"error: line too long\n")
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                received = time.monotonic()
+                try:
+                    event_id, fields = parse_trigger(line)
+                except ValueError as e:
+                    self.rejected += 1
+                    writer.write(f"error: {e}\n".encode("utf-8"))
+                    continue
+                if self._slots.locked():
+                    self.backpressure_waits += 1
+                await self._slots.acquire()
+                self._pending.put((event_id, fields, received))
+                self.accepted += 1
+                writer.write(b"ok\n")
+                # Only wait on a sensor that isn't reading its answers
+                if writer.transport.get_write_buffer_size() > 65536:
+                    await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # Cancelled when the server stops, the connection just closes
+            pass
+        finally:
+            self._connections.discard(asyncio.current_task())
+            writer.close()
+
+    def _dispatch(self):
+        """Hands queued triggers to the handler until given None"""
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            event_id, fields, received = item
+            try:
+                self.handler(event_id, **fields)
+                self.handled += 1
+            except Exception as e:
+                self.failed += 1
+                en.notify(en.SubscribedEventType.ERROR_EVENT,
+                          logging_level=en.LoggingLevel.WARNING,
+                          error_location=type(self).__name__,
+                          description=f"Trigger {event_id.name} failed: {e}")
+            self.latency.observe(time.monotonic() - received)
+            try:
+                self._loop.call_soon_threadsafe(self._slots.release)
+            except RuntimeError:
+                # The loop has already stopped
+                pass
+
+    def quit(self):
+        """Stops accepting, then lets the dispatchers finish what is queued"""
+        if self.is_alive():
+            self._loop.call_soon_threadsafe(self._stopping.set)
+            self.join()
+        else:
+            self._socket.close()
+        for _ in self._dispatchers:
+            self._pending.put(None)
+        for dispatcher in self._dispatchers:
+            dispatcher.join()
+
+    def stats(self):
+        return {"connections" : self.connections,
+                "accepted" : self.accepted,
+                "rejected" : self.rejected,
+                "handled" : self.handled,
+                "failed" : self.failed,
+                "pending" : self._pending.qsize(),
+                "backpressure_waits" : self.backpressure_waits,
+                "latency" : self.latency.summary()}
+
+async def _sensor(host, port, messages, window, latencies):
+    """A stand in sensor sending messages triggers, no more than window unanswered"""
+    reader, writer = await asyncio.open_connection(host, port)
+    sent_times = []
+    answered = 0
+    async def read_answers():
+        nonlocal answered
+        while answered < messages:
+            line = await reader.readline()
+            if not line:
+                return
+            latencies.append(time.monotonic() - sent_times[answered])
+            answered += 1
+    answers = asyncio.ensure_future(read_answers())
+    for index in range(messages):
+        while len(sent_times) - answered >= window:
+            await asyncio.sleep(0)
+        sent_times.append(time.monotonic())
+        writer.write(f"PERSON_DETECTED sensor=load-{port} index={index}\n".encode("utf-8"))
+        if index % window == window - 1:
+            await writer.drain()
+    await writer.drain()
+    await answers
+    writer.close()
+
+def load_test(connections=100, messages=200, window=32, work_seconds=0.0, max_pending=1024,
+              dispatch_workers=2):
+    """Runs a server with a stand in handler that takes work_seconds a trigger against
+        connections concurrent sensors each sending messages triggers. Returns the
+        throughput and the answer and handling latencies in milliseconds"""
+    handled = []
+    def handler(event_id, **fields):
+        if work_seconds:
+            time.sleep(work_seconds)
+        handled.append(event_id)
+    server = IngestServer(handler, port=0, max_pending=max_pending,
+                          dispatch_workers=dispatch_workers)
+    server.start()
+    latencies = []
+    async def run_sensors():
+        await asyncio.gather(*(_sensor("127.0.0.1", server.port, messages, window, latencies)
+                               for _ in range(connections)))
+    start = time.monotonic()
+    asyncio.run(run_sensors())
+    answered = time.monotonic() - start
+    server.quit()
+    elapsed = time.monotonic() - start
+    values = np.array(latencies) * 1000
+    stats = server.stats()
+    return {"triggers" : connections * messages,
+            "handled" : len(handled),
+            "triggers_per_second" : len(handled) / elapsed,
+            "answered_per_second" : len(latencies) / answered,
+            "answer_p50_ms" : float(np.percentile(values, 50)),
+            "answer_p99_ms" : float(np.percentile(values, 99)),
+            "handled_latency" : stats["latency"],
+            "backpressure_waits" : stats["backpressure_waits"]}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="LVS Ingest Load Test",
+                                     description="Load tests the ingest server locally")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--window", type=int, default=32)
+    # Seconds the stand in handler takes a trigger, to see backpressure
+    parser.add_argument("--work", type=float, default=0.0)
+    parser.add_argument("--max-pending", type=int, default=1024)
+    args = parser.parse_args()
+    print(json.dumps(load_test(args.connections, args.messages, args.window, args.work,
+                               args.max_pending), indent=2))
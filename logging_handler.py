@@ -4,9 +4,16 @@ File:             logging_handler.py
 Date:             4/01/2025
 Description:      Logging handler using logging
                   Adds the logging module to the event handler and adds
-				  some extra formatting and commands
+				  some extra formatting and commands.
+				  Records are handed to a queue and written by a listener thread, so
+				  the thread raising an error never waits on the disk. The log file
+				  rotates by size or time and repeats of the same message are collapsed
 """
+import json
+import queue
 import logging
+import logging.handlers
+import datetime
 import event_notifier as en
 
 __author__ = "Benjamin Vernon-Bosley"
@@ -19,11 +26,92 @@ __email__ = "ben.vernon.bosley@gmail.com"
 __status__ = "Prototype"
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(filename='errors.log',
-					encoding='utf-8',
-					level=logging.DEBUG,
-					format='%(asctime)s %(message)s',
-					datefmt='%m/%d/%Y %I:%M:%S %p')
+logger.setLevel(logging.DEBUG)
+logger.propagate = False
+
+LOG_FILE = 'errors.log'
+TEXT_FORMAT = '%(asctime)s %(message)s'
+DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+listener = None
+
+class JsonLinesFormatter(logging.Formatter):
+	"""Formats each record as a single line JSON object"""
+	def format(self, record):
+		entry = {"time" : datetime.datetime.fromtimestamp(record.created).isoformat(),
+				 "level" : record.levelname,
+				 "message" : record.getMessage()}
+		for field in ("error_location", "description", "repeat_count"):
+			if hasattr(record, field):
+				entry[field] = str(getattr(record, field))
+		return json.dumps(entry)
+
+class SuppressingHandler(logging.Handler):
+	"""Wraps the file handler, the first of a message is written straight away and
+		identical messages within window seconds are only counted. Once the window
+		ends a single line with the count is written in their place"""
+	def __init__(self, target, window=1.0):
+		super().__init__()
+		self.target = target
+		self.window = window
+		# Message key to [window start, suppressed count, last suppressed record]
+		self.recent = {}
+
+	def emit(self, record):
+		self.flush_expired(record.created)
+		key = (record.levelno, record.getMessage())
+		if key in self.recent:
+			self.recent[key][1] += 1
+			self.recent[key][2] = record
+			return
+		self.recent[key] = [record.created, 0, None]
+		self.target.handle(record)
+
+	def flush_expired(self, now=None):
+		"""Writes the repeat count line for every window that has ended"""
+		now = datetime.datetime.now().timestamp() if now is None else now
+		for key, (started, count, last_record) in list(self.recent.items()):
+			if now - started >= self.window:
+				del self.recent[key]
+				if count:
+					self.target.handle(self._summary(last_record, count))
+
+	def _summary(self, record, count):
+		"""Copies the last suppressed record with the repeat count added"""
+		summary = logging.makeLogRecord(record.__dict__)
+		summary.msg = f"{record.getMessage()} (repeated {count} times)"
+		summary.args = None
+		summary.repeat_count = count
+		return summary
+
+	def flush(self):
+		self.flush_expired(float("inf"))
+		self.target.flush()
+
+	def close(self):
+		self.flush()
+		self.target.close()
+		super().close()
+
+class SuppressingQueueListener(logging.handlers.QueueListener):
+	"""Queue listener that wakes at least every flush_interval seconds so the repeat
+		counts are written even when no new records arrive"""
+	def __init__(self, log_queue, handler, flush_interval=1.0):
+		super().__init__(log_queue, handler)
+		self.flush_interval = flush_interval
+
+	def dequeue(self, block):
+		while True:
+			try:
+				return self.queue.get(block, timeout=self.flush_interval)
+			except queue.Empty:
+				for handler in self.handlers:
+					handler.flush_expired()
+
+	def stop(self):
+		super().stop()
+		for handler in self.handlers:
+			handler.close()
 
 def handle_error(logging_level, error_location, description):
 	"""Classifies the log type and runs the appropriate type, used as an
@@ -45,13 +133,48 @@ def handle_error(logging_level, error_location, description):
 						description=f"Invalid Logging Level supplied {logging_level}")
 			return
 	log_msg = f"{description} at {error_location}"
-	log_type(log_msg)
+	log_type(log_msg, extra={"error_location" : error_location,
+							 "description" : description})
 
 def purge_logs():
 	"""Erases the contents of the log file, for use in unit tests"""
-	with open('errors.log','w'):
+	with open(LOG_FILE,'w'):
 		pass
 
-def logging_init():
-	"""Enables logging to add itself to the subscribers"""
+def logging_init(log_file=LOG_FILE, max_bytes=5 * 1024 * 1024, backup_count=5,
+				 when=None, json_lines=False, suppress_window=1.0):
+	"""Enables logging to add itself to the subscribers.
+		The log rotates once it reaches max_bytes, or on the time interval given by
+		when (see TimedRotatingFileHandler) if supplied, keeping backup_count old files.
+		json_lines writes structured records rather than plain text"""
+	global listener, LOG_FILE
+	if listener is None:
+		LOG_FILE = log_file
+		if when:
+			file_handler = logging.handlers.TimedRotatingFileHandler(
+				log_file, when=when, backupCount=backup_count, encoding='utf-8', delay=True)
+		else:
+			file_handler = logging.handlers.RotatingFileHandler(
+				log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8',
+				delay=True)
+		if json_lines:
+			file_handler.setFormatter(JsonLinesFormatter())
+		else:
+			file_handler.setFormatter(logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT))
+		log_queue = queue.SimpleQueue()
+		logger.addHandler(logging.handlers.QueueHandler(log_queue))
+		listener = SuppressingQueueListener(log_queue,
+											SuppressingHandler(file_handler, suppress_window),
+											flush_interval=max(0.1, suppress_window))
+		listener.start()
 	en.subscribe(en.SubscribedEventType.ERROR_EVENT, handle_error)
+
+def logging_shutdown():
+	"""Unsubscribes from errors and writes out everything still queued"""
+	global listener
+	en.unsubscribe(en.SubscribedEventType.ERROR_EVENT, handle_error)
+	if listener is not None:
+		listener.stop()
+		logger.handlers = [handler for handler in logger.handlers
+						   if not isinstance(handler, logging.handlers.QueueHandler)]
+		listener = None
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+"""
+File:             metrics.py
+Date:             17/10/2026
+Description:      Runtime metrics for the cameras, events and subscribers.
+                  Cameras count their reads into a CameraStats as they go and events
+                  time each stage from notify to saved into histograms, both are
+                  cheap enough to stay on in the read loops. collect gathers everything
+                  for the stats command, render_prometheus formats it for the optional
+                  MetricsServer, eg: curl http://127.0.0.1:9108/metrics
+                  StartupTimer breaks down how long the manager took to start.
+"""
+
+import time
+import bisect
+import threading
+import contextlib
+import event_notifier as en
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+# Upper bounds in seconds, from a fast frame read up to a slow event save
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+EVENT_STAGES = ("trigger", "capture", "persist", "total")
+
+class Histogram:
+    """Counts of observations under each bucket's upper bound, plus their sum"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def cumulative(self):
+        """(upper bound, observations at or under it) for each bucket and +Inf"""
+        with self._lock:
+            counts = list(self.counts)
+        total = 0
+        bounds = []
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            total += count
+            bounds.append((bound, total))
+        return bounds
+
+    def quantile(self, fraction):
+        """Estimates a quantile as the upper bound of the bucket it falls in"""
+        bounds = self.cumulative()
+        target = fraction * bounds[-1][1]
+        for bound, total in bounds:
+            if total and total >= target:
+                return bound
+        return 0.0
+
+    def summary(self):
+        """Count, mean and estimated p50/p95/p99 in milliseconds"""
+        return {"count" : self.count,
+                "mean_ms" : 1000 * self.sum / self.count if self.count else 0.0,
+                "p50_ms" : 1000 * self.quantile(0.5),
+                "p95_ms" : 1000 * self.quantile(0.95),
+                "p99_ms" : 1000 * self.quantile(0.99)}
+
+class CameraStats:
+    """Read counters of one camera, only written by that camera's own thread.
+        fps is measured over windows of about a second"""
+    def __init__(self):
+        self.reads = 0
+        self.frames = 0
+        self.failed_reads = 0
+        self.restarts = 0
+        self.fps = 0.0
+        self.last_frame = None
+        self.read_latency = Histogram()
+        self._window_start = time.monotonic()
+        self._window_reads = 0
+
+    def record_read(self, started, finished, is_decoded=True):
+        """Counts a successful read or grab, is_decoded if it produced a frame"""
+        self.reads += 1
+        self.read_latency.observe(finished - started)
+        if is_decoded:
+            self.frames += 1
+            self.last_frame = finished
+        self._count_window(1, finished)
+
+    def record_frames(self, count, now):
+        """Counts frames read elsewhere, such as by a camera worker process"""
+        if count > 0:
+            self.reads += count
+            self.frames += count
+            self.last_frame = now
+        self._count_window(count, now)
+
+    def record_failure(self):
+        self.failed_reads += 1
+
+    def _count_window(self, count, now):
+        self._window_reads += count
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.fps = self._window_reads / elapsed
+            self._window_start, self._window_reads = now, 0
+
+    def frame_age(self, now=None):
+        """Seconds since the last frame, None before the first"""
+        if self.last_frame is None:
+            return None
+        return (time.monotonic() if now is None else now) - self.last_frame
+
+    def summary(self):
+        age = self.frame_age()
+        # fps drops to zero once a camera stops delivering rather than holding its last value
+        is_stale = age is None or age > 2.0
+        return {"fps" : 0.0 if is_stale else self.fps,
+                "reads" : self.reads,
+                "frames" : self.frames,
+                "failed_reads" : self.failed_reads,
+                "restarts" : self.restarts,
+                "frame_age_ms" : None if age is None else 1000 * age,
+                "read_latency" : self.read_latency.summary()}
+
+class EventMetrics:
+    """Histograms of each stage an event goes through.
+        trigger is notify to the snapshot starting, capture the snapshot of every
+        camera, persist writing the images and log entry and total all of them"""
+    def __init__(self):
+        self.stages = {stage : Histogram() for stage in EVENT_STAGES}
+
+    def record(self, notified, triggered, captured, persisted):
+        """Records one event from its time.monotonic() stage times"""
+        for stage, seconds in zip(EVENT_STAGES, (triggered - notified, captured - triggered,
+                                                 persisted - captured, persisted - notified)):
+            self.stages[stage].observe(seconds)
+
+    def summary(self):
+        return {stage : histogram.summary() for stage, histogram in self.stages.items()}
+
+class StartupTimer:
+    """Times each phase of startup, from started (time.monotonic(), now by default)"""
+    def __init__(self, started=None):
+        self.started = time.monotonic() if started is None else started
+        self.phases = {}
+        self.ready = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times the body of a with block as the named phase"""
+        phase_started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - phase_started)
+
+    def record(self, name, seconds):
+        self.phases[name] = seconds
+
+    def mark_ready(self):
+        """Notes when the system became usable"""
+        self.ready = time.monotonic() - self.started
+
+    def summary(self, extra=None):
+        """Milliseconds of each phase and until ready, with extra {name: seconds}
+            timed elsewhere, such as each camera opening or the event history loading"""
+        phases = dict(self.phases)
+        phases.update(extra or {})
+        return {"ready_ms" : None if self.ready is None else 1000 * self.ready,
+                "phases_ms" : {name : None if seconds is None else 1000 * seconds
+                               for name, seconds in phases.items()}}
+
+def startup_summary(manager):
+    """The startup breakdown of a SecurityManager"""
+    extra = {f"camera_open:{name}" : seconds
+             for name, seconds in getattr(manager.camera_manager, "open_seconds", {}).items()}
+    extra["event_history_load"] = getattr(manager.logger, "load_seconds", None)
+    return manager.startup.summary(extra)
+
+def collect(manager):
+    """Gathers the metrics of a SecurityManager for the stats command"""
+    return {"startup" : startup_summary(manager),
+            "cameras" : {name : camera.stats.summary()
+                         for name, camera in manager.camera_manager.cameras.items()},
+            "snapshot_spread" : manager.camera_manager.snapshot_spread.summary()
+                                if hasattr(manager.camera_manager, "snapshot_spread") else None,
+            "events" : manager.event_metrics.summary(),
+            "capture_pipeline" : manager.capture_pipeline.stats(),
+            "ingest" : manager.ingest_server.stats() if getattr(manager, "ingest_server", None)
+                       else None,
+            "storm_control" : manager.storm_control.stats()
+                              if getattr(manager, "storm_control", None) else None,
+            "topology" : manager.topology.stats() if getattr(manager, "topology", None) else None,
+            "subscribers" : {event_type.name : stats
+                             for event_type, stats in en.subscriber_stats().items()}}
+
+def _labels(**labels):
+    """Formats Prometheus labels, escaping the values"""
+    return ",".join(f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+                    for key, value in labels.items())
+
+def _histogram_lines(name, histogram, **labels):
+    """The bucket, sum and count lines of a histogram"""
+    label_text = _labels(**labels)
+    separator = "," if label_text else ""
+    lines = []
+    for bound, total in histogram.cumulative():
+        bound_text = "+Inf" if bound == float("inf") else repr(bound)
+        lines.append(f'{name}_bucket{{{label_text}{separator}le="{bound_text}"}} {total}')
+    lines.append(f"{name}_sum{{{label_text}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{label_text}}} {histogram.count}")
+    return lines
+
+def render_prometheus(manager):
+    """The metrics of a SecurityManager in the Prometheus text exposition format"""
+    cameras = dict(manager.camera_manager.cameras)
+    lines = []
+    def family(name, kind, description):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+    for name, kind, description, value in (
+            ("lvs_camera_reads_total", "counter", "Frames read or grabbed", lambda s: s.reads),
+            ("lvs_camera_failed_reads_total", "counter", "Failed reads", lambda s: s.failed_reads),
+            ("lvs_camera_restarts_total", "counter", "Camera worker restarts", lambda s: s.restarts),
+            ("lvs_camera_fps", "gauge", "Frames read per second", lambda s: s.summary()["fps"]),
+            ("lvs_camera_frame_age_seconds", "gauge", "Seconds since the last frame",
+             lambda s: s.frame_age())):
+        family(name, kind, description)
+        for camera_name, camera in cameras.items():
+            sample = value(camera.stats)
+            if sample is not None:
+                lines.append(f"{name}{{{_labels(camera=camera_name)}}} {sample}")
+    family("lvs_camera_read_seconds", "histogram", "Time taken by each frame read")
+    for camera_name, camera in cameras.items():
+        lines += _histogram_lines("lvs_camera_read_seconds", camera.stats.read_latency,
+                                  camera=camera_name)
+    if hasattr(manager.camera_manager, "snapshot_spread"):
+        family("lvs_snapshot_spread_seconds", "histogram",
+               "Time between the earliest and latest frame of each snapshot")
+        lines += _histogram_lines("lvs_snapshot_spread_seconds",
+                                  manager.camera_manager.snapshot_spread)
+    family("lvs_event_stage_seconds", "histogram", "Time taken by each stage of an event")
+    for stage, histogram in manager.event_metrics.stages.items():
+        lines += _histogram_lines("lvs_event_stage_seconds", histogram, stage=stage)
+    pipeline = manager.capture_pipeline.stats()
+    for key, value in pipeline.items():
+        kind = "counter" if key in ("submitted", "completed", "failed", "dropped") else "gauge"
+        suffix = "_total" if kind == "counter" else ""
+        family(f"lvs_capture_pipeline_{key}{suffix}", kind, f"Capture pipeline {key}")
+        lines.append(f"lvs_capture_pipeline_{key}{suffix} {value}")
+    subscriber_samples = [(event_type.name, stats) for event_type, all_stats
+                          in en.subscriber_stats().items() for stats in all_stats]
+    for key, name, kind in (("delivered", "lvs_subscriber_delivered_total", "counter"),
+                            ("dropped", "lvs_subscriber_dropped_total", "counter"),
+                            ("backlog", "lvs_subscriber_backlog", "gauge"),
+                            ("mean_ms", "lvs_subscriber_mean_milliseconds", "gauge"),
+                            ("max_ms", "lvs_subscriber_max_milliseconds", "gauge")):
+        family(name, kind, f"Subscriber {key}")
+        for event_type, stats in subscriber_samples:
+            lines.append(f"{name}{{{_labels(event_type=event_type, subscriber=stats['subscriber'])}}}"
+                         f" {stats[key]}")
+    return "\n".join(lines) + "\n"
+
+class MetricsServer(threading.Thread):
+    """Serves render_prometheus at /metrics on a local port in a daemon thread"""
+    def __init__(self, manager, port=9108, host="127.0.0.1"):
+        # Only imported when metrics are served, it is not needed to start up
+        import http.server
+        threading.Thread.__init__(self, name="metrics-server", daemon=True)
+        render = lambda: render_prometheus(manager)
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes are not worth a line on the console every few seconds
+                pass
+        self.server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        self.port = self.server.server_address[1]
+
+    def run(self):
+        self.server.serve_forever()
+
+    def quit(self):
+        """Stops serving and closes the port"""
+        self.server.shutdown()
+        self.server.server_close()
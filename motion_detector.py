@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+File:             motion_detector.py
+Date:             17/10/2026
+Description:      Optional motion detection stage for the camera feeds.
+                  Frames are shrunk to a small grayscale image and compared against a
+                  running background with NumPy, movement covering enough of a zone
+                  notifies a PERSON_DETECTED security event for that camera.
+                  Run "python motion_detector.py" to benchmark it on synthetic feeds
+"""
+
+import time
+import threading
+import cv2 as cv
+import numpy as np
+import event_notifier as en
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+# The whole frame, zones are (x, y, width, height) as fractions of the frame
+FULL_FRAME = (0.0, 0.0, 1.0, 1.0)
+
+class MotionDetector:
+    """Background subtraction motion detector for a single camera.
+        Works at a reduced width, a pixel counts as moving if it differs from the
+        background by more than threshold, a zone triggers once min_area of it moves"""
+    def __init__(self, zones=None, width=160, threshold=25, min_area=0.02,
+                 learning_rate=0.05, cooldown=5.0):
+        self.zones = zones if zones else [FULL_FRAME]
+        self.width = width
+        self.threshold = threshold
+        self.min_area = min_area
+        self.learning_rate = learning_rate
+        self.cooldown = cooldown
+        self.background = None
+        self.zone_masks = None
+        self.zone_areas = None
+        self.last_detection = float("-inf")
+
+    def _build_zones(self, shape):
+        """Builds a stacked boolean mask per zone at the reduced resolution"""
+        height, width = shape
+        self.zone_masks = np.zeros((len(self.zones), height, width), dtype=bool)
+        for index, (x, y, zone_width, zone_height) in enumerate(self.zones):
+            left, top = int(x * width), int(y * height)
+            right = max(left + 1, int((x + zone_width) * width))
+            bottom = max(top + 1, int((y + zone_height) * height))
+            self.zone_masks[index, top:bottom, left:right] = True
+        self.zone_areas = self.zone_masks.reshape(len(self.zones), -1).sum(axis=1)
+
+    def reduce(self, frame):
+        """Shrinks a BGR or grayscale frame to the working width in grayscale"""
+        height = max(1, round(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv.resize(frame, (self.width, height), interpolation=cv.INTER_AREA)
+        if small.ndim == 3:
+            small = cv.cvtColor(small, cv.COLOR_BGR2GRAY)
+        return small
+
+    def process(self, small, now=None):
+        """Compares a reduced frame against the background and updates it.
+            Returns the indexes of the zones with motion, empty while cooling down"""
+        gray = small.astype(np.float32)
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            self._build_zones(gray.shape)
+            return []
+        moving = np.abs(gray - self.background) > self.threshold
+        self.background += self.learning_rate * (gray - self.background)
+        moved = (self.zone_masks & moving).reshape(len(self.zones), -1).sum(axis=1)
+        zones = np.flatnonzero(moved >= self.min_area * self.zone_areas).tolist()
+        now = time.monotonic() if now is None else now
+        if not zones or now - self.last_detection < self.cooldown:
+            return []
+        self.last_detection = now
+        return zones
+
+class MotionAnalyser(threading.Thread):
+    """Single analysis thread shared by every camera of a CameraManager.
+        Each pass takes the newest unseen frame of every camera, shrinking it while
+        the ring buffer is locked so the full frame is never copied"""
+    def __init__(self, camera_manager, fps=5, zones=None, **detector_settings):
+        threading.Thread.__init__(self, name="motion-analyser", daemon=True)
+        self.camera_manager = camera_manager
+        self.interval = 1 / fps
+        # Either a list of zones for every camera or a dictionary of camera name to zones
+        self.zones = zones
+        self.detector_settings = detector_settings
+        self.detectors = {}
+        self.sequences = {}
+        self.is_quitting = False
+
+    def detector_for(self, camera_name):
+        """Gets or creates the detector of a camera"""
+        if camera_name not in self.detectors:
+            zones = self.zones.get(camera_name) if isinstance(self.zones, dict) else self.zones
+            self.detectors[camera_name] = MotionDetector(zones=zones, **self.detector_settings)
+        return self.detectors[camera_name]
+
+    def analyse(self):
+        """Runs one pass over every camera, a camera whose frame cannot be analysed is
+            reported and starts again with a new detector on the next pass"""
+        for camera_name, camera in list(self.camera_manager.cameras.items()):
+            detector = self.detector_for(camera_name)
+            try:
+                small, sequence = camera.buffer.apply_latest(detector.reduce)
+                if small is None or sequence == self.sequences.get(camera_name):
+                    continue
+                self.sequences[camera_name] = sequence
+                zones = detector.process(small)
+            except Exception as e:
+                # Such as a change of resolution leaving the background the wrong shape
+                self.detectors.pop(camera_name, None)
+                self.sequences.pop(camera_name, None)
+                en.notify(en.SubscribedEventType.ERROR_EVENT,
+                          logging_level=en.LoggingLevel.ERROR,
+                          error_location=type(self).__name__,
+                          description=f"Motion analysis of {camera_name} failed: {e}")
+                continue
+            if zones:
+                en.notify(en.SubscribedEventType.SECURITY_EVENT,
+                          event_id=en.EventTypes.PERSON_DETECTED,
+                          camera=camera_name)
+
+    def run(self):
+        """Analyses every camera at the analysis frame rate until told to quit"""
+        next_pass = time.monotonic()
+        while not self.is_quitting:
+            self.analyse()
+            next_pass += self.interval
+            delay = next_pass - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_pass = time.monotonic()
+
+    def quit(self):
+        """Stops the analysis thread"""
+        self.is_quitting = True
+
+def benchmark(streams=16, frames=100, resolution=(1080, 1920), width=160):
+    """Times reduction and detection of synthetic frames on a single OpenCV thread,
+        returns the frames per second managed across all streams"""
+    cv.setNumThreads(1)
+    height, width_full = resolution
+    gradient = np.linspace(0, 200, width_full, dtype=np.uint8)
+    base = np.repeat(np.tile(gradient, (height, 1))[:, :, None], 3, axis=2)
+    moving = base.copy()
+    moving[height // 4:height // 2, width_full // 4:width_full // 2] = 255
+    detectors = [MotionDetector(width=width, cooldown=0) for _ in range(streams)]
+    detections = 0
+    start = time.perf_counter()
+    for index in range(frames):
+        frame = moving if index % 10 == 9 else base
+        for detector in detectors:
+            detections += bool(detector.process(detector.reduce(frame)))
+    elapsed = time.perf_counter() - start
+    return {"streams" : streams,
+            "frames" : frames * streams,
+            "frames_per_second" : frames * streams / elapsed,
+            "ms_per_frame" : elapsed * 1000 / (frames * streams),
+            "detections" : detections}
+
+if __name__ == "__main__":
+    # Benchmark 16 1080p streams on one thread if run "python motion_detector.py"
+    print(benchmark())
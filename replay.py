@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+File:             replay.py
+Date:             17/10/2026
+Description:      Headless replay driver for soak testing the security system.
+                  Streams a JSONL script of {"checkpoint", "action", "arg", "t"} records
+                  (from a file or stdin) through the checkpoint state machines, either
+                  as fast as possible or at the recorded timing, with the cameras
+                  stubbed out. Events go through the same capture pipeline and event
+                  log as a live system, and the driver reports events per second and
+                  the latency of each stage from action to logged event.
+                  eg: python replay.py soak.jsonl --realtime --speed 10
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import collections
+import numpy as np
+import event_notifier as en
+from event_logger import EventLogger, EventJournal
+from event_store import SQLiteEventStore, DATABASE_EXTENSIONS
+from security_manager import SecurityManager
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+DEFAULT_CHECKPOINT = "default"
+STAGES = ("queue", "machine", "capture", "total")
+
+class StubCameraManager:
+    """Stands in for CameraManager with no cameras, snapshots are empty"""
+    def __init__(self):
+        self.cameras = {}
+        self.capture_store = None
+
+    def snapshot(self, timestamp=None, cameras=None):
+        return {}
+
+    def write_snapshot(self, folder_path, frames, codec=None):
+        return []
+
+    def export_clips(self, folder_path, timestamp, pre_roll, post_roll, cameras=None):
+        return []
+
+    def enable_motion_detection(self, **kwargs):
+        pass
+
+    def quit_all(self):
+        pass
+
+class TimedEventLogger(EventLogger):
+    """EventLogger that hands the time each event is logged to the replay driver"""
+    def __init__(self, on_logged, journal=None):
+        self.on_logged = on_logged
+        super().__init__(journal)
+
+    def log_event(self, /, **kwargs):
+        super().log_event(**kwargs)
+        self.on_logged(kwargs.get("checkpoint"))
+
+def read_script(source):
+    """Yields the (checkpoint, action, argument, t) of every line of a JSONL script,
+        skipping blank lines"""
+    for line_number, line in enumerate(source, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            yield (str(record.get("checkpoint", DEFAULT_CHECKPOINT)), record["action"],
+                   record.get("arg"), record.get("t"))
+        except (ValueError, KeyError) as e:
+            en.notify(en.SubscribedEventType.ERROR_EVENT,
+                      logging_level=en.LoggingLevel.WARNING,
+                      error_location="read_script",
+                      description=f"Skipping script line {line_number}: {e}")
+
+class ReplayDriver:
+    """Runs scripts through a headless SecurityManager.
+        Every security event is timed at three stages, queue (action submitted to
+        started), machine (started to event notified) and capture (notified to written
+        to the event log). A single capture worker keeps each checkpoint's events in
+        order so the stage times can be matched up"""
+    def __init__(self, allowlist=None, workers=4, journal_path=None, capture_path=None,
+                 capture_queue_size=4096):
+        self.capture_folder = None
+        if journal_path is None or capture_path is None:
+            self.capture_folder = tempfile.TemporaryDirectory(prefix="replay-")
+        if journal_path is None:
+            journal_path = os.path.join(self.capture_folder.name, "events.jsonl")
+        if capture_path is None:
+            capture_path = os.path.join(self.capture_folder.name, "event_captures")
+        if journal_path.endswith(DATABASE_EXTENSIONS):
+            journal = SQLiteEventStore(journal_path, legacy_path=journal_path + ".legacy")
+        else:
+            journal = EventJournal(journal_path, legacy_path=journal_path + ".legacy",
+                                   fsync_batch=256)
+        self.latencies = {stage: [] for stage in STAGES}
+        self.actions = 0
+        self.events = 0
+        self._notified = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        # Subscribed ahead of the manager so an event is stamped before it is captured
+        en.subscribe(en.SubscribedEventType.SECURITY_EVENT, self.on_notified)
+        self.manager = SecurityManager(camera_manager=StubCameraManager(),
+                                       logger=TimedEventLogger(self.on_logged, journal),
+                                       capture_path=capture_path, capture_workers=1,
+                                       capture_queue_size=capture_queue_size,
+                                       allowlist=allowlist, checkpoint_workers=workers,
+                                       interactive=False)
+
+    def on_notified(self, event_id, checkpoint=None, **kwargs):
+        """Runs inline on the checkpoint's worker, stamps the action behind the event"""
+        notified = time.monotonic()
+        session = self.manager.checkpoints.sessions.get(checkpoint)
+        running = session.running if session else None
+        submitted, started = (running[1], running[2]) if running else (notified, notified)
+        with self._lock:
+            self._notified[checkpoint].append((submitted, started, notified))
+
+    def on_logged(self, checkpoint):
+        """Called once an event is written to the log, completes its stage times"""
+        logged = time.monotonic()
+        with self._lock:
+            pending = self._notified.get(checkpoint)
+            if not pending:
+                return
+            submitted, started, notified = pending.popleft()
+            self.events += 1
+            for stage, latency in zip(STAGES, (started - submitted, notified - started,
+                                               logged - notified, logged - submitted)):
+                self.latencies[stage].append(latency)
+
+    def run(self, script, realtime=False, speed=1.0, max_in_flight=1024):
+        """Submits every action of the script, waiting out the recorded times if
+            realtime (divided by speed), then waits for the events to be logged.
+            No more than max_in_flight actions are queued at once so the queue stage
+            measures the pool rather than the length of the script. Returns the report"""
+        start = time.monotonic()
+        first_time = None
+        checkpoints = self.manager.checkpoints
+        for checkpoint, action, argument, record_time in script:
+            if realtime and record_time is not None:
+                first_time = record_time if first_time is None else first_time
+                delay = start + (record_time - first_time) / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            while checkpoints.backlog() >= max_in_flight:
+                time.sleep(0.0005)
+            checkpoints.submit(checkpoint, action, argument)
+            self.actions += 1
+        checkpoints.drain()
+        self.finish()
+        return self.report(time.monotonic() - start)
+
+    def finish(self):
+        """Unsubscribes and shuts the manager down, which delivers and logs every
+            queued event first"""
+        en.unsubscribe(en.SubscribedEventType.SECURITY_EVENT, self.on_notified)
+        self.manager.quit()
+        if self.capture_folder:
+            self.capture_folder.cleanup()
+
+    def report(self, elapsed):
+        """Throughput and per stage latency percentiles in milliseconds"""
+        report = {"actions" : self.actions,
+                  "events" : self.events,
+                  "seconds" : elapsed,
+                  "actions_per_second" : self.actions / elapsed if elapsed else 0.0,
+                  "events_per_second" : self.events / elapsed if elapsed else 0.0,
+                  "failed_actions" : self.manager.checkpoints.stats()["failed"],
+                  "dropped_captures" : self.manager.capture_pipeline.stats()["dropped"]}
+        for stage, latencies in self.latencies.items():
+            if latencies:
+                values = np.array(latencies) * 1000
+                report[f"{stage}_ms"] = {"p50" : float(np.percentile(values, 50)),
+                                         "p95" : float(np.percentile(values, 95)),
+                                         "p99" : float(np.percentile(values, 99)),
+                                         "max" : float(values.max())}
+        return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="LVS Security Replay",
+                                     description="Replays a JSONL action script headless")
+    # Script file, stdin if not given or "-"
+    parser.add_argument("script", nargs="?", default="-")
+    # Keep the recorded "t" spacing between actions, sped up by --speed
+    parser.add_argument("--realtime", action='store_true')
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-in-flight", type=int, default=1024)
+    # A file of allowed IDs or a .json allowlist config
+    parser.add_argument("--allowlist", required=False)
+    # Keep the event journal here rather than in a temporary folder, a .db path
+    # logs to the SQLite store
+    parser.add_argument("--journal", required=False)
+    args = parser.parse_args()
+    driver = ReplayDriver(allowlist=args.allowlist, workers=args.workers,
+                          journal_path=args.journal)
+    if args.script == "-":
+        report = driver.run(read_script(sys.stdin), args.realtime, args.speed,
+                            args.max_in_flight)
+    else:
+        with open(args.script, "r") as script_file:
+            report = driver.run(read_script(script_file), args.realtime, args.speed,
+                                args.max_in_flight)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""
+File:             retention.py
+Date:             17/10/2026
+Description:      Retention of event captures and the event log.
+                  A RetentionPolicy expires events by age, with per event type rules
+                  such as keeping detentions for 90 days but ID attempts for only 7, and
+                  by the total bytes of their capture folders, oldest first.
+                  The RetentionPruner applies it in a low priority background thread,
+                  deleting capture folders one at a time with a pause between each to
+                  avoid I/O spikes, and compacting the event log without holding up
+                  log_event.
+                  eg: python security_manager.py --retention-days 30 --retain PERSON_DETAINED=90
+"""
+
+import os
+import time
+import shutil
+import threading
+import event_notifier as en
+from event_logger import event_timestamp
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+SECONDS_PER_DAY = 86400
+
+def event_type_key(event_type):
+    """The form event types are logged in, from an EventTypes, its name or that form"""
+    if isinstance(event_type, en.EventTypes):
+        return str(event_type)
+    event_type = str(event_type)
+    if event_type.startswith("EventTypes."):
+        return event_type
+    return str(en.EventTypes[event_type.upper()])
+
+def folder_bytes(folder):
+    """Total size of the files under a folder, 0 if it does not exist"""
+    total = 0
+    for root, _, files in os.walk(folder):
+        for file_name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                pass
+    return total
+
+class RetentionPolicy:
+    """How long events are kept.
+        max_age_days applies to every event type without a rule of its own in rules,
+        {event type: days}, None keeps them forever. Once the age limits are applied
+        the oldest events are also expired until their capture folders fit max_bytes"""
+    def __init__(self, max_age_days=None, max_bytes=None, rules=None):
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.rules = {event_type_key(event_type) : days
+                      for event_type, days in (rules or {}).items()}
+
+    def days_for(self, event_type):
+        """Days an event type is kept for, None for forever"""
+        return self.rules.get(str(event_type), self.max_age_days)
+
+    def expired(self, event_dicts, now=None, size_of=folder_bytes):
+        """Returns the events the policy removes, size_of gives the bytes of an event's
+            capture folder. Folders shared by several events are only counted once"""
+        now = time.time() if now is None else now
+        expired = []
+        retained = []
+        timed = sorted((event_timestamp(event_dict["event_time"]), index, event_dict)
+                       for index, event_dict in enumerate(event_dicts))
+        for timestamp, _, event_dict in timed:
+            days = self.days_for(event_dict["event_type"])
+            if days is not None and timestamp < now - days * SECONDS_PER_DAY:
+                expired.append(event_dict)
+            else:
+                retained.append(event_dict)
+        if self.max_bytes is None:
+            return expired
+        references = {}
+        for event_dict in retained:
+            folder = event_dict["image_path"]
+            references[folder] = references.get(folder, 0) + 1
+        total = sum(size_of(folder) for folder in references)
+        for event_dict in retained:
+            if total <= self.max_bytes:
+                break
+            expired.append(event_dict)
+            folder = event_dict["image_path"]
+            references[folder] -= 1
+            if references[folder] == 0:
+                total -= size_of(folder)
+        return expired
+
+class RetentionPruner(threading.Thread):
+    """Applies a retention policy every interval seconds in a daemon thread.
+        Expired events are removed from the log first, then their capture folders are
+        deleted with pause seconds between each. Only folders under capture_root are
+        ever deleted, through the capture store if captures are deduplicated"""
+    def __init__(self, logger, policy, capture_root=None, capture_store=None,
+                 interval=600.0, pause=0.05):
+        threading.Thread.__init__(self, name="retention-pruner", daemon=True)
+        self.logger = logger
+        self.policy = policy
+        self.capture_root = capture_root
+        self.capture_store = capture_store
+        self.interval = interval
+        self.pause = pause
+        self.passes = 0
+        self.events_removed = 0
+        self.folders_removed = 0
+        self.bytes_removed = 0
+        self._folder_sizes = {}
+        self._stop_event = threading.Event()
+
+    def _size_of(self, folder):
+        """Folder sizes are cached, a capture folder is not written to after its event"""
+        if folder not in self._folder_sizes:
+            self._folder_sizes[folder] = folder_bytes(folder)
+        return self._folder_sizes[folder]
+
+    def _is_removable(self, folder):
+        """Whether a folder is inside the capture root, never the root itself or a
+            sibling whose name starts the same"""
+        if not self.capture_root or not folder:
+            return False
+        # Capture folders are joined with "\\", read it as a separator on every platform
+        root = os.path.abspath(self.capture_root.replace("\\", os.sep))
+        folder = os.path.abspath(folder.replace("\\", os.sep))
+        try:
+            return folder != root and os.path.commonpath([root, folder]) == root
+        except ValueError:
+            # On different drives
+            return False
+
+    def prune_once(self, now=None):
+        """Runs a single pass, returns the number of events and folders removed"""
+        expired = self.policy.expired(self.logger.events_as_dictionaries(), now,
+                                      self._size_of)
+        if not expired:
+            self.passes += 1
+            return {"events" : 0, "folders" : 0}
+        expired_ids = set(id(event_dict) for event_dict in expired)
+        removed = self.logger.prune(lambda event_dict: id(event_dict) not in expired_ids)
+        in_use = set(event_dict["image_path"]
+                     for event_dict in self.logger.events_as_dictionaries())
+        folders = []
+        for event_dict in removed:
+            folder = event_dict["image_path"]
+            if folder not in in_use and folder not in folders and self._is_removable(folder):
+                folders.append(folder)
+        for folder in folders:
+            if self._stop_event.is_set():
+                break
+            self._remove_folder(folder)
+            self._stop_event.wait(self.pause)
+        self.passes += 1
+        self.events_removed += len(removed)
+        return {"events" : len(removed), "folders" : len(folders)}
+
+    def _remove_folder(self, folder):
+        size = self._folder_sizes.pop(folder, None)
+        size = folder_bytes(folder) if size is None else size
+        try:
+            if self.capture_store is not None:
+                self.capture_store.delete_event(folder)
+            else:
+                shutil.rmtree(folder)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            en.notify(en.SubscribedEventType.ERROR_EVENT,
+                      logging_level=en.LoggingLevel.WARNING,
+                      error_location=type(self).__name__,
+                      description=f"Unable to remove {folder}: {e}")
+            return
+        self.folders_removed += 1
+        self.bytes_removed += size
+
+    def run(self):
+        # Linux schedules threads individually, so this lowers only the pruner
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while not self._stop_event.is_set():
+            try:
+                self.prune_once()
+            except Exception as e:
+                en.notify(en.SubscribedEventType.ERROR_EVENT,
+                          logging_level=en.LoggingLevel.ERROR,
+                          error_location=type(self).__name__,
+                          description=f"Retention pass failed: {e}")
+            self._stop_event.wait(self.interval)
+
+    def quit(self):
+        """Stops after the folder being deleted"""
+        self._stop_event.set()
+
+    def stats(self):
+        return {"passes" : self.passes,
+                "events_removed" : self.events_removed,
+                "folders_removed" : self.folders_removed,
+                "bytes_removed" : self.bytes_removed}
@@ -8,9 +8,21 @@ Description:      Security camera input using OpenCV
                   Each camera inherits from the threading class to allow feeds to run
                   simultaneously
 """
+import os
+import time
 import threading
+import multiprocessing
+import concurrent.futures
 import cv2 as cv
+import numpy as np
 import event_notifier as en
+from frame_buffer import FrameRingBuffer, BufferedFrame, DEFAULT_BUFFER_BYTES
+from image_codec import CaptureCodec, EncodeCache
+from shared_frames import SharedFrameBuffer, camera_worker
+from motion_detector import MotionAnalyser
+from frame_sources import open_source, feed_name
+from metrics import CameraStats, Histogram
+from display import MosaicDisplay
 
 __author__ = "Benjamin Vernon-Bosley"
 __copyright__ = "Livestock Visibility Solutions"
@@ -23,14 +35,32 @@ __status__ = "Prototype"
 
 
 class Camera(threading.Thread):
-    """Camera reader and displayer thread, handled by CameraManager"""
-    def __init__(self, camerafeed, display_camera=False):
+    """Camera reader thread, handled by CameraManager"""
+    def __init__(self, camerafeed, display_camera=False, buffer_seconds=2.0,
+                 buffer_bytes=DEFAULT_BUFFER_BYTES, analysis_fps=None, codec=None,
+                 encode_window=2.0):
+        """analysis_fps of None decodes every frame read, otherwise frames are only
+            grabbed and decoded analysis_fps times a second (never if 0) as well as
+            whenever a consumer, such as the display, asks for a fresh frame.
+            Captures are encoded with codec (PNG by default), a frame captured again
+            within encode_window seconds reuses its encoded image"""
         threading.Thread.__init__(self)
-        self.feed_name = f"{camerafeed}"
-        self.camera_cap = cv.VideoCapture(camerafeed)
+        self.codec = codec if codec else CaptureCodec()
+        self.encode_cache = EncodeCache(encode_window)
+        self._last_stored = {}
+        self._store_lock = threading.Lock()
+        self.stats = CameraStats()
+        self.feed_name = feed_name(camerafeed)
+        # A cv.VideoCapture, or a virtual source for synthetic://, loop:// and images://
+        self.camera_cap = open_source(camerafeed)
         self.is_showing = display_camera
         self.is_quitting = False
-        self.frame = None
+        self.frame_time = None
+        self.analysis_fps = analysis_fps
+        self._next_decode = 0.0
+        self._decode_requested = threading.Event()
+        self.buffer = FrameRingBuffer(seconds=buffer_seconds, max_bytes=buffer_bytes,
+                                      fps=self.camera_cap.get(cv.CAP_PROP_FPS))
         if not self.camera_cap.isOpened():
             en.notify(en.SubscribedEventType.ERROR_EVENT,
                       logging_level=en.LoggingLevel.WARNING,
@@ -40,27 +70,65 @@ class Camera(threading.Thread):
 
     def run(self):
         """Threaded loop that runs continuously, constantly reads the camera input
-            and can display the camera contents if specified.
-            Press Esc on a running camera window to close it permanently"""
+            into the frame buffer, the MosaicDisplay draws it from there when shown"""
         while(True):
             if (self.is_quitting):
                 self.camera_cap.release()
                 self.destroy_feed()
                 return
-            is_running, self.frame = self.camera_cap.read()
+            started = time.monotonic()
+            is_running, frame = self.read_frame()
             try:
                 assert is_running, "Camera capture is no longer running"
             except AssertionError as e:
+                self.stats.record_failure()
                 en.notify(en.SubscribedEventType.ERROR_EVENT,
                       logging_level=en.LoggingLevel.WARNING,
                       error_location=type(self).__name__,
                       description=e)
                 return
-            if self.is_showing:
-                cv.imshow(self.feed_name, self.frame)
-                if cv.waitKey(1) == 27:
-                    self.is_showing = False
-                    self.is_quitting = True
+            self.stats.record_read(started, time.monotonic(), frame is not None)
+            if frame is None:
+                continue
+            self.frame_time = time.time()
+            # The committed slot is rewritten once the ring comes back around, readers
+            # take copies through frame or the buffer instead
+            self.buffer.commit(frame, self.frame_time)
+
+    @property
+    def frame(self):
+        """A copy of the newest frame, None before the first"""
+        latest = self.buffer.latest()
+        return None if latest is None else latest.frame
+
+    def read_frame(self):
+        """Reads the next frame straight into the next ring buffer slot once it has
+            been sized. In grab mode the frame is only decoded when it is due or asked
+            for, otherwise the frame returned is None"""
+        if self.analysis_fps is None:
+            slot = self.buffer.acquire()
+            return self.camera_cap.read() if slot is None else self.camera_cap.read(slot)
+        if not self.camera_cap.grab():
+            return False, None
+        now = time.monotonic()
+        is_due = self.analysis_fps > 0 and now >= self._next_decode
+        if not (is_due or self._decode_requested.is_set()):
+            return True, None
+        self._decode_requested.clear()
+        if self.analysis_fps > 0:
+            self._next_decode = max(self._next_decode + 1 / self.analysis_fps, now)
+        slot = self.buffer.acquire()
+        return self.camera_cap.retrieve() if slot is None else self.camera_cap.retrieve(slot)
+
+    def wait_for_frame(self, after_sequence=0, timeout=None):
+        """Blocks until a frame newer than after_sequence has been read, asking for a
+            decode if the camera is only grabbing. Returns a BufferedFrame or None"""
+        self.request_frame()
+        return self.buffer.wait_for_frame(after_sequence, timeout)
+
+    def request_frame(self):
+        """Asks for the next grabbed frame to be decoded"""
+        self._decode_requested.set()
 
     def enable_feed(self):
         """Enables the updating of the windowed camera feed"""
@@ -71,41 +139,304 @@ class Camera(threading.Thread):
         self.is_showing = False
 
     def destroy_feed(self):
-        """Stops the feed buffer from updating and closes the associated
-            window"""
-        if cv.getWindowProperty(self.feed_name, cv.WND_PROP_VISIBLE) >= 1:
-            cv.destroyWindow(self.feed_name)
+        """Stops the feed being shown, the window belongs to the MosaicDisplay"""
+        self.is_showing = False
+
+    def snapshot(self, timestamp=None, decode_timeout=0.1, fresh_within=0.1):
+        """Returns a BufferedFrame copy of the latest frame, or of the buffered frame
+            nearest to the timestamp (seconds since the epoch) if one is given.
+            In grab mode a fresh frame is decoded first, waiting up to decode_timeout,
+            unless the newest frame is under fresh_within seconds old"""
+        if self.needs_fresh_frame(fresh_within):
+            self.wait_for_frame(self.buffer.sequence, decode_timeout)
+        if timestamp is None:
+            return self.buffer.latest()
+        return self.buffer.nearest(timestamp)
+
+    def needs_fresh_frame(self, fresh_within=0.1):
+        """Whether a snapshot has to wait for a frame to be decoded, only in grab mode
+            when the newest frame is over fresh_within seconds old"""
+        if self.analysis_fps is None or not self.is_alive():
+            return False
+        age = self.buffer.latest_age()
+        return age is None or age > fresh_within
+
+    def export_clip(self, file_path, event_time, pre_roll=2.0, post_roll=2.0, timeout=None):
+        """Writes the buffered frames from pre_roll seconds before to post_roll seconds
+            after the event time as a video clip, waiting for the post roll to be read.
+            Returns the number of frames written"""
+        if post_roll > 0:
+            self.buffer.wait_until(event_time + post_roll,
+                                   timeout if timeout is not None else post_roll + 1.0)
+        clip = self.buffer.frames(event_time - pre_roll, event_time + post_roll)
+        if not clip:
+            en.notify(en.SubscribedEventType.ERROR_EVENT,
+                      logging_level=en.LoggingLevel.WARNING,
+                      error_location=type(self).__name__,
+                      description=f"No buffered frames for clip of {self.feed_name}")
+            return 0
+        duration = clip[-1][0] - clip[0][0]
+        fps = (len(clip) - 1) / duration if duration > 0 else self.buffer.fps
+        height, width = clip[0][1].shape[:2]
+        clip_name = file_path + "\\clip-camera-" + self.feed_name + ".avi"
+        writer = cv.VideoWriter(clip_name, cv.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+        for _, frame in clip:
+            writer.write(frame)
+        writer.release()
+        return len(clip)
 
     def capture(self, file_path):
         """Captures the current feed to the event and time-stamped capture folder,
             even if the window isnt showing, it is still recording.
             The file name is only the name of the camera, but the folder is named after
             the event and time"""
-        image_name = file_path + "\\camera-" + self.feed_name + ".png"
+        self.write_frame(file_path, self.snapshot())
+
+    def image_name(self, file_path, codec=None):
+        """The path of this camera's image in a capture folder"""
+        codec = codec if codec else self.codec
+        return file_path + "\\camera-" + self.feed_name + codec.extension
+
+    def encode_frame(self, frame, codec=None):
+        """Encodes a frame with the codec given or the camera's own, snapshots
+            (BufferedFrame) are encoded once per sequence number and codec"""
+        codec = codec if codec else self.codec
+        if isinstance(frame, BufferedFrame):
+            return self.encode_cache.get_or_encode(frame.sequence, codec, frame.frame)
+        return codec.encode(frame)
+
+    def write_frame(self, file_path, frame, store=None, codec=None):
+        """Encodes and writes a previously snapshotted frame into the capture folder,
+            with the codec given or the camera's own. With a CaptureStore the image is
+            saved once in the store and linked into the folder. Returns the image path
+            and blob id (None without a store)"""
+        image_name = self.image_name(file_path, codec)
         try:
-            assert cv.imwrite(image_name, self.frame)
-        except cv.Error as e:
+            assert frame is not None, "No frame has been read"
+            if store is None:
+                with open(image_name, "wb") as outfile:
+                    outfile.write(self.encode_frame(frame, codec))
+                return image_name, None
+            blob_id = self._store_frame(store, frame, codec)
+            try:
+                store.link(blob_id, image_name)
+            except OSError:
+                store.release(blob_id)
+                raise
+            return image_name, blob_id
+        except (cv.error, AssertionError, OSError) as e:
             en.notify(en.SubscribedEventType.ERROR_EVENT,
                       logging_level=en.LoggingLevel.ERROR,
                       error_location=type(self).__name__,
                       description=f"Unable to take capture: {e}")
+            return image_name, None
+
+    def _store_frame(self, store, frame, codec=None):
+        """Puts the encoded frame in the store, unless the store opts in to near
+            duplicates and it looks the same as this camera's last stored capture, in
+            which case that blob is reused. Either way the blob comes back pinned in the
+            store until the event is recorded"""
+        codec = codec if codec else self.codec
+        if store.near_threshold <= 0:
+            return store.put(self.encode_frame(frame, codec), codec.extension)
+        pixels = frame.frame if isinstance(frame, BufferedFrame) else frame
+        thumbnail = cv.resize(pixels, (32, 18), interpolation=cv.INTER_AREA).astype(np.float32)
+        with self._store_lock:
+            # Only a blob encoded with the same settings can stand in for this capture
+            last_thumbnail, last_blob = self._last_stored.get(codec.key(), (None, None))
+            if (last_thumbnail is not None and last_thumbnail.shape == thumbnail.shape and
+                    float(np.mean(np.abs(thumbnail - last_thumbnail))) < store.near_threshold and
+                    store.pin(last_blob)):
+                return last_blob
+        blob_id = store.put(self.encode_frame(frame, codec), codec.extension)
+        with self._store_lock:
+            self._last_stored[codec.key()] = (thumbnail, blob_id)
+        return blob_id
 
     def quit(self):
         """Stops the feed, display and closes the thread"""
         self.is_quitting = True
 
+class ProcessCamera(Camera):
+    """Camera read and decoded in its own worker process, so decoding never competes
+        with the main process for the GIL. Frames arrive through a SharedFrameBuffer.
+        The thread itself only watches the worker, restarting it up to max_restarts
+        times if it dies, and counts the frames it publishes"""
+    def __init__(self, camerafeed, display_camera=False, buffer_seconds=2.0,
+                 buffer_bytes=DEFAULT_BUFFER_BYTES, analysis_fps=None, codec=None,
+                 encode_window=2.0, max_restarts=3, restart_delay=1.0):
+        threading.Thread.__init__(self)
+        self.codec = codec if codec else CaptureCodec()
+        self.encode_cache = EncodeCache(encode_window)
+        self._last_stored = {}
+        self._store_lock = threading.Lock()
+        self.stats = CameraStats()
+        self._seen_sequence = 0
+        self.camerafeed = camerafeed
+        self.feed_name = feed_name(camerafeed)
+        self.is_showing = display_camera
+        self.is_quitting = False
+        self.frame_time = None
+        # The worker decodes at its own rate, frames are never requested on demand
+        self.analysis_fps = None
+        self.worker_fps = analysis_fps
+        self.buffer_seconds = buffer_seconds
+        self.buffer_bytes = buffer_bytes
+        self.max_restarts = max_restarts
+        self.restart_delay = restart_delay
+        self.restarts = 0
+        # Empty until the worker reports its shared buffer
+        self.buffer = FrameRingBuffer(seconds=0)
+        self._context = multiprocessing.get_context("spawn")
+        self.start_worker()
+
+    def start_worker(self):
+        """Starts a new worker process for the camera"""
+        self._connection, worker_connection = self._context.Pipe(duplex=False)
+        self._stop_event = self._context.Event()
+        self.process = self._context.Process(
+            target=camera_worker, name=f"camera-{self.feed_name}", daemon=True,
+            args=(self.camerafeed, worker_connection, self._stop_event,
+                  self.buffer_seconds, self.buffer_bytes, self.worker_fps))
+        self.process.start()
+        worker_connection.close()
+
+    def handle_messages(self, timeout=0):
+        """Handles anything the worker has sent, attaching to its buffer once ready"""
+        try:
+            while self._connection.poll(timeout):
+                timeout = 0
+                message = self._connection.recv()
+                match message:
+                    case ("ready", name, shape, dtype, slots, fps):
+                        self.release_buffer()
+                        # A new worker numbers its frames from 1 again, forget the
+                        # encodes and stored captures of the last one
+                        self.encode_cache.clear()
+                        with self._store_lock:
+                            self._last_stored.clear()
+                        self.buffer = SharedFrameBuffer.attach(name, shape, dtype, slots, fps)
+                        self._seen_sequence = 0
+                    case ("error", description):
+                        self.stats.record_failure()
+                        en.notify(en.SubscribedEventType.ERROR_EVENT,
+                                  logging_level=en.LoggingLevel.WARNING,
+                                  error_location=type(self).__name__,
+                                  description=description)
+        except (EOFError, OSError):
+            pass
+
+    def release_buffer(self):
+        """Detaches from and removes the shared buffer of the last worker"""
+        if isinstance(self.buffer, SharedFrameBuffer):
+            buffer = self.buffer
+            self.buffer = FrameRingBuffer(seconds=0)
+            buffer.close(unlink=True)
+
+    def stop_worker(self, timeout=2.0):
+        """Asks the worker to stop, forcing it if it does not and cleans up after it"""
+        self._stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.handle_messages()
+        self.release_buffer()
+
+    def run(self):
+        """Watches the worker process, the MosaicDisplay draws its frames when shown"""
+        while not self.is_quitting:
+            self.handle_messages(timeout=0.03)
+            if not self.process.is_alive() and not self.is_quitting:
+                self.handle_messages()
+                self.release_buffer()
+                if self.restarts >= self.max_restarts:
+                    en.notify(en.SubscribedEventType.ERROR_EVENT,
+                              logging_level=en.LoggingLevel.ERROR,
+                              error_location=type(self).__name__,
+                              description=f"Camera {self.feed_name} worker stopped, "
+                                          f"exit code {self.process.exitcode}")
+                    self.is_quitting = True
+                    break
+                en.notify(en.SubscribedEventType.ERROR_EVENT,
+                          logging_level=en.LoggingLevel.WARNING,
+                          error_location=type(self).__name__,
+                          description=f"Restarting camera {self.feed_name} worker, "
+                                      f"exit code {self.process.exitcode}")
+                time.sleep(self.restart_delay)
+                self.restarts += 1
+                self.stats.restarts = self.restarts
+                self.start_worker()
+                continue
+            # Frames are read in the worker, count them from the buffer's sequence
+            sequence = self.buffer.sequence
+            self.stats.record_frames(max(0, sequence - self._seen_sequence), time.monotonic())
+            self._seen_sequence = max(self._seen_sequence, sequence)
+        self.stop_worker()
+        self.destroy_feed()
+
+    def request_frame(self):
+        """The worker decodes at its own rate, there is nothing to ask for"""
+        pass
+
+    def wait_for_frame(self, after_sequence=0, timeout=None):
+        """Blocks until the worker publishes a frame newer than after_sequence, the
+            buffer is swapped whenever the worker restarts so it is waited on in steps"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            step = 0.05 if deadline is None else min(0.05, max(0, deadline - time.monotonic()))
+            handoff = self.buffer.wait_for_frame(after_sequence, step)
+            if handoff is not None or (deadline is not None and time.monotonic() >= deadline):
+                return handoff
+
+    def quit(self):
+        """Stops the worker, display and monitoring thread"""
+        self.is_quitting = True
+        self._stop_event.set()
+        if not self.is_alive():
+            self.stop_worker()
+
 class CameraManager:
     """Manages all the camera inputs to the system"""
-    def __init__(self, cameraFeeds=None):
-        """Sets up all camera(s) supplied"""
+    def __init__(self, cameraFeeds=None, buffer_seconds=2.0, buffer_bytes=DEFAULT_BUFFER_BYTES,
+                 analysis_fps=None, use_processes=False, codec=None, codecs=None,
+                 display_fps=10.0, display_size=(1280, 720), write_workers=None):
+        """Sets up all camera(s) supplied, each camera keeps buffer_seconds of frames
+            within a memory budget of buffer_bytes and decodes at analysis_fps.
+            use_processes reads each camera in its own worker process.
+            Captures are encoded with codec, or the codec in codecs named for the camera.
+            Setting capture_store saves the captures through a deduplicating CaptureStore.
+            Shown cameras are tiled into one display_size window refreshed display_fps
+            times a second. Snapshots are latched and written on a pool of write_workers
+            threads, by default a few more than there are cores"""
         self.cameras: dict[str: Camera] = {}
+        self.buffer_seconds = buffer_seconds
+        self.buffer_bytes = buffer_bytes
+        self.analysis_fps = analysis_fps
+        self.camera_type = ProcessCamera if use_processes else Camera
+        self.codec = codec
+        self.codecs = codecs if codecs else {}
+        self.capture_store = None
+        self.motion_analyser = None
+        self.display_fps = display_fps
+        self.display_size = display_size
+        # Only started once a camera is first shown
+        self.display = None
+        # Seconds each camera took to open, opening a device can take a second or more
+        self.open_seconds = {}
+        self.write_workers = write_workers if write_workers else min(32, (os.cpu_count() or 1) + 4)
+        self._write_pool = None
+        self._pool_lock = threading.Lock()
+        self._is_closed = False
+        # Seconds between the earliest and latest frame of each snapshot
+        self.snapshot_spread = Histogram()
+        self.last_snapshot_spread = None
         match cameraFeeds:
             case None:
                 print("Defaulting to webcam 0")
                 self.add_camera(0)
             case list():
-                for feed in cameraFeeds:
-                    self.add_camera(feed)
+                self.add_cameras(cameraFeeds)
             case int():
                 print(f"Accessing camera number {cameraFeeds}")
                 self.add_camera(cameraFeeds)
@@ -116,9 +447,28 @@ class CameraManager:
                 print("Invalid input type")
                 return
 
-    def add_camera(self, feed):
+    def open_camera(self, feed, codec=None):
+        """Creates the camera object for a feed, timing how long it takes to open"""
+        codec = codec if codec else self.codecs.get(str(feed), self.codec)
+        started = time.monotonic()
+        camera = self.camera_type(feed, buffer_seconds=self.buffer_seconds,
+                                  buffer_bytes=self.buffer_bytes,
+                                  analysis_fps=self.analysis_fps, codec=codec)
+        self.open_seconds[str(feed)] = time.monotonic() - started
+        return camera
+
+    def add_camera(self, feed, codec=None):
         """Adds the camera object to the manager"""
-        self.cameras.update({str(feed) : Camera(feed)})
+        self.cameras.update({str(feed) : self.open_camera(feed, codec)})
+
+    def add_cameras(self, feeds, max_workers=16):
+        """Opens several cameras at once and adds them in the order given, so startup
+            waits on the slowest camera rather than the sum of them"""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                   thread_name_prefix="camera-open") as pool:
+            cameras = list(pool.map(self.open_camera, feeds))
+        for feed, camera in zip(feeds, cameras):
+            self.cameras[str(feed)] = camera
 
     def remove_camera(self, feed):
         """Removes the camera object from the manager"""
@@ -150,10 +500,18 @@ class CameraManager:
                 return
         return self.cameras[name]
 
+    def start_display(self):
+        """Starts the display thread if it is not already running"""
+        if self.display is None:
+            self.display = MosaicDisplay(self, fps=self.display_fps,
+                                         canvas_size=self.display_size)
+            self.display.start()
+
     def display_camera(self, name=None):
-        """Enables/ opens up a window to display the feed of a given camera"""
+        """Adds the feed of a given camera to the display window"""
         try:
             self.cameras[str(name)].enable_feed()
+            self.start_display()
         except KeyError as e:
             en.notify(en.SubscribedEventType.ERROR_EVENT,
                       logging_level=en.LoggingLevel.WARNING,
@@ -171,9 +529,10 @@ class CameraManager:
                       description=f"No camera found: {e}")
 
     def show_all_cameras(self):
-        """Enables/ opens up a window to display the feed of all cameras"""
+        """Tiles the feeds of all cameras in the display window"""
         for camera in self.cameras.values():
             camera.is_showing = True
+        self.start_display()
 
     def hide_all_cameras(self):
         """Stops the display the feed of all cameras"""
@@ -182,20 +541,53 @@ class CameraManager:
 
     def quit_all(self):
         """Closes all captures and threads of all cameras"""
+        self.disable_motion_detection()
+        if self.display:
+            self.display.quit()
         for camera in self.cameras.values():
             camera.quit()
+        with self._pool_lock:
+            self._is_closed = True
+            write_pool, self._write_pool = self._write_pool, None
+        if write_pool:
+            write_pool.shutdown()
+
+    def _pool(self):
+        """The pool snapshots are latched and written on, started on first use and
+            None once the manager has quit"""
+        with self._pool_lock:
+            if self._write_pool is None and not self._is_closed:
+                self._write_pool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.write_workers, thread_name_prefix="capture-write")
+            return self._write_pool
+
+    def _map(self, function, items):
+        """function applied to every item, on the pool if there is more than one and
+            on the calling thread once the manager has quit"""
+        pool = self._pool() if len(items) > 1 and self.write_workers > 1 else None
+        if pool is None:
+            return [function(item) for item in items]
+        return list(pool.map(function, items))
+
+    def enable_motion_detection(self, fps=5, zones=None, **detector_settings):
+        """Starts analysing every camera for motion, which notifies PERSON_DETECTED
+            security events. See MotionDetector for the detector settings"""
+        if self.motion_analyser:
+            return
+        self.motion_analyser = MotionAnalyser(self, fps=fps, zones=zones, **detector_settings)
+        self.motion_analyser.start()
+
+    def disable_motion_detection(self):
+        """Stops the motion analysis thread if it is running"""
+        if self.motion_analyser:
+            self.motion_analyser.quit()
+            self.motion_analyser = None
 
     def capture(self, file_location, camera=None):
-        """Captures images on all cameras to the given file location"""
+        """Captures images on all cameras to the given file location, every camera's
+            frame from the same instant"""
         if not camera:
-            for camera_name in self.cameras.keys():
-                try:
-                    self.capture(file_location=file_location, camera=camera_name)
-                except Exception as e:
-                    en.notify(en.SubscribedEventType.ERROR_EVENT,
-                        logging_level=en.LoggingLevel.WARNING,
-                        error_location=type(self).__name__,
-                        description=f"No capture available for {camera_name} {e}")
+            self.write_snapshot(file_location, self.snapshot())
         else:
             try:
                 self.cameras[str(camera)].capture(file_location)
@@ -205,3 +597,62 @@ class CameraManager:
                         error_location=type(self).__name__,
                         description=f"No camera found: {e}")
 
+    def resolve_cameras(self, names):
+        """The keys of the cameras named by key (the feed) or feed_name (the name their
+            images are saved under), in the manager's order. Unknown names are left out"""
+        wanted = {str(name) for name in names}
+        return [key for key, camera in list(self.cameras.items())
+                if key in wanted or camera.feed_name in wanted]
+
+    def snapshot(self, timestamp=None, decode_timeout=0.1, fresh_within=0.1, cameras=None):
+        """Latches every camera's frame nearest to one instant, the timestamp if given
+            or now, returns a dictionary of camera name to frame for writing later.
+            cameras limits it to the cameras named (see resolve_cameras).
+            Cameras only grabbing are all asked to decode before any is waited on, so
+            the grabs happen together and take as long as the slowest camera rather
+            than the sum. The spread of the frame times is kept in snapshot_spread"""
+        if cameras is None:
+            cameras = list(self.cameras.items())
+        else:
+            cameras = [(key, self.cameras[key]) for key in self.resolve_cameras(cameras)]
+        stale = [(camera, camera.buffer.sequence) for _, camera in cameras
+                 if camera.needs_fresh_frame(fresh_within)]
+        for camera, _ in stale:
+            camera.request_frame()
+        deadline = time.monotonic() + decode_timeout
+        for camera, sequence in stale:
+            camera.wait_for_frame(sequence, max(0.0, deadline - time.monotonic()))
+        instant = time.time() if timestamp is None else timestamp
+        latched = self._map(lambda item: item[1].buffer.nearest(instant), cameras)
+        frames = {camera_name : frame for (camera_name, _), frame in zip(cameras, latched)}
+        frame_times = [frame.timestamp for frame in latched if frame is not None]
+        if frame_times:
+            self.last_snapshot_spread = max(frame_times) - min(frame_times)
+            self.snapshot_spread.observe(self.last_snapshot_spread)
+        return frames
+
+    def export_clips(self, file_location, event_time, pre_roll=2.0, post_roll=2.0, cameras=None):
+        """Exports a pre and post roll clip around the event time from every camera, or
+            only those named in cameras"""
+        keys = self.cameras if cameras is None else self.resolve_cameras(cameras)
+        for key in list(keys):
+            self.cameras[key].export_clip(file_location, event_time, pre_roll, post_roll)
+
+    def write_snapshot(self, file_location, frames, codec=None):
+        """Writes the frames of a snapshot into the given file location, encoding
+            them in parallel on the write pool with the codec given or each camera's own"""
+        def write(item):
+            camera_name, frame = item
+            try:
+                return self.cameras[camera_name].write_frame(file_location, frame,
+                                                             self.capture_store, codec)
+            except KeyError as e:
+                en.notify(en.SubscribedEventType.ERROR_EVENT,
+                        logging_level=en.LoggingLevel.WARNING,
+                        error_location=type(self).__name__,
+                        description=f"No camera found: {e}")
+                return None, None
+        stored = {image_name : blob_id
+                  for image_name, blob_id in self._map(write, list(frames.items())) if blob_id}
+        if self.capture_store:
+            self.capture_store.record_event(file_location, stored)
@@ -7,16 +7,31 @@ Description:      Central manager of the security system and command line interf
                   concurrent processes
 """
 
+import time
+# Taken ahead of the other imports so the startup report includes them
+STARTED = time.monotonic()
 import os
 import cmd
 import threading
+import json
 import datetime
 import argparse
 import logging_handler
 import event_notifier as en
 from event_logger import EventLogger
+from event_store import open_store
 from security_camera import CameraManager
+from capture_pipeline import CapturePipeline
+from image_codec import CaptureCodec
+from capture_store import CaptureStore
 from security_states import SecurityStateMachine
+from checkpoint_pool import CheckpointPool
+from allowlist import AccessPolicy, Allowlist
+from metrics import EventMetrics, MetricsServer, StartupTimer, collect, startup_summary
+from retention import RetentionPolicy, RetentionPruner
+from ingest import IngestServer
+from storm_control import StormControl, parse_windows, CAPTURE, MERGE
+from topology import CameraTopology
 
 __author__ = "Benjamin Vernon-Bosley"
 __copyright__ = "Livestock Visibility Solutions"
@@ -93,6 +108,30 @@ class CommandUI(cmd.Cmd, threading.Thread):
         else:
             self.manager.camera_manager.hide_camera(camera)
 
+    def do_checkpoint(self, args):
+        """Runs a state machine action at a named checkpoint, its session is created on
+            first use. eg: checkpoint gate-1 open 42"""
+        checkpoint_args = args.split(" ")
+        if len(checkpoint_args) not in (2, 3):
+            print(f"Wrong number of arguments: {len(checkpoint_args)}")
+            en.notify(en.SubscribedEventType.ERROR_EVENT,
+                      logging_level=en.LoggingLevel.WARNING,
+                      error_location=type(self).__name__,
+                      description=f"Wrong number of arguments: {len(checkpoint_args)}")
+            return
+        checkpoint, action = checkpoint_args[:2]
+        argument = checkpoint_args[2] if len(checkpoint_args) == 3 else None
+        self.manager.security_action(action, argument, checkpoint=checkpoint)
+
+    def do_reload_allowlist(self, args):
+        """Reloads the allowlist files without stopping the checkpoints"""
+        if self.manager.allowlist.reload():
+            print(f"Allowlist reloaded: {self.manager.allowlist.stats()}")
+
+    def do_stats(self, args):
+        """Prints camera frame rates, event stage latencies and subscriber timings"""
+        print(json.dumps(collect(self.manager), indent=2, default=str))
+
     def do_trigger_event(self, args):
         print(f"Triggering event {args}")
         self.manager.trigger_event(args)
@@ -100,21 +139,100 @@ class CommandUI(cmd.Cmd, threading.Thread):
 
 class SecurityManager():
     """Main security interface"""
-    def __init__(self, camera_feed=None):
-        logging_handler.logging_init()
-        self.camera_manager = CameraManager(camera_feed)
+    def __init__(self, camera_feed=None, capture_workers=2, capture_queue_size=32,
+                 buffer_seconds=2.0, pre_roll=0.0, post_roll=0.0, analysis_fps=None,
+                 motion_fps=None, camera_processes=False, codec=None, dedupe_captures=False,
+                 allowlist=None, checkpoint_workers=4, camera_manager=None, logger=None,
+                 capture_path=None, interactive=True, metrics_port=None, retention=None,
+                 event_store=None, startup=None, ingest_port=None, storm_control=None,
+                 topology=None, near_duplicate_threshold=0):
+        """camera_manager, logger and capture_path replace the defaults (such as stub
+            cameras for a replay), the CommandUI only runs if interactive.
+            metrics_port serves Prometheus metrics on that local port, 0 picks a free one.
+            retention is a RetentionPolicy applied to the events and captures in the
+            background. event_store is the path of the event log, the default logger
+            loads its history in the background. startup is a StartupTimer to carry on
+            timing with, such as one started before the imports. ingest_port takes
+            sensor triggers over TCP on that local port, 0 picks a free one.
+            storm_control is a StormControl to debounce and cap the captures with.
+            topology is a CameraTopology, or the path of its JSON config, choosing the
+            cameras each event captures. near_duplicate_threshold opts the deduplicated
+            captures in to lossy near duplicate reuse (see CaptureStore)"""
+        self.startup = startup if startup else StartupTimer()
+        with self.startup.phase("logging"):
+            logging_handler.logging_init()
+        with self.startup.phase("cameras"):
+            if camera_manager is None:
+                camera_manager = CameraManager(camera_feed, buffer_seconds=buffer_seconds,
+                                               analysis_fps=analysis_fps,
+                                               use_processes=camera_processes, codec=codec)
+            self.camera_manager = camera_manager
+        # Seconds of video either side of an event to save as a clip, none if both zero
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        if capture_path is None:
+            capture_path = os.path.dirname(os.path.realpath('__file__')) + "\\event_captures"
+        self.capture_path = capture_path
+        if dedupe_captures:
+            self.camera_manager.capture_store = CaptureStore(
+                self.capture_path, near_threshold=near_duplicate_threshold)
 
-        self.logger = EventLogger()
-        self.simulator = SecurityStateMachine(allowable_ids=[42, 100, 55])
-        self.ui = CommandUI(self)
+        with self.startup.phase("event_log"):
+            self.logger = logger if logger else EventLogger(open_store(event_store), lazy=True)
+        self.capture_pipeline = CapturePipeline(workers=capture_workers,
+                                                max_queue=capture_queue_size)
+        self.event_metrics = EventMetrics()
+        self.metrics_server = (MetricsServer(self, metrics_port) if metrics_port is not None
+                               else None)
+        self.ingest_server = (IngestServer(self.trigger_event, ingest_port)
+                              if ingest_port is not None else None)
+        with self.startup.phase("checkpoints"):
+            # A JSON config of scoped lists, a file of IDs or the IDs themselves
+            if isinstance(allowlist, str) and allowlist.endswith(".json"):
+                self.allowlist = AccessPolicy(config_path=allowlist)
+            elif isinstance(allowlist, str):
+                self.allowlist = AccessPolicy([Allowlist(path=allowlist)])
+            else:
+                self.allowlist = AccessPolicy.of(allowlist if allowlist is not None
+                                                 else [42, 100, 55])
+            self.simulator = SecurityStateMachine(allowable_ids=self.allowlist)
+            self.checkpoints = CheckpointPool(workers=checkpoint_workers,
+                                              allowable_ids=self.allowlist)
+        self.ui = CommandUI(self) if interactive else None
+        self.pruner = (RetentionPruner(self.logger, retention, capture_root=self.capture_path,
+                                       capture_store=self.camera_manager.capture_store)
+                       if retention is not None else None)
+        self.storm_control = storm_control
+        self.topology = (CameraTopology(config_path=topology) if isinstance(topology, str)
+                         else topology)
+        if self.topology:
+            self.topology.validate(self.camera_manager)
+        if self.storm_control and self.storm_control.on_close is None:
+            self.storm_control.on_close = self.close_repeats
 
-        self.threads = []
-        self.setup_camera_threads()
-        self.threads.append(self.ui)
-        for thread in self.threads:
-            thread.start()
+        with self.startup.phase("threads"):
+            self.threads = []
+            self.setup_camera_threads()
+            if self.ui:
+                self.threads.append(self.ui)
+            if self.metrics_server:
+                self.threads.append(self.metrics_server)
+            if self.pruner:
+                self.threads.append(self.pruner)
+            if self.ingest_server:
+                self.threads.append(self.ingest_server)
+            if self.storm_control:
+                self.threads.append(self.storm_control)
+            for thread in self.threads:
+                thread.start()
 
-        en.subscribe(en.SubscribedEventType.SECURITY_EVENT, self.trigger_event)
+        # Events are snapshotted on the notifier's worker thread so the state machine
+        # and sensors never wait on the cameras
+        en.subscribe(en.SubscribedEventType.SECURITY_EVENT, self.trigger_event,
+                     asynchronous=True)
+        self.startup.mark_ready()
+        if motion_fps:
+            self.camera_manager.enable_motion_detection(fps=motion_fps)
 
     def setup_camera_threads(self):
         """Adds the camera display loops to the central threading task"""
@@ -122,25 +240,65 @@ class SecurityManager():
             print(f"Adding {camera_name}")
             self.threads.append(camera)
 
-    def security_action(self, action, arguments=None):
-        """Searches for available actions in the statemachine and calls it"""
+    def security_action(self, action, arguments=None, checkpoint=None):
+        """Searches for available actions in the statemachine and calls it, actions for
+            a checkpoint are queued on that checkpoint's session instead"""
         print(f"Action: {action}")
+        if checkpoint is not None:
+            self.checkpoints.submit(checkpoint, action, arguments)
+            return
         function = getattr(self.simulator, action)
         function(arguments)
 
-    def trigger_event(self, event_id):
-        time = datetime.datetime.now()
-        formatted_time = f"{time.year}-{time.month}-{time.day}_{time.hour}h{time.minute}m{time.second}s"
+    def trigger_event(self, /, event_id, **kwargs):
+        """Snapshots every camera's frame and queues the images and event to be saved,
+            returns without waiting on the disk. Extra arguments (such as the camera
+            that detected motion) are stored with the event. With storm control, repeats
+            inside a debounce window only add to the count of the event they repeat and
+            captures over the limit are shed. With a topology only the cameras mapped to
+            the event's source are captured"""
+        triggered = time.monotonic()
+        notified = en.notified_at() or triggered
+        event_time = datetime.datetime.now()
+        formatted_time = (f"{event_time.year}-{event_time.month}-{event_time.day}_"
+                          f"{event_time.hour}h{event_time.minute}m{event_time.second}s")
         folder_name = f"event_{event_id}_{formatted_time}"
 
-        path = os.path.dirname(os.path.realpath('__file__')) + "\\event_captures"
-        if not os.path.exists(path):
-            os.mkdir("event_captures")
-        folder_path = path + "\\" + folder_name
-        os.makedirs(name=folder_path)
-        self.camera_manager.capture(folder_path)
+        folder_path = self.capture_path + "\\" + folder_name
+        if self.storm_control:
+            decision, window = self.storm_control.admit(event_id, kwargs, folder_path,
+                                                        str(event_time), triggered)
+            if decision == MERGE:
+                self.logger.amend_event(window.folder_path, persist=False,
+                                        repeats=window.count, last_repeat=window.last_time)
+            if decision != CAPTURE:
+                return
+        route = self.topology.route_for(kwargs, self.camera_manager) if self.topology else None
+        frames = self.camera_manager.snapshot(event_time.timestamp(),
+                                              cameras=route.cameras if route else None)
+        captured = time.monotonic()
+        def save():
+            self.save_event(event_id, folder_path, event_time, frames, route, **kwargs)
+            self.event_metrics.record(notified, triggered, captured, time.monotonic())
+        self.capture_pipeline.submit(save)
+
+    def save_event(self, event_id, folder_path, time, frames, route=None, /, **kwargs):
+        """Run by the capture pipeline, writes the snapshotted frames and logs the event.
+            A CaptureRoute sets the codec and the cameras clips are exported from"""
+        os.makedirs(name=folder_path, exist_ok=True)
+        self.camera_manager.write_snapshot(folder_path, frames, route.codec if route else None)
+        if self.pre_roll or self.post_roll:
+            self.camera_manager.export_clips(folder_path, time.timestamp(),
+                                             self.pre_roll, self.post_roll,
+                                             cameras=route.cameras if route else None)
+
+        self.logger.log_event(event_type=event_id, image_path=folder_path, event_time=str(time),
+                              **kwargs)
 
-        self.logger.log_event(event_type=event_id, image_path=folder_path, event_time=str(time))
+    def close_repeats(self, window):
+        """Saves the final count of a closed debounce window to the event it repeated"""
+        self.logger.amend_event(window.folder_path, repeats=window.count,
+                                last_repeat=window.last_time)
 
     def show_all(self):
         """Enable all camera threads to show in a new window"""
@@ -152,19 +310,97 @@ class SecurityManager():
 
     def quit(self):
         """Calls for all processes to quit"""
+        en.unsubscribe(en.SubscribedEventType.SECURITY_EVENT, self.trigger_event)
+        if self.ingest_server:
+            self.ingest_server.quit()
+        self.checkpoints.shutdown()
+        if self.metrics_server:
+            self.metrics_server.quit()
+        if self.pruner:
+            self.pruner.quit()
+        # Queued captures are written before the cameras and their write pool close
+        self.capture_pipeline.shutdown()
         self.camera_manager.quit_all()
+        if self.storm_control:
+            self.storm_control.quit()
+        self.logger.close()
+        logging_handler.logging_shutdown()
 
 
 if __name__ == "__main__":
     # For multiple cameras add -c before each camera input
     # eg: python security_manager.py -c 0 -c 1 -c 2
+    # Virtual cameras need no hardware, eg: -c synthetic://gate1 -c loop://yard.avi
     parser = argparse.ArgumentParser(prog="LVS Security Application",
                                      description="A basic security system simulation")
     parser.add_argument("-c", "--camera", action='append', required=False)
+    # Only grab frames and decode this many a second, 0 decodes on demand only
+    parser.add_argument("--analysis-fps", type=float, required=False)
+    # Detect motion on every camera this many times a second
+    parser.add_argument("--motion-fps", type=float, required=False)
+    # Read each camera in its own worker process rather than a thread
+    parser.add_argument("--processes", action='store_true')
+    # Capture image format and quality, eg: --image-format jpg --image-quality 85
+    parser.add_argument("--image-format", default="png", choices=["png", "jpg", "webp"])
+    parser.add_argument("--image-quality", type=int, default=90)
+    # Save each unique capture image once and link it into the event folders
+    parser.add_argument("--dedupe", action='store_true')
+    # Lossy, reuse a camera's last capture when its new frame differs by less than
+    # this mean grey level, a small change in the scene can go unsaved
+    parser.add_argument("--near-duplicate-threshold", type=float, default=0)
+    # A file of allowed IDs (.txt or sorted .npy) or a .json config of scoped lists
+    parser.add_argument("--allowlist", required=False)
+    # Where events are logged, a .db or .sqlite path uses the SQLite store
+    parser.add_argument("--event-store", required=False)
+    # Serve Prometheus metrics at http://127.0.0.1:<port>/metrics
+    parser.add_argument("--metrics-port", type=int, required=False)
+    # Delete events and their captures older than this, or past this many bytes of
+    # captures. --retain overrides the days for a type, eg: --retain PERSON_DETAINED=90
+    parser.add_argument("--retention-days", type=float, required=False)
+    parser.add_argument("--retention-bytes", type=int, required=False)
+    parser.add_argument("--retain", action='append', default=[])
+    # Take triggers from external sensors over TCP on this local port
+    parser.add_argument("--ingest-port", type=int, required=False)
+    # Merge repeats of an event type from one source within this many seconds into the
+    # first, for every source or one, eg: --debounce PERSON_DETECTED@gate-3=30
+    parser.add_argument("--debounce", action='append', default=[])
+    # Shed captures beyond this many a second, with bursts of up to --capture-burst
+    parser.add_argument("--max-captures-per-second", type=float, required=False)
+    parser.add_argument("--capture-burst", type=float, required=False)
+    # A JSON config of the cameras each checkpoint or sensor captures
+    parser.add_argument("--topology", required=False)
+    # Print how long each part of startup took once the event history has loaded
+    parser.add_argument("--startup-report", action='store_true')
     args = parser.parse_args()
-    # Integers parsed in will be counted as strings, this changes it back
+    # Integers parsed in will be counted as strings, this changes it back. Other feeds
+    # such as synthetic://gate1?size=1280x720 are kept as they are
     if args.camera:
-        camera_input = [int(camera) for camera in args.camera if camera.isdigit()]
+        camera_input = [int(camera) if camera.isdigit() else camera for camera in args.camera]
     else:
         camera_input = None
-    manager = SecurityManager(camera_input)
+    retention = None
+    if args.retention_days is not None or args.retention_bytes is not None or args.retain:
+        rules = dict(rule.split("=", 1) for rule in args.retain)
+        retention = RetentionPolicy(max_age_days=args.retention_days,
+                                    max_bytes=args.retention_bytes,
+                                    rules={event_type : float(days)
+                                           for event_type, days in rules.items()})
+    storm_control = None
+    if args.debounce or args.max_captures_per_second:
+        storm_control = StormControl(parse_windows(args.debounce),
+                                     rate=args.max_captures_per_second,
+                                     burst=args.capture_burst)
+    startup = StartupTimer(STARTED)
+    startup.record("imports", time.monotonic() - STARTED)
+    manager = SecurityManager(camera_input, analysis_fps=args.analysis_fps,
+                              motion_fps=args.motion_fps, camera_processes=args.processes,
+                              codec=CaptureCodec(args.image_format, quality=args.image_quality),
+                              dedupe_captures=args.dedupe, allowlist=args.allowlist,
+                              metrics_port=args.metrics_port, retention=retention,
+                              event_store=args.event_store, startup=startup,
+                              ingest_port=args.ingest_port, storm_control=storm_control,
+                              topology=args.topology,
+                              near_duplicate_threshold=args.near_duplicate_threshold)
+    if args.startup_report:
+        manager.logger.wait_loaded()
+        print(json.dumps(startup_summary(manager), indent=2))
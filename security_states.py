@@ -9,6 +9,7 @@ Description:    Security state machine designed to trigger specific events.
 
 from statemachine import StateMachine, State
 import event_notifier as en
+from allowlist import AccessPolicy
 
 __author__ = "Benjamin Vernon-Bosley"
 __copyright__ = "Livestock Visibility Solutions"
@@ -39,47 +40,59 @@ class SecurityStateMachine(StateMachine):
     ignore = hacking.to(allowed)
     move_on = (detained.to(idle) | allowed.to(idle))
 
-    def __init__(self, allowable_ids=[42, 50], print_actions=True):
-        """Initialises the prameters for the state machine"""
+    def __init__(self, allowable_ids=(42, 50), print_actions=True, checkpoint=None):
+        """Initialises the prameters for the state machine, events are tagged with
+            the checkpoint if one is given. allowable_ids is a list of IDs or an
+            AccessPolicy, which can be shared between machines"""
         self.max_tries = 3
         self.current_tries = 0
         self.detain_individual = False
         self.id_accepted = False
-        self.allowable_ids = allowable_ids
+        self.allowable_ids = AccessPolicy.of(allowable_ids)
         self.user_id = None
         self.print_actions = print_actions
+        self.checkpoint = checkpoint
         super(SecurityStateMachine, self).__init__()
 
+    def notify_event(self, event_id):
+        """Notifies a security event, tagged with the checkpoint when there is one"""
+        if self.checkpoint is None:
+            en.notify(en.SubscribedEventType.SECURITY_EVENT, event_id=event_id)
+        else:
+            en.notify(en.SubscribedEventType.SECURITY_EVENT, event_id=event_id,
+                      checkpoint=self.checkpoint)
+
+    def reset(self, checkpoint=None):
+        """Returns the machine to idle with no person, so it can be reused for another
+            checkpoint rather than built again"""
+        self.current_state_value = self.initial_state.value
+        self.on_enter_idle()
+        self.checkpoint = checkpoint
+
 
     def before_identify(self):
         """At the start of the identify action, determines if tried too many times"""
         self.current_tries += 1
         self.detain_individual = (self.current_tries >= self.max_tries)
-        en.notify(en.SubscribedEventType.SECURITY_EVENT,
-                  event_id=en.EventTypes.PERSON_ID_ATTEMPT)
+        self.notify_event(en.EventTypes.PERSON_ID_ATTEMPT)
         if self.id_accepted:
-            en.notify(en.SubscribedEventType.SECURITY_EVENT,
-                  event_id=en.EventTypes.PERSON_ID_SUCCESS)
+            self.notify_event(en.EventTypes.PERSON_ID_SUCCESS)
         else:
-            en.notify(en.SubscribedEventType.SECURITY_EVENT,
-                    event_id=en.EventTypes.PERSON_ID_FAIL)
+            self.notify_event(en.EventTypes.PERSON_ID_FAIL)
 
     def before_open(self, user_id):
         """At the start of the open action, reads and compares the given id"""
         self.user_id = int(user_id)
-        self.id_accepted = self.user_id in self.allowable_ids
-        en.notify(en.SubscribedEventType.SECURITY_EVENT,
-                  event_id=en.EventTypes.PERSON_DETECTED)
+        self.id_accepted = self.allowable_ids.allows(self.user_id, checkpoint=self.checkpoint)
+        self.notify_event(en.EventTypes.PERSON_DETECTED)
 
     def on_enter_allowed(self):
         """On entry to the allowed state, notify"""
-        en.notify(en.SubscribedEventType.SECURITY_EVENT,
-                  event_id=en.EventTypes.PERSON_ENTER)
+        self.notify_event(en.EventTypes.PERSON_ENTER)
 
     def on_enter_detained(self):
         """On entry to the detained state, notify"""
-        en.notify(en.SubscribedEventType.SECURITY_EVENT,
-                  event_id=en.EventTypes.PERSON_DETAINED)
+        self.notify_event(en.EventTypes.PERSON_DETAINED)
 
     def on_enter_idle(self):
         """On entry to the idle state, reset the person variables"""
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+"""
+File:             shared_frames.py
+Date:             17/10/2026
+Description:      Shared memory frame transport for cameras read in worker processes.
+                  Each worker process decodes its camera into a ring of frame slots in
+                  a multiprocessing.shared_memory block, the main process reads the
+                  slots in place as NumPy views.
+                  Each slot carries a sequence number that is cleared while the slot is
+                  being written, readers check it before and after using a slot so a
+                  frame overwritten mid read is never handed on. Closing waits for
+                  reads in progress, reads after it find no frames
+"""
+
+import math
+import time
+import threading
+import contextlib
+import numpy as np
+import cv2 as cv
+from multiprocessing import shared_memory
+from frame_buffer import BufferedFrame
+from frame_sources import open_source
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+# Header fields, [latest slot, sequence counter] then (sequence, timestamp, monotonic)
+# for every slot, all float64
+STATE_FIELDS = 2
+SLOT_FIELDS = 3
+HEADER_ALIGN = 64
+
+def header_bytes(slots):
+    """Bytes taken by the header of a ring with the given number of slots"""
+    size = 8 * (STATE_FIELDS + SLOT_FIELDS * slots)
+    return -(-size // HEADER_ALIGN) * HEADER_ALIGN
+
+class SharedFrameBuffer:
+    """Ring of frame slots inside a shared memory block.
+        The worker process is the only writer, through acquire and commit. The
+        reading side matches FrameRingBuffer so cameras can use either, and once the
+        buffer is closed it reads as empty"""
+    def __init__(self, memory, shape, dtype, slots, fps=30):
+        self.memory = memory
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.capacity = slots
+        self.fps = fps if fps and fps > 0 else 30
+        offset = header_bytes(slots)
+        self._state = np.ndarray((STATE_FIELDS,), dtype=np.float64, buffer=memory.buf)
+        self._meta = np.ndarray((slots, SLOT_FIELDS), dtype=np.float64,
+                                buffer=memory.buf, offset=8 * STATE_FIELDS)
+        self._slots = np.ndarray((slots,) + self.shape, dtype=self.dtype,
+                                 buffer=memory.buf, offset=offset)
+        self._readers = 0
+        self._is_closed = False
+        self._reader_lock = threading.Lock()
+
+    @classmethod
+    def create(cls, shape, dtype, slots, fps=30):
+        """Creates a new shared memory block sized for the frames, used by the worker"""
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        memory = shared_memory.SharedMemory(create=True,
+                                            size=header_bytes(slots) + slots * frame_bytes)
+        buffer = cls(memory, shape, dtype, slots, fps)
+        buffer._state[:] = (-1, 0)
+        buffer._meta[:] = 0
+        return buffer
+
+    @classmethod
+    def attach(cls, name, shape, dtype, slots, fps=30):
+        """Attaches to the shared memory block created by a worker"""
+        return cls(shared_memory.SharedMemory(name=name), shape, dtype, slots, fps)
+
+    @property
+    def name(self):
+        """The name of the shared memory block"""
+        return self.memory.name
+
+    @contextlib.contextmanager
+    def _reading(self):
+        """Keeps the block mapped while a read uses it, yields False once closed"""
+        with self._reader_lock:
+            is_open = not self._is_closed
+            if is_open:
+                self._readers += 1
+        try:
+            yield is_open
+        finally:
+            if is_open:
+                with self._reader_lock:
+                    self._readers -= 1
+                    is_last = self._is_closed and self._readers == 0
+                if is_last:
+                    self._release()
+
+    @property
+    def sequence(self):
+        """The sequence number of the newest committed frame"""
+        with self._reading() as is_open:
+            return int(self._state[1]) if is_open else 0
+
+    def acquire(self):
+        """Returns the slot to read the next frame into and marks it as being written"""
+        head = (int(self._state[0]) + 1) % self.capacity
+        self._meta[head, 0] = 0
+        return self._slots[head]
+
+    def commit(self, frame, timestamp, monotonic=None):
+        """Publishes the acquired slot, copying the frame in if it was read elsewhere"""
+        head = (int(self._state[0]) + 1) % self.capacity
+        slot = self._slots[head]
+        if frame is not slot and not np.shares_memory(frame, slot):
+            np.copyto(slot, frame)
+        sequence = self._state[1] + 1
+        self._meta[head] = (sequence, timestamp,
+                            time.monotonic() if monotonic is None else monotonic)
+        self._state[:] = (head, sequence)
+        return slot
+
+    def _read(self, index, function):
+        """Runs function on a slot in place, retrying if the slot is rewritten part
+            way through. Returns (result, sequence, timestamp, monotonic) or None"""
+        for _ in range(3):
+            sequence, timestamp, monotonic = self._meta[index]
+            if sequence <= 0:
+                return None
+            result = function(self._slots[index])
+            if self._meta[index, 0] == sequence:
+                return result, int(sequence), timestamp, monotonic
+        return None
+
+    def view(self, index):
+        """A zero copy view of a slot, only valid until the writer comes back around"""
+        return self._slots[index]
+
+    def _latest_index(self):
+        """The slot of the newest frame, or None if nothing has been written"""
+        index = int(self._state[0])
+        return None if index < 0 else index
+
+    def latest(self):
+        """Returns a BufferedFrame copy of the newest frame, or None if there is none"""
+        with self._reading() as is_open:
+            index = self._latest_index() if is_open else None
+            read = None if index is None else self._read(index, np.copy)
+        return None if read is None else BufferedFrame(*read)
+
+    def latest_age(self):
+        """Seconds since the newest frame was published, None if there is none"""
+        with self._reading() as is_open:
+            index = self._latest_index() if is_open else None
+            if index is None or self._meta[index, 0] <= 0:
+                return None
+            return time.monotonic() - float(self._meta[index, 2])
+
+    def apply_latest(self, function):
+        """Runs function on the newest frame in place, returns the result and sequence"""
+        with self._reading() as is_open:
+            index = self._latest_index() if is_open else None
+            read = None if index is None else self._read(index, function)
+        return (None, None) if read is None else (read[0], read[1])
+
+    def nearest(self, timestamp):
+        """Returns a BufferedFrame copy of the frame closest in time to the timestamp"""
+        with self._reading() as is_open:
+            if not is_open:
+                return None
+            filled = [(abs(slot_time - timestamp), index)
+                      for index, (sequence, slot_time, _) in enumerate(self._meta.tolist())
+                      if sequence > 0]
+            for _, index in sorted(filled):
+                read = self._read(index, np.copy)
+                if read is not None:
+                    return BufferedFrame(*read)
+        return None
+
+    def frames(self, start, end):
+        """Returns copies of every buffered (timestamp, frame) between start and end,
+            oldest first"""
+        clip = []
+        with self._reading() as is_open:
+            for index, (sequence, slot_time, _) in enumerate(
+                    self._meta.tolist() if is_open else ()):
+                if sequence > 0 and start <= slot_time <= end:
+                    read = self._read(index, np.copy)
+                    if read is not None:
+                        clip.append((read[2], read[0]))
+        return sorted(clip, key=lambda item: item[0])
+
+    def wait_for_frame(self, after_sequence=0, timeout=None, poll_interval=0.005):
+        """Polls until a frame newer than after_sequence is published, there is no
+            shared condition across processes. Returns a BufferedFrame or None, at once
+            if the buffer is closed"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._reading() as is_open:
+                if not is_open:
+                    return None
+                index = self._latest_index()
+                if index is not None and int(self._state[1]) > after_sequence:
+                    read = self._read(index, np.copy)
+                    if read is not None:
+                        return BufferedFrame(*read)
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def wait_until(self, timestamp, timeout=None, poll_interval=0.005):
+        """Polls until a frame at or after the timestamp is published"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._reading() as is_open:
+                if not is_open:
+                    return False
+                index = self._latest_index()
+                if index is not None and self._meta[index, 1] >= timestamp:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(poll_interval)
+
+    def memory_bytes(self):
+        """The memory held by the frame slots"""
+        with self._reading() as is_open:
+            return self._slots.nbytes if is_open else 0
+
+    def close(self, unlink=False):
+        """Unlinks the block if asked and detaches from it once no read is using it,
+            reads started after this find the buffer empty"""
+        with self._reader_lock:
+            is_first = not self._is_closed
+            self._is_closed = True
+            is_idle = self._readers == 0
+        if unlink:
+            try:
+                self.memory.unlink()
+            except FileNotFoundError:
+                pass
+        if is_first and is_idle:
+            self._release()
+
+    def _release(self):
+        """Releases the views and detaches from the block"""
+        self._state = self._meta = self._slots = None
+        try:
+            self.memory.close()
+        except BufferError:
+            # A reader still holds a view, the mapping goes when that view does
+            pass
+
+def camera_worker(camerafeed, connection, stop_event, buffer_seconds, buffer_bytes,
+                  analysis_fps=None):
+    """Entry point of a camera worker process. Opens the camera, creates the shared
+        ring from the first frame's shape and reports it, then reads frames into the
+        ring until told to stop. Problems are sent back as ("error", description).
+        The ring is sized like FrameRingBuffer, by seconds of frames and a memory budget"""
+    camera_cap = open_source(camerafeed)
+    if not camera_cap.isOpened():
+        connection.send(("error", f"Camera {camerafeed} Unavailable"))
+        return
+    is_running, frame = camera_cap.read()
+    if not is_running:
+        connection.send(("error", "Camera capture is no longer running"))
+        return
+    fps = camera_cap.get(cv.CAP_PROP_FPS)
+    fps = fps if fps and fps > 0 else 30
+    slots = max(2, min(math.ceil(buffer_seconds * fps), buffer_bytes // max(1, frame.nbytes)))
+    buffer = SharedFrameBuffer.create(frame.shape, frame.dtype, slots, fps)
+    buffer.commit(frame, time.time())
+    connection.send(("ready", buffer.name, frame.shape, frame.dtype.str, slots, fps))
+    interval = 1 / analysis_fps if analysis_fps else 0
+    next_decode = 0.0
+    try:
+        while not stop_event.is_set():
+            if interval:
+                if not camera_cap.grab():
+                    connection.send(("error", "Camera capture is no longer running"))
+                    return
+                if time.monotonic() < next_decode:
+                    continue
+                next_decode = time.monotonic() + interval
+                is_running, frame = camera_cap.retrieve(buffer.acquire())
+            else:
+                is_running, frame = camera_cap.read(buffer.acquire())
+            if not is_running:
+                connection.send(("error", "Camera capture is no longer running"))
+                return
+            if frame.shape != buffer.shape:
+                connection.send(("error", f"Camera {camerafeed} changed resolution"))
+                return
+            buffer.commit(frame, time.time())
+    finally:
+        camera_cap.release()
+        buffer.close()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+File:             storm_control.py
+Date:             17/10/2026
+Description:      Debouncing and load shedding for security event captures.
+                  A chattering sensor or someone loitering can fire the same event
+                  over and over, each one capturing every camera. Repeats of an event
+                  type from the same source inside its debounce window are merged into
+                  the event already captured, counted rather than captured again, and a
+                  token bucket caps new captures a second across every source, shedding
+                  the rest with a summary logged every so often.
+                  eg: python security_manager.py --debounce PERSON_DETECTED=5
+                          --debounce PERSON_DETECTED@gate-3=30 --max-captures-per-second 2
+"""
+
+import time
+import threading
+import event_notifier as en
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+# The trigger arguments that name where an event came from, first found is used
+SOURCE_FIELDS = ("sensor", "camera", "checkpoint")
+CAPTURE = "capture"
+MERGE = "merge"
+SHED = "shed"
+
+def event_name(event_id):
+    """The EventTypes name of an event id, enum or string"""
+    if isinstance(event_id, en.EventTypes):
+        return event_id.name
+    return str(event_id).rsplit(".", 1)[-1].upper()
+
+def trigger_source(kwargs):
+    """The source of a trigger from its arguments, None if it does not say"""
+    for field in SOURCE_FIELDS:
+        if kwargs.get(field) is not None:
+            return str(kwargs[field])
+    return None
+
+def parse_windows(rules):
+    """Turns ["TYPE=seconds", "TYPE@source=seconds"] into {(TYPE, source): seconds},
+        source None for the type from any source"""
+    windows = {}
+    for rule in rules:
+        key, _, seconds = rule.partition("=")
+        name, _, source = key.partition("@")
+        windows[(event_name(name), source or None)] = float(seconds)
+    return windows
+
+class TokenBucket:
+    """Allows rate takes a second on average with bursts of up to burst"""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, now=None):
+        """Takes a token if one is available, returns whether it did"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class DebounceWindow:
+    """The event captured for an event type and source and the repeats merged into it"""
+    __slots__ = ("folder_path", "seconds", "started", "last", "last_time", "count")
+
+    def __init__(self, folder_path, seconds, now, event_time):
+        self.folder_path = folder_path
+        self.seconds = seconds
+        self.started = now
+        self.last = now
+        self.last_time = event_time
+        self.count = 1
+
+class StormControl(threading.Thread):
+    """Decides whether each trigger is captured, merged or shed.
+        windows maps (event type name, source) to debounce seconds, a source of None
+        covering that type from any source without a window of its own. Each source
+        gets its own window. rate caps new captures a second (None for no cap), with
+        bursts of up to burst. The thread closes windows as they expire, handing any
+        with repeats to on_close(window), and logs the triggers shed every
+        summary_interval seconds"""
+    def __init__(self, windows=None, rate=None, burst=None, summary_interval=10.0,
+                 on_close=None, sweep_interval=1.0):
+        threading.Thread.__init__(self, name="storm-control", daemon=True)
+        self.windows = {(event_name(name), source) : seconds
+                        for (name, source), seconds in (windows or {}).items()}
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.summary_interval = summary_interval
+        self.on_close = on_close
+        self.sweep_interval = sweep_interval
+        self.captured = 0
+        self.merged = 0
+        self.shed = 0
+        self._open = {}
+        self._closed = []
+        self._shed_since = {}
+        self._last_summary = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def window_for(self, name, source):
+        """Debounce seconds for an event type from a source, 0 if not debounced"""
+        seconds = self.windows.get((name, source))
+        return self.windows.get((name, None), 0.0) if seconds is None else seconds
+
+    def admit(self, event_id, kwargs, folder_path, event_time=None, now=None):
+        """Returns (CAPTURE, window) for a trigger to capture into folder_path, (MERGE,
+            window) with the window of the event it was merged into, or (SHED, None)"""
+        now = time.monotonic() if now is None else now
+        name = event_name(event_id)
+        source = trigger_source(kwargs)
+        with self._lock:
+            window = self._open.get((name, source))
+            if window is not None:
+                if now - window.started < window.seconds:
+                    window.count += 1
+                    window.last = now
+                    window.last_time = event_time
+                    self.merged += 1
+                    return MERGE, window
+                del self._open[(name, source)]
+                self._closed.append(window)
+            if self.bucket is not None and not self.bucket.take(now):
+                self.shed += 1
+                self._shed_since[name] = self._shed_since.get(name, 0) + 1
+                return SHED, None
+            window = DebounceWindow(folder_path, self.window_for(name, source), now, event_time)
+            if window.seconds > 0:
+                self._open[(name, source)] = window
+            self.captured += 1
+            return CAPTURE, window
+
+    def sweep(self, now=None, close_all=False):
+        """Closes expired windows (every window if close_all), passing those with
+            repeats to on_close, and logs the shed summary when it is due"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            closed = self._closed
+            self._closed = []
+            for key, window in list(self._open.items()):
+                if close_all or now - window.started >= window.seconds:
+                    closed.append(self._open.pop(key))
+            shed = {}
+            if close_all or now - self._last_summary >= self.summary_interval:
+                shed, self._shed_since = self._shed_since, {}
+                elapsed = now - self._last_summary
+                self._last_summary = now
+        if shed:
+            en.notify(en.SubscribedEventType.ERROR_EVENT,
+                      logging_level=en.LoggingLevel.WARNING,
+                      error_location=type(self).__name__,
+                      description=f"Shed {sum(shed.values())} captures over the capture "
+                                  f"limit in the last {elapsed:.0f}s: {shed}")
+        for window in closed:
+            if window.count > 1 and self.on_close is not None:
+                self.on_close(window)
+        return closed
+
+    def run(self):
+        while not self._stop_event.wait(self.sweep_interval):
+            self.sweep()
+
+    def quit(self):
+        """Stops sweeping and closes every open window"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.sweep(close_all=True)
+
+    def stats(self):
+        return {"captured" : self.captured,
+                "merged" : self.merged,
+                "shed" : self.shed,
+                "open_windows" : len(self._open)}
@@ -8,14 +8,46 @@ Description:    Runs unit tests on the state machine, event logger,
 """
 
 import os
+import json
+import tempfile
 import unittest
 import random
 import time
+import threading
+import types
 from string import ascii_lowercase
 from security_states import SecurityStateMachine
-from event_logger import EventLogger
-from security_camera import Camera
+from event_logger import EventLogger, EventJournal, AMEND_REACH
+from event_store import SQLiteEventStore
+from security_camera import Camera, CameraManager, ProcessCamera
+from capture_pipeline import CapturePipeline
+from checkpoint_pool import CheckpointPool
+from allowlist import Allowlist, AccessPolicy, save_ids
+from replay import ReplayDriver, read_script
+import benchmarks
+import io
+import datetime
+from frame_buffer import FrameRingBuffer
+from shared_frames import SharedFrameBuffer
+from image_codec import CaptureCodec, EncodeCache
+from capture_store import CaptureStore
+from frame_sources import GeneratedSource, open_source, feed_name
+from metrics import Histogram, CameraStats, render_prometheus, collect
+from display import MosaicDisplay, grid_shape
+from ingest import IngestServer, parse_trigger
+from topology import CameraTopology, CaptureRoute
+from storm_control import StormControl, TokenBucket, parse_windows, CAPTURE, MERGE, SHED
+import socket
+import sqlite3
+import multiprocessing
+from retention import RetentionPolicy, RetentionPruner
+from security_manager import SecurityManager
+import urllib.request
+import cv2 as cv
+from motion_detector import MotionDetector, MotionAnalyser
+import numpy as np
 import event_notifier as en
+import logging_handler
 
 __author__ = "Benjamin Vernon-Bosley"
 __copyright__ = "Livestock Visibility Solutions"
@@ -76,6 +108,108 @@ class StateMachineTests(unittest.TestCase):
                              expected_events,
                              f"Expected {self.events} to match {expected_events}")
 
+class NotifierTests(unittest.TestCase):
+    """Tests the asynchronous subscriber queues of the event notifier"""
+    def setUp(self):
+        self.release = threading.Event()
+        self.received = []
+
+    def slow_subscriber(self, value):
+        """Waits to be released before recording the value received"""
+        self.release.wait(5)
+        self.received.append(value)
+
+    def notify_blocked(self, overflow, count):
+        """Notifies count values to a blocked subscriber with a queue of two, then
+            releases it and returns its statistics"""
+        en.subscribe(en.SubscribedEventType.SECURITY_EVENT, self.slow_subscriber,
+                     asynchronous=True, max_queue=2, overflow=overflow)
+        en.notify(en.SubscribedEventType.SECURITY_EVENT, value=0)
+        while en.subscriber_stats()[en.SubscribedEventType.SECURITY_EVENT][-1]["backlog"]:
+            time.sleep(0.01)
+        for value in range(1, count):
+            en.notify(en.SubscribedEventType.SECURITY_EVENT, value=value)
+        stats = en.subscriber_stats()[en.SubscribedEventType.SECURITY_EVENT][-1]
+        self.release.set()
+        en.unsubscribe(en.SubscribedEventType.SECURITY_EVENT, self.slow_subscriber)
+        return stats
+
+    def test_notify_does_not_wait_for_async_subscriber(self):
+        """The notifying thread returns while the subscriber is still blocked"""
+        stats = self.notify_blocked(en.OverflowPolicy.DROP_NEWEST, 3)
+        self.assertEqual(stats["backlog"], 2)
+        self.assertListEqual(self.received, [0, 1, 2])
+
+    def test_overflow_policies(self):
+        """Full queues drop either the newest or the oldest waiting event"""
+        stats = self.notify_blocked(en.OverflowPolicy.DROP_NEWEST, 5)
+        self.assertEqual(stats["dropped"], 2)
+        self.assertListEqual(self.received, [0, 1, 2])
+        self.release.clear()
+        self.received = []
+        stats = self.notify_blocked(en.OverflowPolicy.DROP_OLDEST, 5)
+        self.assertEqual(stats["dropped"], 2)
+        self.assertListEqual(self.received, [0, 3, 4])
+
+    def test_async_failures_reported(self):
+        """A failing asynchronous subscriber is reported through ERROR_EVENT"""
+        errors = []
+        def failing_subscriber(value):
+            raise ValueError(f"bad value {value}")
+        def error_subscriber(**kwargs):
+            errors.append(kwargs)
+        en.subscribe(en.SubscribedEventType.ERROR_EVENT, error_subscriber)
+        en.subscribe(en.SubscribedEventType.SECURITY_EVENT, failing_subscriber,
+                     asynchronous=True)
+        try:
+            en.notify(en.SubscribedEventType.SECURITY_EVENT, value=7)
+        finally:
+            en.unsubscribe(en.SubscribedEventType.SECURITY_EVENT, failing_subscriber)
+            en.unsubscribe(en.SubscribedEventType.ERROR_EVENT, error_subscriber)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0]["logging_level"], en.LoggingLevel.ERROR)
+        self.assertEqual(errors[0]["error_location"], "QueuedSubscriber")
+        self.assertIn("bad value 7", errors[0]["description"])
+
+class ErrorLoggingTests(unittest.TestCase):
+    """Tests the queued error log collapses repeated messages and writes JSON lines"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.directory.name, "errors.log")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def log_repeats(self, count):
+        """Sends the same camera warning count times followed by a different error"""
+        for _ in range(count):
+            en.notify(en.SubscribedEventType.ERROR_EVENT,
+                      logging_level=en.LoggingLevel.WARNING,
+                      error_location="Camera",
+                      description="Camera 3 Unavailable")
+        en.notify(en.SubscribedEventType.ERROR_EVENT,
+                  logging_level=en.LoggingLevel.ERROR,
+                  error_location="CameraManager",
+                  description="No camera found")
+        logging_handler.logging_shutdown()
+        with open(self.log_path, "r") as openfile:
+            return openfile.read().splitlines()
+
+    def test_repeats_collapse_to_count(self):
+        """Repeated messages are written once and then once more with their count"""
+        logging_handler.logging_init(log_file=self.log_path, suppress_window=60)
+        lines = self.log_repeats(50)
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].endswith("Camera 3 Unavailable at Camera"))
+        self.assertTrue(lines[2].endswith("Camera 3 Unavailable at Camera (repeated 49 times)"))
+
+    def test_json_lines_format(self):
+        """Structured logging writes one JSON object per line with the location"""
+        logging_handler.logging_init(log_file=self.log_path, json_lines=True)
+        records = [json.loads(line) for line in self.log_repeats(1)]
+        self.assertListEqual([record["level"] for record in records], ["WARNING", "ERROR"])
+        self.assertEqual(records[1]["error_location"], "CameraManager")
+
 class EventLoggingTests(unittest.TestCase):
     """Tests for the event logger to correctly write, read and erase events from a file"""
     def setUp(self):
@@ -115,6 +249,1312 @@ class EventLoggingTests(unittest.TestCase):
         read_events = self.logger.retrieve_events()
         self.assertListEqual(random_events, read_events, "Events generated does not match events read")
 
+class EventJournalTests(unittest.TestCase):
+    """Tests the append only event journal, its crash recovery and legacy compaction"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal_path = os.path.join(self.directory.name, "events.jsonl")
+        self.legacy_path = os.path.join(self.directory.name, "events.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def new_logger(self):
+        """Creates a logger writing into the temporary directory"""
+        return EventLogger(EventJournal(journal_path=self.journal_path,
+                                        legacy_path=self.legacy_path))
+
+    def test_append_only(self):
+        """Each logged event adds exactly one line to the journal"""
+        logger = self.new_logger()
+        for index in range(3):
+            logger.log_event(event_type="PERSON_DETECTED", image_path=str(index),
+                             event_time=index)
+        logger.close()
+        with open(self.journal_path, "rb") as openfile:
+            self.assertEqual(len(openfile.readlines()), 3)
+        self.assertEqual(len(self.new_logger().retrieve_events()), 3)
+
+    def test_partial_tail_recovery(self):
+        """A half written final record is dropped and later appends stay readable"""
+        logger = self.new_logger()
+        logger.log_event(event_type="PERSON_ENTER", image_path="a", event_time=1)
+        logger.close()
+        with open(self.journal_path, "ab") as openfile:
+            openfile.write(b'{"event_type":"PERSON_DET')
+        logger = self.new_logger()
+        self.assertEqual(len(logger.events_as_dictionaries()), 1)
+        logger.log_event(event_type="PERSON_DETAINED", image_path="b", event_time=2)
+        logger.close()
+        read_events = self.new_logger().retrieve_events()
+        self.assertListEqual([event["image_path"] for event in read_events], ["a", "b"])
+
+    def test_legacy_migration_and_compaction(self):
+        """An existing events.json seeds the journal and compaction writes it back out"""
+        legacy_event = {"event_type" : "PERSON_ENTER", "image_path" : "a", "event_time" : 1}
+        with open(self.legacy_path, "w") as outfile:
+            json.dump({"events" : [legacy_event]}, outfile)
+        logger = self.new_logger()
+        logger.log_event(event_type="PERSON_DETAINED", image_path="b", event_time=2)
+        logger.compact()
+        with open(self.legacy_path, "r") as openfile:
+            compacted = json.load(openfile)["events"]
+        self.assertListEqual(compacted, logger.events_as_dictionaries())
+        self.assertEqual(len(compacted), 2)
+        logger.close()
+
+    def test_lazy_load(self):
+        """Events logged while the history loads in the background are kept once,
+            after the history, and the history is indexed by time"""
+        logger = self.new_logger()
+        for index in range(5000):
+            logger.log_event(event_type="PERSON_ENTER", image_path=str(index),
+                             event_time=(index * 7919) % 5000)
+        logger.close()
+        logger = EventLogger(EventJournal(journal_path=self.journal_path,
+                                          legacy_path=self.legacy_path), lazy=True)
+        logger.log_event(event_type="PERSON_DETAINED", image_path="new", event_time=6000)
+        self.assertTrue(logger.wait_loaded(timeout=10))
+        events = logger.events_as_dictionaries()
+        self.assertEqual(len(events), 5001)
+        self.assertEqual(events[-1]["image_path"], "new")
+        self.assertListEqual([event["event_time"] for event in logger.query(start=10, end=12)],
+                             [10, 11, 12])
+        logger.close()
+        self.assertEqual(len(self.new_logger().retrieve_events()), 5001)
+
+
+class SQLiteEventStoreTests(unittest.TestCase):
+    """Tests the SQLite event store behind the same logger API"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database_path = os.path.join(self.directory.name, "events.db")
+        self.legacy_path = os.path.join(self.directory.name, "events.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def new_logger(self):
+        return EventLogger(SQLiteEventStore(self.database_path, self.legacy_path))
+
+    def test_failed_commit_raises(self):
+        """Events in a batch that fails to commit raise in log_event and are not indexed"""
+        logger = self.new_logger()
+        store = logger.journal
+        insert = store._insert
+        def fail_once(rows):
+            store._insert = insert
+            raise sqlite3.OperationalError("disk I/O error")
+        store._insert = fail_once
+        with self.assertRaises(sqlite3.OperationalError):
+            logger.log_event(event_type="PERSON_ENTER", image_path="lost", event_time=1.0)
+        logger.log_event(event_type="PERSON_ENTER", image_path="kept", event_time=2.0)
+        self.assertEqual([event["image_path"] for event in logger.events_as_dictionaries()],
+                         ["kept"])
+        self.assertEqual([event["image_path"] for event in store.load()], ["kept"])
+        logger.close()
+
+    def test_round_trip_and_purge(self):
+        """Events and their optional arguments read back as logged, purge empties it"""
+        logger = self.new_logger()
+        logger.log_event(event_type=en.EventTypes.PERSON_ENTER, image_path="a",
+                         event_time="2026-10-17 09:30:00", camera=1)
+        logger.log_event(event_type=en.EventTypes.PERSON_DETAINED, image_path="b", event_time=2)
+        logger.close()
+        logger = self.new_logger()
+        self.assertListEqual(logger.retrieve_events(),
+                             [{"event_type" : "EventTypes.PERSON_ENTER", "image_path" : "a",
+                               "event_time" : "2026-10-17 09:30:00", "camera" : "1"},
+                              {"event_type" : "EventTypes.PERSON_DETAINED", "image_path" : "b",
+                               "event_time" : 2}])
+        self.assertEqual([event["image_path"] for event in logger.journal.query(
+            event_type=en.EventTypes.PERSON_DETAINED)], ["b"])
+        logger.purge_file()
+        self.assertEqual(logger.journal.count(), 0)
+        logger.close()
+
+    def test_concurrent_writes_group_commit(self):
+        """Writes from several threads all land and share transactions"""
+        logger = self.new_logger()
+        def log_events(thread_index):
+            for index in range(200):
+                logger.log_event(event_type=en.EventTypes.PERSON_DETECTED,
+                                 image_path=f"{thread_index}_{index}", event_time=index)
+        threads = [threading.Thread(target=log_events, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = logger.journal.stats()
+        self.assertEqual(stats["events"], 1600)
+        self.assertLess(stats["commits"], 1600)
+        self.assertEqual(len(logger.journal.query(start=100, end=199)), 800)
+        logger.close()
+
+    def test_readers_while_writing(self):
+        """A second connection reads committed events while the store is open"""
+        logger = self.new_logger()
+        logger.log_event(event_type=en.EventTypes.PERSON_ENTER, image_path="a", event_time=1)
+        reader = SQLiteEventStore(self.database_path, self.legacy_path)
+        self.assertEqual(reader.count(), 1)
+        reader.close()
+        logger.close()
+
+    def test_migrates_journal(self):
+        """A new database is seeded from the JSONL journal beside it"""
+        journal_logger = EventLogger(EventJournal(os.path.join(self.directory.name, "events.jsonl"),
+                                                  self.legacy_path))
+        journal_logger.log_event(event_type=en.EventTypes.PERSON_ENTER, image_path="a",
+                                 event_time=1)
+        journal_logger.close()
+        logger = self.new_logger()
+        self.assertEqual(logger.events_as_dictionaries(),
+                         journal_logger.events_as_dictionaries())
+        logger.close()
+
+class EventQueryTests(unittest.TestCase):
+    """Tests the indexed event query API on the event logger"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.logger = EventLogger(EventJournal(
+            journal_path=os.path.join(self.directory.name, "events.jsonl"),
+            legacy_path=os.path.join(self.directory.name, "events.json")))
+        # Log out of time order so the index has to sort them
+        for event_time in [5, 1, 3, 2, 4, 6]:
+            event_type = en.EventTypes.PERSON_DETAINED if event_time % 2 else en.EventTypes.PERSON_ENTER
+            self.logger.log_event(event_type=event_type, image_path=str(event_time),
+                                  event_time=event_time, camera=event_time % 3)
+
+    def tearDown(self):
+        self.logger.close()
+        self.directory.cleanup()
+
+    def times(self, events):
+        """Returns the event times of the queried events"""
+        return [event["event_time"] for event in events]
+
+    def test_query_by_type_newest_first(self):
+        """Type filtered queries come back newest first with limit and offset"""
+        events = self.logger.query(event_type=en.EventTypes.PERSON_DETAINED,
+                                   newest_first=True, limit=2, offset=1)
+        self.assertListEqual(self.times(events), [3, 1])
+        self.assertListEqual(self.times(self.logger.latest(2)), [6, 5])
+
+    def test_query_time_range_and_kwargs(self):
+        """Time ranges are inclusive and extra keyword arguments filter the results"""
+        self.assertListEqual(self.times(self.logger.query(start=2, end=4)), [2, 3, 4])
+        self.assertListEqual(self.times(self.logger.query(camera=0)), [3, 6])
+        self.assertListEqual(self.times(self.logger.query(start=2, image_path="5")), [5])
+
+    def test_limited_query_stops_at_limit(self):
+        """A limited query reads no further back than the events it returns"""
+        read = []
+        class CountingIndex(list):
+            def __getitem__(self, item):
+                read.append(item)
+                return list.__getitem__(self, item)
+        self.logger._time_index = CountingIndex(self.logger._time_index)
+        self.assertListEqual(self.times(self.logger.query(camera=0, newest_first=True,
+                                                          limit=1)), [6])
+        self.assertListEqual(read, [5])
+
+class CapturePipelineTests(unittest.TestCase):
+    """Tests the asynchronous capture pipeline queues, drops and drains its jobs"""
+    def test_drops_when_full_and_drains(self):
+        """A blocked worker fills the queue, extra jobs are dropped and queued ones
+            still finish on shutdown"""
+        release = threading.Event()
+        finished = []
+        pipeline = CapturePipeline(workers=1, max_queue=2)
+        self.assertTrue(pipeline.submit(release.wait))
+        while pipeline.queue_depth():
+            time.sleep(0.01)
+        accepted = [pipeline.submit(lambda index=index: finished.append(index)) for index in range(4)]
+        self.assertListEqual(accepted, [True, True, False, False])
+        self.assertEqual(pipeline.stats()["dropped"], 2)
+        release.set()
+        pipeline.shutdown()
+        self.assertListEqual(finished, [0, 1])
+        self.assertEqual(pipeline.stats()["completed"], 3)
+        self.assertFalse(pipeline.submit(release.wait))
+
+class CheckpointPoolTests(unittest.TestCase):
+    """Tests checkpoint sessions run their own machines and tag their events"""
+    def setUp(self):
+        self.events = []
+        self.events_lock = threading.Lock()
+        en.subscribe(en.SubscribedEventType.SECURITY_EVENT, self.collect_event)
+        self.pool = CheckpointPool(workers=4, allowable_ids=[42])
+
+    def tearDown(self):
+        self.pool.shutdown()
+        en.unsubscribe(en.SubscribedEventType.SECURITY_EVENT, self.collect_event)
+
+    def collect_event(self, event_id, checkpoint=None):
+        """Collects (checkpoint, event id) of every security event"""
+        with self.events_lock:
+            self.events.append((checkpoint, event_id))
+
+    def test_submit_to_session_closed_meanwhile(self):
+        """An action submitted as its session closes goes to a newly opened session"""
+        open_session = self.pool.open_session
+        opened = []
+        def open_then_close(checkpoint_id):
+            session = open_session(checkpoint_id)
+            opened.append(session)
+            if len(opened) == 1:
+                self.pool.close_session(checkpoint_id)
+            return session
+        self.pool.open_session = open_then_close
+        self.pool.submit("gate-1", "walk_up")
+        self.assertTrue(self.pool.drain(timeout=10))
+        self.assertEqual(len(opened), 2)
+        self.assertIs(self.pool.sessions["gate-1"], opened[1])
+        self.assertEqual((opened[0].processed, opened[1].processed), (0, 1))
+        self.assertEqual(self.pool.state("gate-1"), "detected")
+
+    def test_sessions_keep_order_and_tag_events(self):
+        """Interleaved actions at many gates run in order at each gate"""
+        gates = [f"gate-{index}" for index in range(20)]
+        for action, argument in [("walk_up", None), ("open", 42), ("identify", None)]:
+            for gate in gates:
+                self.pool.submit(gate, action, argument)
+        self.assertTrue(self.pool.drain(timeout=10))
+        expected = [en.EventTypes.PERSON_DETECTED,
+                    en.EventTypes.PERSON_ID_ATTEMPT,
+                    en.EventTypes.PERSON_ID_SUCCESS,
+                    en.EventTypes.PERSON_ENTER]
+        for gate in gates:
+            self.assertEqual(self.pool.state(gate), "allowed")
+            self.assertListEqual([event for checkpoint, event in self.events
+                                  if checkpoint == gate], expected)
+        self.assertEqual(self.pool.stats()["processed"], 60)
+
+    def test_closed_session_machine_is_reused(self):
+        """A closed session's machine is reset and handed to the next new session"""
+        self.pool.submit("gate-a", "walk_up")
+        self.pool.submit("gate-a", "open", 7)
+        machine = self.pool.open_session("gate-a").machine
+        self.pool.close_session("gate-a")
+        session = self.pool.open_session("gate-b")
+        self.assertIs(session.machine, machine)
+        self.assertEqual(self.pool.state("gate-b"), "idle")
+        self.assertEqual(machine.current_tries, 0)
+        self.pool.submit("gate-b", "walk_up")
+        self.pool.submit("gate-b", "open", 42)
+        self.pool.submit("gate-b", "bad_action")
+        self.pool.drain(timeout=10)
+        self.assertEqual(self.events[-1], ("gate-b", en.EventTypes.PERSON_DETECTED))
+        self.assertEqual(self.pool.stats()["failed"], 1)
+
+class AllowlistTests(unittest.TestCase):
+    """Tests the allowlist lookups, scopes and reloading"""
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_lookups_from_text_and_mapped_files(self):
+        """Both file formats find the same IDs and reject anything else"""
+        text_path = os.path.join(self.folder.name, "ids.txt")
+        with open(text_path, "w") as outfile:
+            outfile.write("100\n42 55\n42\n")
+        npy_path = os.path.join(self.folder.name, "ids.npy")
+        save_ids(npy_path, [55, 100, 42])
+        for allowlist in (Allowlist(path=text_path), Allowlist(path=npy_path)):
+            self.assertEqual(len(allowlist), 3)
+            self.assertTrue(all(user_id in allowlist for user_id in (42, "55", 100)))
+            self.assertFalse(any(user_id in allowlist for user_id in (0, 43, 101, 2 ** 70, "x")))
+
+    def test_scopes(self):
+        """Scoped lists only apply at their checkpoints and hours"""
+        policy = AccessPolicy([Allowlist([1]),
+                               Allowlist([2], checkpoints=["gate-3"]),
+                               Allowlist([3], hours=("22:00", "06:00"))])
+        night = datetime.datetime(2026, 1, 1, 23, 30)
+        noon = datetime.datetime(2026, 1, 1, 12, 0)
+        self.assertTrue(policy.allows(1, "gate-1", noon))
+        self.assertTrue(policy.allows(2, "gate-3", noon))
+        self.assertFalse(policy.allows(2, "gate-1", noon))
+        self.assertTrue(policy.allows(3, None, night))
+        self.assertFalse(policy.allows(3, None, noon))
+
+    def test_hot_reload(self):
+        """A changed config is picked up, a broken one keeps the current lists"""
+        config_path = os.path.join(self.folder.name, "allowlist.json")
+        save_ids(os.path.join(self.folder.name, "staff.npy"), [42])
+        with open(config_path, "w") as outfile:
+            json.dump([{"path" : "staff.npy"}], outfile)
+        policy = AccessPolicy(config_path=config_path)
+        machine = SecurityStateMachine(allowable_ids=policy, print_actions=False)
+        self.assertIn(42, policy)
+        save_ids(os.path.join(self.folder.name, "visitors.npy"), [7])
+        with open(config_path, "w") as outfile:
+            json.dump([{"path" : "staff.npy"}, {"path" : "visitors.npy"}], outfile)
+        os.utime(config_path, (time.time() + 5, time.time() + 5))
+        self.assertTrue(policy.reload_if_changed())
+        machine.walk_up()
+        machine.open(7)
+        self.assertTrue(machine.id_accepted)
+        with open(config_path, "w") as outfile:
+            json.dump([{"path" : "missing.npy"}], outfile)
+        self.assertFalse(policy.reload())
+        self.assertIn(7, policy)
+
+    def test_corrupt_text_list_keeps_current_ids(self):
+        """A half written text list fails to reload rather than loading fewer IDs"""
+        text_path = os.path.join(self.folder.name, "ids.txt")
+        with open(text_path, "w") as outfile:
+            outfile.write("42 55 100")
+        policy = AccessPolicy([Allowlist(path=text_path)])
+        for corrupt in ("42 5x 100", "42 55 99999999999999999999"):
+            with open(text_path, "w") as outfile:
+                outfile.write(corrupt)
+            with self.assertRaises(ValueError):
+                Allowlist(path=text_path)
+            self.assertFalse(policy.reload())
+            self.assertIn(100, policy)
+
+class ReplayTests(unittest.TestCase):
+    """Tests the headless replay driver against stub cameras"""
+    def test_replay_logs_every_event(self):
+        """A scripted entry at two gates logs each gate's events with stage times"""
+        with tempfile.TemporaryDirectory() as folder:
+            journal_path = os.path.join(folder, "events.jsonl")
+            lines = [json.dumps({"checkpoint" : gate, "action" : action, "arg" : argument,
+                                 "t" : index * 0.001})
+                     for index, (action, argument) in enumerate([("walk_up", None),
+                                                                 ("open", 42),
+                                                                 ("identify", None)])
+                     for gate in ("gate-1", "gate-2")]
+            driver = ReplayDriver(journal_path=journal_path,
+                                  capture_path=os.path.join(folder, "captures"))
+            report = driver.run(read_script(io.StringIO("\n".join(lines + ["not json"]))),
+                                realtime=True, speed=10)
+            self.assertEqual(report["actions"], 6)
+            self.assertEqual(report["events"], 8)
+            self.assertEqual(report["failed_actions"], 0)
+            self.assertLessEqual(report["machine_ms"]["max"], report["total_ms"]["max"])
+            logger = EventLogger(EventJournal(journal_path, os.path.join(folder, "events.json")))
+            self.assertEqual(len(list(logger.query(checkpoint="gate-2"))), 4)
+            logger.close()
+
+class BenchmarkTests(unittest.TestCase):
+    """Tests the benchmark suite runs without hardware and flags regressions"""
+    def test_compare_flags_regressions(self):
+        """Only metrics worse than the threshold in their own direction fail"""
+        baseline = {"metrics" : {"latency" : benchmarks.metric(10.0, "us"),
+                                 "rate" : benchmarks.metric(100.0, "/s", True),
+                                 "retired" : benchmarks.metric(1.0, "us")}}
+        results = {"metrics" : {"latency" : benchmarks.metric(12.5, "us"),
+                                "rate" : benchmarks.metric(85.0, "/s", True),
+                                "new" : benchmarks.metric(1.0, "us")}}
+        self.assertDictEqual(benchmarks.compare(results, baseline, threshold=0.2),
+                             {"latency" : (10.0, 12.5)})
+        self.assertIn("rate", benchmarks.compare(results, baseline, threshold=0.1))
+
+    def test_capture_suite_without_camera(self):
+        """The capture benchmark writes real images from a synthetic video"""
+        results = benchmarks.bench_capture({"small" : (90, 160)},
+                                           {"jpg" : CaptureCodec("jpg")}, captures=2)
+        self.assertGreater(results["capture_jpg_small_ms"]["value"], 0)
+
+class FrameRingBufferTests(unittest.TestCase):
+    """Tests the fixed memory frame ring buffer used for pre and post event frames"""
+    def fill(self, buffer, count):
+        """Writes count frames into the buffer, each frame filled with its index"""
+        for index in range(count):
+            slot = buffer.acquire()
+            frame = np.full((4, 4, 3), index, dtype=np.uint8)
+            if slot is not None:
+                slot[:] = frame
+                frame = slot
+            buffer.commit(frame, float(index))
+
+    def test_memory_budget_and_slot_reuse(self):
+        """The slot count is capped by the memory budget and slots are never reallocated"""
+        buffer = FrameRingBuffer(seconds=10, max_bytes=4 * 48, fps=30)
+        self.fill(buffer, 1)
+        slots = buffer._slots
+        self.fill(buffer, 10)
+        self.assertEqual(buffer.capacity, 4)
+        self.assertIs(buffer._slots, slots)
+        self.assertEqual(buffer.memory_bytes(), 4 * 48)
+        latest = buffer.latest()
+        self.assertEqual((latest.frame[0, 0, 0], latest.timestamp, latest.sequence), (9, 9.0, 11))
+
+    def test_nearest_and_clip_frames(self):
+        """Frames are picked by nearest timestamp and clips come back oldest first"""
+        buffer = FrameRingBuffer(seconds=1, fps=5)
+        self.fill(buffer, 8)
+        nearest = buffer.nearest(5.4)
+        self.assertEqual((nearest.frame[0, 0, 0], nearest.timestamp), (5, 5.0))
+        self.assertListEqual([timestamp for timestamp, _ in buffer.frames(4, 6)], [4.0, 5.0, 6.0])
+        self.assertListEqual(buffer.frames(0, 2), [])
+        self.assertTrue(buffer.wait_until(7, timeout=0))
+        self.assertFalse(buffer.wait_until(8, timeout=0))
+
+    def test_wait_for_frame_handoff(self):
+        """Consumers waiting on the buffer are woken with the next sequenced frame"""
+        buffer = FrameRingBuffer(seconds=1, fps=5)
+        self.assertIsNone(buffer.wait_for_frame(0, timeout=0))
+        writer = threading.Timer(0.05, self.fill, (buffer, 2))
+        writer.start()
+        handoff = buffer.wait_for_frame(0, timeout=1)
+        writer.join()
+        self.assertIsNotNone(handoff)
+        self.assertGreaterEqual(handoff.sequence, 1)
+        self.assertEqual(buffer.wait_for_frame(1, timeout=1).sequence, 2)
+        self.assertIsNone(buffer.wait_for_frame(2, timeout=0))
+
+    def test_camera_frame_is_a_copy(self):
+        """A camera's frame is copied out, so the ring coming around leaves it intact"""
+        manager = CameraManager(["synthetic://cam0?size=8x6"])
+        camera = manager.get_camera("synthetic://cam0?size=8x6")
+        try:
+            camera.buffer = FrameRingBuffer(seconds=1, fps=2)
+            self.assertIsNone(camera.frame)
+            self.fill(camera.buffer, 1)
+            frame = camera.frame
+            self.fill(camera.buffer, 4)
+            self.assertEqual(int(frame.max()), 0)
+            self.assertEqual(int(camera.frame.max()), 3)
+        finally:
+            manager.quit_all()
+
+class MotionDetectionTests(unittest.TestCase):
+    """Tests the motion detector zones and the analyser's security events"""
+    def setUp(self):
+        self.events = []
+        en.subscribe(en.SubscribedEventType.SECURITY_EVENT, self.collect_event)
+        self.still = np.zeros((120, 160, 3), dtype=np.uint8)
+        self.moved = self.still.copy()
+        self.moved[:60, 80:] = 255
+
+    def tearDown(self):
+        en.unsubscribe(en.SubscribedEventType.SECURITY_EVENT, self.collect_event)
+
+    def collect_event(self, event_id, **kwargs):
+        """Called from every security event, collects the event and its arguments"""
+        self.events.append((event_id, kwargs))
+
+    def test_zones_and_cooldown(self):
+        """Only zones covering the movement trigger, and not again while cooling down"""
+        detector = MotionDetector(zones=[(0, 0, 0.5, 1), (0.5, 0, 0.5, 0.5)],
+                                  width=80, cooldown=5)
+        self.assertListEqual(detector.process(detector.reduce(self.still), now=0), [])
+        self.assertListEqual(detector.process(detector.reduce(self.moved), now=1), [1])
+        self.assertListEqual(detector.process(detector.reduce(self.still), now=2), [])
+        self.assertListEqual(detector.process(detector.reduce(self.moved), now=3), [])
+
+    def test_analyser_notifies_person_detected(self):
+        """Movement on a camera's buffered frames notifies PERSON_DETECTED with its name"""
+        buffer = FrameRingBuffer(seconds=1, fps=5)
+        manager = types.SimpleNamespace(cameras={"gate" : types.SimpleNamespace(buffer=buffer)})
+        analyser = MotionAnalyser(manager, width=80)
+        for frame in (self.still, self.still, self.moved):
+            buffer.commit(frame, time.time())
+            analyser.analyse()
+        self.assertListEqual(self.events, [(en.EventTypes.PERSON_DETECTED, {"camera" : "gate"})])
+
+    def test_analyser_reports_failing_camera(self):
+        """A camera whose frames cannot be analysed is reported, the others carry on"""
+        errors = []
+        record_error = lambda **kwargs: errors.append(kwargs)
+        buffer = FrameRingBuffer(seconds=1, fps=5)
+        def broken(function):
+            raise ValueError("closed buffer")
+        manager = types.SimpleNamespace(cameras={
+            "broken" : types.SimpleNamespace(buffer=types.SimpleNamespace(apply_latest=broken)),
+            "gate" : types.SimpleNamespace(buffer=buffer)})
+        analyser = MotionAnalyser(manager, width=80)
+        en.subscribe(en.SubscribedEventType.ERROR_EVENT, record_error)
+        try:
+            for frame in (self.still, self.still, self.moved):
+                buffer.commit(frame, time.time())
+                analyser.analyse()
+        finally:
+            en.unsubscribe(en.SubscribedEventType.ERROR_EVENT, record_error)
+        self.assertListEqual(self.events, [(en.EventTypes.PERSON_DETECTED, {"camera" : "gate"})])
+        self.assertEqual(len(errors), 3)
+        self.assertIn("broken", errors[0]["description"])
+
+class ImageCodecTests(unittest.TestCase):
+    """Tests capture encoding settings and the reuse of encoded frames"""
+    def setUp(self):
+        self.frame = np.zeros((64, 96, 3), dtype=np.uint8)
+        self.frame[16:48, 24:72] = (0, 128, 255)
+
+    def test_formats_and_downscale(self):
+        """Each format decodes back to the frame size, scaled if asked"""
+        for image_format in ("png", "jpeg", "webp"):
+            encoded = CaptureCodec(image_format, quality=80).encode(self.frame)
+            decoded = cv.imdecode(np.frombuffer(encoded, np.uint8), cv.IMREAD_COLOR)
+            self.assertTupleEqual(decoded.shape, self.frame.shape)
+        encoded = CaptureCodec("jpg", scale=0.5).encode(self.frame)
+        decoded = cv.imdecode(np.frombuffer(encoded, np.uint8), cv.IMREAD_COLOR)
+        self.assertTupleEqual(decoded.shape, (32, 48, 3))
+        self.assertRaises(ValueError, CaptureCodec, "gif")
+
+    def test_same_sequence_encoded_once(self):
+        """Concurrent captures of one frame sequence share a single encode"""
+        codec = CaptureCodec("png")
+        cache = EncodeCache(window=60)
+        encodes = []
+        original_encode = codec.encode
+        codec.encode = lambda frame: encodes.append(1) or time.sleep(0.05) or original_encode(frame)
+        results = []
+        workers = [threading.Thread(target=lambda: results.append(
+                       cache.get_or_encode(7, codec, self.frame))) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(len(encodes), 1)
+        self.assertEqual(len(set(results)), 1)
+        cache.get_or_encode(8, codec, self.frame)
+        self.assertEqual((cache.hits, cache.misses), (3, 2))
+
+class CaptureStoreTests(unittest.TestCase):
+    """Tests the deduplicating capture store and its reference counting"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = CaptureStore(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def add_event(self, name, images):
+        """Stores the images as an event folder, returns the folder and blob ids"""
+        folder = os.path.join(self.directory.name, name)
+        os.makedirs(folder)
+        files = {}
+        for image_name, encoded in images.items():
+            blob_id = self.store.put(encoded, ".png")
+            self.store.link(blob_id, os.path.join(folder, image_name))
+            files[os.path.join(folder, image_name)] = blob_id
+        self.store.record_event(folder, files)
+        return folder, files
+
+    def test_identical_images_stored_once(self):
+        """Byte identical captures share one blob and still appear in both folders"""
+        first, first_files = self.add_event("event_1", {"camera-0.png" : b"same", "camera-1.png" : b"new"})
+        second, second_files = self.add_event("event_2", {"camera-0.png" : b"same"})
+        self.assertDictEqual(self.store.stats(), {"blobs_written" : 2, "blobs_reused" : 1})
+        with open(os.path.join(second, "camera-0.png"), "rb") as openfile:
+            self.assertEqual(openfile.read(), b"same")
+        self.assertEqual(self.store.refcount(second_files[os.path.join(second, "camera-0.png")]), 2)
+
+    def test_deleting_events_reclaims_unshared_blobs(self):
+        """Blobs are only removed once no event references them"""
+        first, first_files = self.add_event("event_1", {"camera-0.png" : b"same", "camera-1.png" : b"new"})
+        second, second_files = self.add_event("event_2", {"camera-0.png" : b"same"})
+        self.assertEqual(self.store.delete_event(first), len(b"new"))
+        self.assertFalse(os.path.exists(first))
+        shared = second_files[os.path.join(second, "camera-0.png")]
+        self.assertEqual(self.store.refcount(shared), 1)
+        self.assertEqual(self.store.delete_event(second), len(b"same"))
+        self.assertFalse(os.path.exists(self.store.blob_path(*os.path.splitext(shared))))
+
+    def test_pinned_blobs_survive_pruning(self):
+        """A blob being saved into a new event is kept when the only event recorded
+            with it is deleted, and a released blob nothing references is removed"""
+        first, first_files = self.add_event("event_1", {"camera-0.png" : b"same"})
+        shared = first_files[os.path.join(first, "camera-0.png")]
+        blob_path = self.store.blob_path(*os.path.splitext(shared))
+        self.assertTrue(self.store.pin(shared))
+        self.assertEqual(self.store.put(b"same", ".png"), shared)
+        self.assertEqual(self.store.delete_event(first), 0)
+        self.assertTrue(os.path.exists(blob_path))
+        self.store.release(shared)
+        self.store.record_event(os.path.join(self.directory.name, "event_2"),
+                                {"camera-0.png" : shared})
+        self.assertEqual(self.store.refcount(shared), 1)
+        self.assertEqual(self.store.delete_event(os.path.join(self.directory.name, "event_2")),
+                         len(b"same"))
+        self.assertFalse(self.store.pin(shared))
+        orphan = self.store.put(b"orphan", ".png")
+        self.store.release(orphan)
+        self.assertFalse(os.path.exists(self.store.blob_path(*os.path.splitext(orphan))))
+
+    def test_near_duplicates_only_reused_on_opt_in(self):
+        """A frame with a small change is stored by default and only stands in for
+            the camera's last capture once near_threshold is set"""
+        manager = CameraManager(["synthetic://cam0?size=64x48"])
+        camera = manager.get_camera("synthetic://cam0?size=64x48")
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        changed = frame.copy()
+        changed[:4, :4] = 255
+        try:
+            self.assertNotEqual(camera._store_frame(self.store, frame),
+                                camera._store_frame(self.store, changed))
+            lossy = CaptureStore(os.path.join(self.directory.name, "lossy"), near_threshold=2.0)
+            self.assertEqual(camera._store_frame(lossy, frame),
+                             camera._store_frame(lossy, changed))
+        finally:
+            manager.quit_all()
+
+class SharedFrameTests(unittest.TestCase):
+    """Tests the shared memory frame ring and cameras read in worker processes"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_close_waits_for_reads_in_progress(self):
+        """Closing a buffer mid read lets the read finish, later reads find it empty"""
+        writer = SharedFrameBuffer.create((4, 4, 3), np.uint8, slots=2)
+        reader = SharedFrameBuffer.attach(writer.name, (4, 4, 3), np.uint8, slots=2)
+        writer.commit(np.full((4, 4, 3), 7, dtype=np.uint8), 1.0)
+        reading, closed = threading.Event(), threading.Event()
+        def slow_sum(view):
+            reading.set()
+            closed.wait(5)
+            return int(view.sum())
+        results = []
+        worker = threading.Thread(target=lambda: results.append(reader.apply_latest(slow_sum)))
+        worker.start()
+        self.assertTrue(reading.wait(5))
+        reader.close()
+        closed.set()
+        worker.join()
+        self.assertEqual(results, [(7 * 48, 1)])
+        self.assertIsNone(reader._slots)
+        self.assertIsNone(reader.latest())
+        self.assertEqual(reader.apply_latest(slow_sum), (None, None))
+        self.assertEqual((reader.sequence, reader.frames(0, 10)), (0, []))
+        self.assertIsNone(reader.wait_for_frame(0, timeout=5))
+        writer.close(unlink=True)
+
+    def test_shared_ring_reads_in_place(self):
+        """Committed frames are read back by sequence and a slot being written is skipped"""
+        writer = SharedFrameBuffer.create((4, 4, 3), np.uint8, slots=3)
+        reader = SharedFrameBuffer.attach(writer.name, (4, 4, 3), np.uint8, slots=3)
+        for index in range(4):
+            writer.acquire()[:] = index
+            writer.commit(writer._slots[index % 3], float(index))
+        latest = reader.latest()
+        self.assertEqual((latest.frame[0, 0, 0], latest.timestamp), (3, 3.0))
+        self.assertEqual(reader.apply_latest(lambda view: int(view.sum()))[1], 4)
+        self.assertListEqual([timestamp for timestamp, _ in reader.frames(0, 10)], [1.0, 2.0, 3.0])
+        writer.acquire()
+        self.assertListEqual([timestamp for timestamp, _ in reader.frames(0, 10)], [2.0, 3.0])
+        reader.close()
+        writer.close(unlink=True)
+
+    def test_process_camera_restarts_worker(self):
+        """A worker reading a short video delivers frames, then is restarted when it stops"""
+        video_path = os.path.join(self.directory.name, "feed.avi")
+        writer = cv.VideoWriter(video_path, cv.VideoWriter_fourcc(*"MJPG"), 30, (32, 24))
+        for index in range(30):
+            writer.write(np.full((24, 32, 3), index, dtype=np.uint8))
+        writer.release()
+        manager = CameraManager([video_path], use_processes=True)
+        camera = manager.get_camera(video_path)
+        camera.max_restarts = 1
+        camera.restart_delay = 0
+        camera.start()
+        handoff = camera.wait_for_frame(0, timeout=30)
+        self.assertIsNotNone(handoff)
+        self.assertTupleEqual(handoff.frame.shape, (24, 32, 3))
+        camera.join(timeout=30)
+        self.assertEqual(camera.restarts, 1)
+        self.assertFalse(camera.process.is_alive())
+        manager.quit_all()
+
+    def test_restarted_worker_forgets_encodes(self):
+        """A restarted worker's buffer numbers frames from 1 again, so the encodes and
+            stored captures of the last buffer are forgotten when it is attached"""
+        class PipeCamera(ProcessCamera):
+            def start_worker(self):
+                self._connection, self.sender = multiprocessing.Pipe(duplex=False)
+        camera = PipeCamera("synthetic://cam0?size=4x4")
+        codec = CaptureCodec("png")
+        old_frame = np.zeros((4, 4, 3), dtype=np.uint8)
+        for index in range(2):
+            writer = SharedFrameBuffer.create((4, 4, 3), np.uint8, slots=3)
+            camera.sender.send(("ready", writer.name, (4, 4, 3), "|u1", 3, 30))
+            camera.handle_messages()
+            writer.close()
+            self.assertEqual(len(camera._last_stored), 0)
+            encoded = camera.encode_cache.get_or_encode(1, codec, old_frame + index)
+            decoded = cv.imdecode(np.frombuffer(encoded, np.uint8), cv.IMREAD_COLOR)
+            self.assertTrue(np.array_equal(decoded, old_frame + index))
+            camera._last_stored[codec.key()] = (None, "blob.png")
+        self.assertEqual(camera.encode_cache.misses, 2)
+        camera.release_buffer()
+
+class FrameSourceTests(unittest.TestCase):
+    """Tests the virtual camera sources and cameras built on them"""
+    def test_sources_behave_like_video_capture(self):
+        """Generated, looping video and image folder sources read, grab and loop"""
+        with tempfile.TemporaryDirectory() as folder:
+            generated = GeneratedSource(width=64, height=48, realtime=False)
+            frames = [generated.read()[1].copy() for _ in range(3)]
+            self.assertEqual(frames[0].shape, (48, 64, 3))
+            self.assertFalse(np.array_equal(frames[0], frames[1]))
+            video_path = os.path.join(folder, "yard.avi")
+            writer = cv.VideoWriter(video_path, cv.VideoWriter_fourcc(*"MJPG"), 10, (64, 48))
+            for frame in frames:
+                writer.write(frame)
+                cv.imwrite(os.path.join(folder, f"{len(os.listdir(folder))}.png"), frame)
+            writer.release()
+            for feed in (f"loop://{video_path}?realtime=0", f"images://{folder}?realtime=0"):
+                source = open_source(feed)
+                self.assertTrue(source.isOpened(), feed)
+                results = [source.read() for _ in range(7)]
+                self.assertTrue(all(is_read for is_read, _ in results), feed)
+                self.assertEqual(results[-1][1].shape, (48, 64, 3))
+            self.assertEqual(feed_name(f"loop://{video_path}"), "yard")
+            self.assertEqual(feed_name("synthetic://gate1?size=64x48"), "gate1")
+            self.assertEqual(feed_name(0), "0")
+
+    def test_injected_faults(self):
+        """Dropped frames skip ahead, a failed source stops reading"""
+        source = open_source("synthetic://gate?size=32x24&drop=1&fail_after=3&realtime=0")
+        self.assertTrue(source.grab())
+        self.assertEqual(source.frame_index, 1)
+        self.assertEqual([source.grab(), source.grab(), source.grab()], [True, True, False])
+        self.assertEqual(source.drops, 3)
+        self.assertFalse(source.read()[0])
+
+    def test_manager_captures_synthetic_cameras(self):
+        """A CameraManager of synthetic cameras captures without camera hardware"""
+        feeds = [f"synthetic://cam{index}?size=64x48&fps=50" for index in range(4)]
+        manager = CameraManager(feeds)
+        # Opened in parallel but kept in the order given
+        self.assertListEqual(list(manager.cameras), feeds)
+        self.assertCountEqual(manager.open_seconds, feeds)
+        for camera in manager.cameras.values():
+            camera.start()
+        with tempfile.TemporaryDirectory() as folder:
+            for camera in manager.cameras.values():
+                self.assertIsNotNone(camera.wait_for_frame(timeout=2))
+            event_path = os.path.join(folder, "event")
+            manager.write_snapshot(event_path, manager.snapshot())
+            for index in range(4):
+                self.assertTrue(os.path.exists(event_path + f"\\camera-cam{index}.png"))
+        manager.quit_all()
+
+    def test_synchronised_snapshot(self):
+        """Every camera's frame comes from the one instant, grab mode cameras decode
+            together and the frames are written on the pool"""
+        feeds = [f"synthetic://cam{index}?size=64x48&fps=20" for index in range(4)]
+        manager = CameraManager(feeds, analysis_fps=0, write_workers=4)
+        for camera in manager.cameras.values():
+            camera.start()
+        try:
+            for camera in manager.cameras.values():
+                self.assertIsNotNone(camera.wait_for_frame(timeout=2))
+            time.sleep(0.3)
+            instant = time.time()
+            started = time.monotonic()
+            frames = manager.snapshot(instant, decode_timeout=0.5, fresh_within=0.01)
+            # The decodes are waited on together, not one timeout per camera
+            self.assertLess(time.monotonic() - started, 1.0)
+            for camera_name, frame in frames.items():
+                self.assertIsNotNone(frame, camera_name)
+                buffered = manager.cameras[camera_name].buffer.frames(0, float("inf"))
+                self.assertEqual(frame.timestamp, min((abs(frame_time - instant), frame_time)
+                                                      for frame_time, _ in buffered)[1])
+            frame_times = [frame.timestamp for frame in frames.values()]
+            self.assertEqual(manager.last_snapshot_spread, max(frame_times) - min(frame_times))
+            self.assertEqual(manager.snapshot_spread.count, 1)
+            writers = set()
+            for camera in manager.cameras.values():
+                def write_frame(file_path, frame, store=None, codec=None, camera=camera):
+                    writers.add(threading.current_thread().name)
+                    time.sleep(0.05)
+                    return Camera.write_frame(camera, file_path, frame, store, codec)
+                camera.write_frame = write_frame
+            with tempfile.TemporaryDirectory() as folder:
+                event_path = os.path.join(folder, "event")
+                manager.write_snapshot(event_path, frames)
+                for index in range(4):
+                    self.assertTrue(os.path.exists(event_path + f"\\camera-cam{index}.png"))
+            self.assertGreater(len(writers), 1)
+            self.assertTrue(all(name.startswith("capture-write") for name in writers))
+        finally:
+            manager.quit_all()
+        # Snapshots written after quitting do not start a new pool
+        with tempfile.TemporaryDirectory() as folder:
+            event_path = os.path.join(folder, "late")
+            manager.write_snapshot(event_path, frames)
+            self.assertTrue(os.path.exists(event_path + "\\camera-cam0.png"))
+        self.assertIsNone(manager._write_pool)
+
+class MosaicDisplayTests(unittest.TestCase):
+    """Tests the tiled display is composed without the cameras touching the GUI"""
+    def setUp(self):
+        self.feeds = [f"synthetic://cam{index}?size=128x96&fps=50" for index in range(3)]
+        # Grab only, so frames are only decoded for the display when it asks
+        self.manager = CameraManager(self.feeds, analysis_fps=0)
+        for camera in self.manager.cameras.values():
+            camera.start()
+
+    def tearDown(self):
+        self.manager.quit_all()
+
+    def test_grid_shape(self):
+        self.assertEqual(grid_shape(1), (1, 1))
+        self.assertEqual(grid_shape(3), (2, 2))
+        self.assertEqual(grid_shape(16), (4, 4))
+        self.assertEqual(grid_shape(17), (5, 4))
+
+    def test_shown_cameras_are_tiled(self):
+        """Shown feeds are drawn into their own tile of the preallocated canvas, and
+            tiles are only redrawn for new frames"""
+        display = MosaicDisplay(self.manager, canvas_size=(320, 240))
+        canvas = display.canvas
+        self.assertIsNone(display.compose())
+        self.manager.cameras[self.feeds[0]].is_showing = True
+        self.manager.cameras[self.feeds[2]].is_showing = True
+        deadline = time.monotonic() + 5
+        while display.tiles_drawn < 2 and time.monotonic() < deadline:
+            display.compose()
+            time.sleep(0.02)
+        self.assertIs(display.compose(), canvas)
+        self.assertCountEqual(display.tiles, [self.feeds[0], self.feeds[2]])
+        self.assertEqual(display.tiles[self.feeds[0]].shape, (240, 160, 3))
+        self.assertGreater(int(display.tiles[self.feeds[2]].sum()), 0)
+        # Without a decode being asked for no new frame arrives to draw
+        time.sleep(0.1)
+        camera = self.manager.cameras[self.feeds[0]]
+        display._draw_tile(self.feeds[0], camera)
+        self.assertFalse(display._draw_tile(self.feeds[0], camera))
+
+class IngestTests(unittest.TestCase):
+    """Tests the sensor ingest server, its validation and backpressure"""
+    def test_parse_trigger(self):
+        """Both line forms parse, unknown events and reserved fields are refused"""
+        self.assertEqual(parse_trigger(b"person_detected sensor=gate-1\n"),
+                         (en.EventTypes.PERSON_DETECTED, {"sensor" : "gate-1"}))
+        self.assertEqual(parse_trigger('{"event": "PERSON_ENTER", "zone": 3}'),
+                         (en.EventTypes.PERSON_ENTER, {"zone" : "3"}))
+        for line in ("DOOR_OPENED", "INVALID", "PERSON_ENTER image_path=/etc",
+                     "PERSON_ENTER sensor", '{"sensor": "gate-1"}', '{"event": ',
+                     "PERSON_ENTER repeats=99", '{"event": "PERSON_ENTER", "last_repeat": 0}'):
+            with self.assertRaises(ValueError, msg=line):
+                parse_trigger(line)
+
+    def test_triggers_answered_and_handled(self):
+        """Each line gets an answer and valid triggers reach the handler"""
+        handled = []
+        server = IngestServer(lambda event_id, **fields: handled.append((event_id, fields)),
+                              port=0)
+        server.start()
+        try:
+            with socket.create_connection(("127.0.0.1", server.port), timeout=5) as sensor:
+                sensor.sendall(b"PERSON_DETECTED sensor=a\nNOT_AN_EVENT\n\nPERSON_ENTER\n")
+                answers = sensor.makefile("rb")
+                self.assertEqual([answers.readline() for _ in range(3)],
+                                 [b"ok\n", b"error: Unknown event 'NOT_AN_EVENT'\n", b"ok\n"])
+        finally:
+            server.quit()
+        self.assertEqual(handled, [(en.EventTypes.PERSON_DETECTED, {"sensor" : "a"}),
+                                   (en.EventTypes.PERSON_ENTER, {})])
+        self.assertEqual(server.stats()["rejected"], 1)
+
+    def test_backpressure(self):
+        """Once max_pending triggers are waiting no more are read until one is handled"""
+        release = threading.Event()
+        handled = []
+        def handler(event_id, **fields):
+            release.wait(5)
+            handled.append(event_id)
+        server = IngestServer(handler, port=0, max_pending=2, dispatch_workers=1)
+        server.start()
+        try:
+            with socket.create_connection(("127.0.0.1", server.port), timeout=5) as sensor:
+                sensor.sendall(b"PERSON_ENTER\n" * 5)
+                def read_answers(count):
+                    answers = b""
+                    while answers.count(b"\n") < count:
+                        answers += sensor.recv(64)
+                    return answers
+                self.assertEqual(read_answers(2), b"ok\n" * 2)
+                sensor.settimeout(0.2)
+                with self.assertRaises(socket.timeout):
+                    sensor.recv(64)
+                self.assertEqual(server.stats()["backpressure_waits"], 1)
+                release.set()
+                sensor.settimeout(5)
+                self.assertEqual(read_answers(3), b"ok\n" * 3)
+        finally:
+            release.set()
+            server.quit()
+        self.assertEqual(len(handled), 5)
+
+    def test_parameter_named_fields(self):
+        """Fields named like the parameters of the functions handling a trigger are
+            logged with the event, self is refused"""
+        with tempfile.TemporaryDirectory() as folder:
+            cameras = CameraManager(["synthetic://gate?size=64x48&fps=50"])
+            journal = EventJournal(os.path.join(folder, "events.jsonl"),
+                                   os.path.join(folder, "events.json"))
+            manager = SecurityManager(camera_manager=cameras, interactive=False,
+                                      capture_path=os.path.join(folder, "captures"),
+                                      logger=EventLogger(journal), ingest_port=0)
+            try:
+                with socket.create_connection(("127.0.0.1", manager.ingest_server.port),
+                                              timeout=5) as sensor:
+                    sensor.sendall(b"PERSON_DETECTED self=1\n"
+                                   b"PERSON_DETECTED time=1 frames=2 folder_path=3 route=4 "
+                                   b"kwargs=5\n")
+                    answers = b""
+                    while answers.count(b"\n") < 2:
+                        answers += sensor.recv(256)
+                self.assertEqual(answers, b"error: Field name 'self' is not allowed\nok\n")
+            finally:
+                manager.quit()
+            self.assertEqual(manager.ingest_server.stats()["failed"], 0)
+            events = list(journal.load())
+            self.assertEqual(len(events), 1)
+            self.assertEqual({name : events[0][name] for name in
+                              ("time", "frames", "folder_path", "route", "kwargs")},
+                             {"time" : "1", "frames" : "2", "folder_path" : "3",
+                              "route" : "4", "kwargs" : "5"})
+
+class StormControlTests(unittest.TestCase):
+    """Tests debouncing, load shedding and amending events with their repeats"""
+    def test_repeats_merge_per_source(self):
+        """Repeats from a source inside its window merge, other sources get their own"""
+        closed = []
+        storm = StormControl(parse_windows(["PERSON_DETECTED=5", "PERSON_DETECTED@gate-3=30"]),
+                             on_close=closed.append)
+        detected = en.EventTypes.PERSON_DETECTED
+        self.assertEqual(storm.admit(detected, {"sensor" : "a"}, "a1", now=0)[0], CAPTURE)
+        decision, window = storm.admit(detected, {"sensor" : "a"}, "a2", now=4)
+        self.assertEqual((decision, window.folder_path, window.count), (MERGE, "a1", 2))
+        self.assertEqual(storm.admit(detected, {"sensor" : "b"}, "b1", now=4)[0], CAPTURE)
+        self.assertEqual(storm.admit(detected, {"sensor" : "gate-3"}, "g1", now=0)[0], CAPTURE)
+        self.assertEqual(storm.admit(detected, {"sensor" : "gate-3"}, "g2", now=20)[0], MERGE)
+        self.assertEqual(storm.admit(en.EventTypes.PERSON_ENTER, {}, "e1", now=4)[0], CAPTURE)
+        self.assertEqual(storm.admit(en.EventTypes.PERSON_ENTER, {}, "e2", now=4)[0], CAPTURE)
+        self.assertEqual(storm.admit(detected, {"sensor" : "a"}, "a3", now=6)[0], CAPTURE)
+        storm.sweep(now=10)
+        self.assertEqual([window.folder_path for window in closed], ["a1"])
+        storm.quit()
+        self.assertEqual([window.folder_path for window in closed], ["a1", "g1"])
+        self.assertEqual(storm.stats(), {"captured" : 6, "merged" : 2, "shed" : 0,
+                                         "open_windows" : 0})
+
+    def test_token_bucket_sheds_captures(self):
+        """Captures past the rate are shed once the burst is spent, merges never are"""
+        bucket = TokenBucket(rate=1, burst=2)
+        self.assertEqual([bucket.take(now=bucket.updated) for _ in range(3)],
+                         [True, True, False])
+        storm = StormControl({("PERSON_DETECTED", None) : 60}, rate=1, burst=2)
+        now = storm.bucket.updated
+        decisions = [storm.admit(en.EventTypes.PERSON_ENTER, {"sensor" : index}, index,
+                                 now=now)[0] for index in range(3)]
+        self.assertEqual(decisions, [CAPTURE, CAPTURE, SHED])
+        self.assertEqual(storm.admit(en.EventTypes.PERSON_ENTER, {}, "x", now=now + 1)[0],
+                         CAPTURE)
+        self.assertEqual(storm.admit(en.EventTypes.PERSON_DETECTED, {}, "y", now=now + 1)[0],
+                         SHED)
+        self.assertEqual(storm.stats()["shed"], 2)
+
+    def test_amendments_persist(self):
+        """Amended fields are kept by the journal and the SQLite store, and fields for
+            an event not yet logged are applied when it is"""
+        with tempfile.TemporaryDirectory() as folder:
+            legacy_path = os.path.join(folder, "events.json")
+            for store in (EventJournal(os.path.join(folder, "events.jsonl"), legacy_path),
+                          SQLiteEventStore(os.path.join(folder, "events.db"), legacy_path)):
+                logger = EventLogger(store)
+                logger.log_event(event_type="PERSON_DETECTED", image_path="one", event_time=1.0)
+                logger.log_event(event_type="PERSON_ENTER", image_path="two", event_time=2.0)
+                self.assertTrue(logger.amend_event("one", persist=False, repeats=2))
+                self.assertTrue(logger.amend_event("one", repeats=3))
+                self.assertFalse(logger.amend_event("three", repeats=4))
+                logger.log_event(event_type="PERSON_ENTER", image_path="three", event_time=3.0)
+                self.assertEqual(logger.events_as_dictionaries()[0]["repeats"], "3")
+                logger.close()
+                reloaded = EventLogger(store)
+                self.assertEqual([event.get("repeats") for event
+                                  in reloaded.events_as_dictionaries()], ["3", None, "4"])
+                reloaded.prune(lambda event_dict: event_dict["image_path"] != "one")
+                reloaded.close()
+                self.assertEqual([event["image_path"] for event in store.load()],
+                                 ["two", "three"])
+                store.close()
+
+    def test_far_amendments_reloaded(self):
+        """An amendment written many chunks after its event is applied on reload, as
+            far back as amend_event reaches in memory"""
+        with tempfile.TemporaryDirectory() as folder:
+            journal = EventJournal(os.path.join(folder, "events.jsonl"),
+                                   os.path.join(folder, "events.json"))
+            journal.read_chunk = 256
+            logger = EventLogger(journal)
+            for index in range(AMEND_REACH + 1):
+                logger.log_event(event_type="PERSON_DETECTED", image_path=str(index),
+                                 event_time=float(index))
+            self.assertTrue(logger.amend_event("1", repeats=5))
+            self.assertFalse(logger.amend_event("0", repeats=6))
+            logger.close()
+            reloaded = EventLogger(journal)
+            amended = {event["image_path"] : event.get("repeats")
+                       for event in reloaded.events_as_dictionaries()}
+            self.assertEqual((amended["0"], amended["1"]), (None, "5"))
+            self.assertEqual(len(amended), AMEND_REACH + 1)
+            reloaded.close()
+
+    def test_manager_merges_repeats(self):
+        """A chattering sensor gets one capture, its event counting the repeats"""
+        with tempfile.TemporaryDirectory() as folder:
+            cameras = CameraManager(["synthetic://gate?size=64x48&fps=50"])
+            journal = EventJournal(os.path.join(folder, "events.jsonl"),
+                                   os.path.join(folder, "events.json"))
+            manager = SecurityManager(camera_manager=cameras, interactive=False,
+                                      capture_path=os.path.join(folder, "captures"),
+                                      logger=EventLogger(journal),
+                                      storm_control=StormControl(
+                                          {("PERSON_DETECTED", None) : 60}))
+            try:
+                self.assertIsNotNone(cameras.cameras["synthetic://gate?size=64x48&fps=50"]
+                                     .wait_for_frame(timeout=2))
+                for _ in range(5):
+                    manager.trigger_event(en.EventTypes.PERSON_DETECTED, sensor="gate-1")
+            finally:
+                manager.quit()
+            events = list(journal.load())
+            self.assertEqual(len(events), 1)
+            self.assertEqual(events[0]["repeats"], "5")
+            self.assertTrue(os.path.isdir(events[0]["image_path"]))
+            self.assertEqual(manager.storm_control.stats()["merged"], 4)
+
+class TopologyTests(unittest.TestCase):
+    """Tests events only capture the cameras mapped to their source"""
+    def test_routes_from_config(self):
+        """Sources route to their cameras and codec, anything else to the default"""
+        with tempfile.TemporaryDirectory() as folder:
+            config_path = os.path.join(folder, "topology.json")
+            with open(config_path, "w") as outfile:
+                json.dump({"default" : {"cameras" : ["yard"]},
+                           "sources" : {"gate-1" : {"cameras" : ["gate-in", 2], "format" : "jpg",
+                                                    "quality" : 80, "max_width" : 640},
+                                        "dock" : {"cameras" : ["dock"]}}}, outfile)
+            topology = CameraTopology(config_path=config_path)
+        gate = topology.route_for({"checkpoint" : "gate-1"})
+        self.assertEqual(gate.cameras, ("gate-in", "2"))
+        self.assertEqual(gate.codec.key(), ("jpg", 80, 3, 1.0, 640))
+        self.assertIs(topology.route_for({"sensor" : "dock", "checkpoint" : "gate-1"}),
+                      topology.routes["dock"])
+        self.assertIsNone(topology.route_for({"sensor" : "dock"}).codec)
+        self.assertEqual(topology.route_for({"sensor" : "fence"}).cameras, ("yard",))
+        # Cameras are known by their key (the feed) or their feed name
+        camera_manager = types.SimpleNamespace(cameras={
+            "0" : types.SimpleNamespace(feed_name="0"),
+            "synthetic://yard?size=64x48" : types.SimpleNamespace(feed_name="yard"),
+            "rtsp://10.0.0.5/gate-in" : types.SimpleNamespace(feed_name="gate-in")})
+        self.assertEqual(topology.validate(camera_manager), ["2", "dock"])
+        self.assertIsNone(CameraTopology().route_for({}).cameras)
+
+    def test_manager_captures_mapped_cameras(self):
+        """A gate's events capture its cameras, named by feed name, with its codec. Other
+            sources, and a source whose cameras are all unknown, capture the default"""
+        feeds = [f"synthetic://cam{index}?size=64x48&fps=50" for index in range(3)]
+        with tempfile.TemporaryDirectory() as folder:
+            cameras = CameraManager(feeds)
+            journal = EventJournal(os.path.join(folder, "events.jsonl"),
+                                   os.path.join(folder, "events.json"))
+            topology = CameraTopology({"gate-1" : CaptureRoute(["cam0"],
+                                                               CaptureCodec("jpg", max_width=32)),
+                                       "dock" : CaptureRoute(["dock-cam"])},
+                                      default=CaptureRoute(["cam1", feeds[2]]))
+            manager = SecurityManager(camera_manager=cameras, interactive=False,
+                                      capture_path=os.path.join(folder, "captures"),
+                                      logger=EventLogger(journal), topology=topology)
+            try:
+                for camera in cameras.cameras.values():
+                    self.assertIsNotNone(camera.wait_for_frame(timeout=2))
+                manager.trigger_event(en.EventTypes.PERSON_ENTER, checkpoint="gate-1")
+                manager.trigger_event(en.EventTypes.PERSON_DETECTED, sensor="fence")
+                manager.trigger_event(en.EventTypes.PERSON_ID_ATTEMPT, sensor="dock")
+            finally:
+                manager.quit()
+            gate_event, fence_event, dock_event = [event["image_path"]
+                                                   for event in journal.load()]
+            gate_image = gate_event + "\\camera-cam0.jpg"
+            self.assertEqual(cv.imread(gate_image).shape, (24, 32, 3))
+            self.assertFalse(os.path.exists(gate_event + "\\camera-cam1.png"))
+            for event_path in (fence_event, dock_event):
+                self.assertFalse(os.path.exists(event_path + "\\camera-cam0.png"))
+                for index in (1, 2):
+                    self.assertTrue(os.path.exists(event_path + f"\\camera-cam{index}.png"))
+        self.assertIsNone(CameraTopology(default=CaptureRoute(["gone"])).route_for(
+            {}, cameras).cameras)
+
+class MetricsTests(unittest.TestCase):
+    """Tests the runtime metrics and their Prometheus endpoint"""
+    def test_histogram_quantiles(self):
+        """Quantiles are estimated as the upper bound of their bucket"""
+        histogram = Histogram(buckets=(0.01, 0.1, 1.0))
+        for value in [0.005] * 90 + [0.05] * 9 + [5.0]:
+            histogram.observe(value)
+        self.assertEqual(histogram.quantile(0.5), 0.01)
+        self.assertEqual(histogram.quantile(0.95), 0.1)
+        self.assertEqual(histogram.quantile(1.0), float("inf"))
+        self.assertEqual(histogram.cumulative()[-1], (float("inf"), 100))
+
+    def test_prometheus_text_format(self):
+        """Label values are escaped and every histogram ends with a +Inf bucket"""
+        stats = CameraStats()
+        stats.record_read(0.0, 0.02)
+        stage = Histogram(buckets=(0.01, 0.1))
+        stage.observe(5.0)
+        manager = types.SimpleNamespace(
+            camera_manager=types.SimpleNamespace(
+                cameras={'C:\\feeds\\"gate".avi' : types.SimpleNamespace(stats=stats)},
+                snapshot_spread=Histogram(buckets=(0.01,))),
+            event_metrics=types.SimpleNamespace(stages={"total" : stage}),
+            capture_pipeline=types.SimpleNamespace(stats=lambda: {"submitted" : 1, "queued" : 0}))
+        lines = render_prometheus(manager).splitlines()
+        self.assertIn('lvs_camera_reads_total{camera="C:\\\\feeds\\\\\\"gate\\".avi"} 1', lines)
+        self.assertIn('lvs_camera_read_seconds_bucket{camera="C:\\\\feeds\\\\\\"gate\\".avi",'
+                      'le="+Inf"} 1', lines)
+        self.assertIn('lvs_event_stage_seconds_bucket{stage="total",le="0.1"} 0', lines)
+        self.assertIn('lvs_event_stage_seconds_bucket{stage="total",le="+Inf"} 1', lines)
+        self.assertIn('lvs_event_stage_seconds_count{stage="total"} 1', lines)
+        self.assertIn('lvs_snapshot_spread_seconds_bucket{le="+Inf"} 0', lines)
+        self.assertIn("# TYPE lvs_capture_pipeline_submitted_total counter", lines)
+        self.assertIn("lvs_capture_pipeline_queued 0", lines)
+
+    def test_manager_metrics_endpoint(self):
+        """Camera reads and event stages show up in the stats and at /metrics"""
+        with tempfile.TemporaryDirectory() as folder:
+            cameras = CameraManager(["synthetic://yard?size=64x48&fps=50"])
+            manager = SecurityManager(camera_manager=cameras, interactive=False,
+                                      capture_path=os.path.join(folder, "captures"),
+                                      logger=EventLogger(EventJournal(
+                                          os.path.join(folder, "events.jsonl"),
+                                          os.path.join(folder, "events.json"))),
+                                      metrics_port=0)
+            try:
+                self.assertIsNotNone(cameras.cameras["synthetic://yard?size=64x48&fps=50"]
+                                     .wait_for_frame(timeout=2))
+                en.notify(en.SubscribedEventType.SECURITY_EVENT,
+                          event_id=en.EventTypes.PERSON_DETECTED)
+                deadline = time.monotonic() + 5
+                while (manager.event_metrics.stages["total"].count == 0 and
+                       time.monotonic() < deadline):
+                    time.sleep(0.01)
+                url = f"http://127.0.0.1:{manager.metrics_server.port}/metrics"
+                with urllib.request.urlopen(url, timeout=5) as response:
+                    text = response.read().decode("utf-8")
+            finally:
+                manager.quit()
+            self.assertIn('lvs_camera_reads_total{camera="synthetic://yard?size=64x48&fps=50"}', text)
+            self.assertIn('lvs_event_stage_seconds_count{stage="total"} 1', text)
+            self.assertIn("lvs_subscriber_delivered_total", text)
+            startup = collect(manager)["startup"]
+            self.assertIsNotNone(startup["ready_ms"])
+            self.assertIn("camera_open:synthetic://yard?size=64x48&fps=50", startup["phases_ms"])
+            self.assertGreater(manager.camera_manager.cameras[
+                "synthetic://yard?size=64x48&fps=50"].stats.frames, 0)
+
+class RetentionTests(unittest.TestCase):
+    """Tests retention rules and the background pruning of events and captures"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.capture_root = os.path.join(self.directory.name, "captures")
+        self.logger = EventLogger(EventJournal(os.path.join(self.directory.name, "events.jsonl"),
+                                               os.path.join(self.directory.name, "events.json")))
+        self.now = time.time()
+
+    def tearDown(self):
+        self.logger.close()
+        self.directory.cleanup()
+
+    def add_event(self, event_type, days_old, size=100):
+        """Logs an event with a capture folder holding size bytes"""
+        index = len(self.logger.events_as_dictionaries())
+        folder = os.path.join(self.capture_root, f"event_{index}")
+        os.makedirs(folder)
+        with open(os.path.join(folder, "camera-0.png"), "wb") as outfile:
+            outfile.write(b"x" * size)
+        self.logger.log_event(event_type=event_type, image_path=folder,
+                              event_time=self.now - days_old * 86400)
+        return folder
+
+    def test_per_type_rules_override_max_age(self):
+        """Detentions outlive the default age, ID attempts are dropped sooner"""
+        policy = RetentionPolicy(max_age_days=30, rules={"PERSON_DETAINED" : 90,
+                                                         en.EventTypes.PERSON_ID_ATTEMPT : 7})
+        detained = self.add_event(en.EventTypes.PERSON_DETAINED, 60)
+        attempt = self.add_event(en.EventTypes.PERSON_ID_ATTEMPT, 10)
+        detected = self.add_event(en.EventTypes.PERSON_DETECTED, 40)
+        recent = self.add_event(en.EventTypes.PERSON_DETECTED, 1)
+        expired = policy.expired(self.logger.events_as_dictionaries(), self.now)
+        self.assertCountEqual([event["image_path"] for event in expired], [attempt, detected])
+
+    def test_byte_budget_expires_oldest(self):
+        """Events are expired oldest first until the captures fit the budget"""
+        folders = [self.add_event(en.EventTypes.PERSON_DETECTED, days) for days in (3, 2, 1, 0)]
+        expired = RetentionPolicy(max_bytes=250).expired(self.logger.events_as_dictionaries(),
+                                                         self.now)
+        self.assertEqual([event["image_path"] for event in expired], folders[:2])
+
+    def test_pruner_removes_events_and_folders(self):
+        """Expired folders are deleted and the events pruned from memory and journal,
+            events logged during the pass are kept"""
+        old = self.add_event(en.EventTypes.PERSON_ID_ATTEMPT, 10)
+        kept = self.add_event(en.EventTypes.PERSON_ID_ATTEMPT, 1)
+        outside = os.path.join(self.directory.name, "not_a_capture")
+        # Shares the capture root's name as a prefix but is not inside it
+        sibling = self.capture_root + "_old"
+        for folder in (outside, sibling):
+            os.makedirs(folder)
+            self.logger.log_event(event_type=en.EventTypes.PERSON_ID_ATTEMPT, image_path=folder,
+                                  event_time=self.now - 20 * 86400)
+        pruner = RetentionPruner(self.logger, RetentionPolicy(max_age_days=7),
+                                 capture_root=self.capture_root, pause=0)
+        self.assertDictEqual(pruner.prune_once(self.now), {"events" : 3, "folders" : 1})
+        self.logger.log_event(event_type=en.EventTypes.PERSON_ENTER, image_path=kept,
+                              event_time=self.now)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(kept))
+        self.assertTrue(os.path.exists(outside))
+        self.assertTrue(os.path.exists(sibling))
+        self.assertTrue(pruner._is_removable(self.capture_root + "\\PERSON_ENTER_1"))
+        self.assertFalse(pruner._is_removable(self.capture_root))
+        self.assertFalse(pruner._is_removable(self.capture_root + "2\\PERSON_ENTER_1"))
+        self.assertEqual(pruner.stats()["bytes_removed"], 100)
+        self.assertEqual(len(list(self.logger.query(event_type=en.EventTypes.PERSON_ID_ATTEMPT))), 1)
+        self.logger.close()
+        reloaded = EventLogger(self.logger.journal)
+        self.assertCountEqual([event["image_path"] for event in reloaded.events_as_dictionaries()],
+                              [kept, kept])
+
+    def test_prune_keeps_events_logged_concurrently(self):
+        """log_event carries on while the log is pruned and nothing new is lost"""
+        for index in range(2000):
+            self.logger.log_event(event_type=en.EventTypes.PERSON_DETECTED,
+                                  image_path=f"old_{index}", event_time=index)
+        stop = threading.Event()
+        logged = []
+        def log_more():
+            while not stop.is_set():
+                self.logger.log_event(event_type=en.EventTypes.PERSON_ENTER,
+                                      image_path=f"new_{len(logged)}", event_time=self.now)
+                logged.append(1)
+        writer = threading.Thread(target=log_more)
+        writer.start()
+        try:
+            removed = self.logger.prune(lambda event: not event["image_path"].startswith("old_"),
+                                        pause=0.0001)
+        finally:
+            stop.set()
+            writer.join()
+        self.assertEqual(len(removed), 2000)
+        self.assertEqual(len(self.logger.events_as_dictionaries()), len(logged))
+        self.logger.close()
+        self.assertEqual(len(EventLogger(self.logger.journal).events_as_dictionaries()),
+                         len(logged))
 
 class CameraTests(unittest.TestCase):
     """Tests the camera functionality of the security system"""
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+File:             topology.py
+Date:             17/10/2026
+Description:      Which cameras each security event captures.
+                  A site config maps checkpoints, sensors and cameras to the cameras that
+                  cover them, each mapping optionally with its own capture codec and
+                  resolution, so an event only captures the cameras that can see where it
+                  came from. Events from a source without a mapping capture the default
+                  cameras, every camera unless the config sets them.
+                  eg: {"default": {"cameras": ["yard"]},
+                       "sources": {"gate-1": {"cameras": ["gate-1-in", "gate-1-out"],
+                                              "format": "jpg", "quality": 80,
+                                              "max_width": 1280}}}
+"""
+
+import json
+import event_notifier as en
+from image_codec import CaptureCodec
+from storm_control import SOURCE_FIELDS
+
+__author__ = "Benjamin Vernon-Bosley"
+__copyright__ = "Livestock Visibility Solutions"
+
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Benjamin Vernon-Bosley"
+__email__ = "ben.vernon.bosley@gmail.com"
+__status__ = "Prototype"
+
+ALL_CAMERAS = None
+# Mapping settings passed to CaptureCodec, format is its image_format
+CODEC_FIELDS = ("format", "quality", "png_compression", "scale", "max_width")
+
+class CaptureRoute:
+    """The cameras an event captures by key or feed name, None for every camera, and the
+        codec to save them with, None for each camera's own"""
+    def __init__(self, cameras=None, codec=None):
+        self.cameras = (ALL_CAMERAS if cameras is None
+                        else tuple(str(camera) for camera in cameras))
+        self.codec = codec
+
+    @classmethod
+    def from_config(cls, entry):
+        """A route from a config mapping of "cameras" and any CODEC_FIELDS"""
+        codec = None
+        if any(field in entry for field in CODEC_FIELDS):
+            settings = {field : entry[field] for field in CODEC_FIELDS[1:] if field in entry}
+            codec = CaptureCodec(entry.get("format", "png"), **settings)
+        return cls(entry.get("cameras"), codec)
+
+class CameraTopology:
+    """Routes events to cameras by their source. routes maps a checkpoint, sensor or
+        camera name to its CaptureRoute, the first of the event's SOURCE_FIELDS with a
+        route is used and default covers the rest. config_path loads both from JSON"""
+    def __init__(self, routes=None, default=None, config_path=None):
+        self.routes = dict(routes) if routes else {}
+        self.default = default if default else CaptureRoute()
+        self.config_path = config_path
+        if config_path:
+            self.routes, self.default = self._load_config()
+
+    def _load_config(self):
+        """Reads the routes and default of a JSON config"""
+        with open(self.config_path, "r") as openfile:
+            config = json.load(openfile)
+        routes = {str(source) : CaptureRoute.from_config(entry)
+                  for source, entry in config.get("sources", {}).items()}
+        return routes, CaptureRoute.from_config(config.get("default", {}))
+
+    def route_for(self, kwargs, camera_manager=None):
+        """The route of an event from its trigger arguments. Given the CameraManager, a
+            route naming none of its cameras falls back to the default, and a default
+            naming none of them to every camera"""
+        route = self.default
+        for field in SOURCE_FIELDS:
+            if kwargs.get(field) is None:
+                continue
+            source_route = self.routes.get(str(kwargs[field]))
+            if source_route is not None:
+                route = source_route
+                break
+        if camera_manager is None:
+            return route
+        for candidate in (route, self.default):
+            if (candidate.cameras is ALL_CAMERAS or
+                    camera_manager.resolve_cameras(candidate.cameras)):
+                return candidate
+        return CaptureRoute(ALL_CAMERAS, route.codec)
+
+    def validate(self, camera_manager):
+        """Reports mapped cameras matching no camera of the CameraManager by key or
+            feed name, and routes left with none, returns the unknown names"""
+        known = {name for key, camera in camera_manager.cameras.items()
+                 for name in (key, camera.feed_name)}
+        missing = sorted({camera for route in (self.default, *self.routes.values())
+                          for camera in (route.cameras or ()) if camera not in known})
+        empty = sorted(source for source, route in self.routes.items()
+                       if route.cameras is not ALL_CAMERAS and
+                       not any(camera in known for camera in route.cameras))
+        if missing:
+            en.notify(en.SubscribedEventType.ERROR_EVENT,
+                      logging_level=en.LoggingLevel.WARNING,
+                      error_location=type(self).__name__,
+                      description=f"Topology maps unknown cameras, they will not be "
+                                  f"captured: {missing}")
+        if empty:
+            en.notify(en.SubscribedEventType.ERROR_EVENT,
+                      logging_level=en.LoggingLevel.WARNING,
+                      error_location=type(self).__name__,
+                      description=f"Topology sources {empty} have no known cameras, their "
+                                  f"events capture the default cameras")
+        return missing
+
+    def stats(self):
+        """The number of routes and cameras each source captures, None for all"""
+        return {"default" : None if self.default.cameras is None else len(self.default.cameras),
+                "sources" : {source : None if route.cameras is None else len(route.cameras)
+                             for source, route in self.routes.items()}}